@@ -1,10 +1,13 @@
 from dotenv import load_dotenv
 load_dotenv()
 
-from sqlalchemy import text
+from sqlalchemy import text, event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
 import os
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
 
 DATABASE_URL = os.getenv(
     "DATABASE_URL",
@@ -22,11 +25,79 @@ AsyncSessionLocal = sessionmaker(
 )
 
 Base = declarative_base()
+logger = logging.getLogger(__name__)
+
+# broadcast_messages.mobile_no was added to a table that already had rows. init_db
+# flags the column with a comment when it creates it; backfill_mobile_no() fills the
+# old rows in keyset batches and removes the flag, so later boots don't scan the table.
+MOBILE_NO_BACKFILL_BATCH = int(os.getenv("MOBILE_NO_BACKFILL_BATCH", "5000"))
+MOBILE_NO_BACKFILL_PENDING = "mobile_no backfill pending"
+
+MOBILE_NO_COLUMN_SQL = text("""
+    SELECT 1 FROM information_schema.columns
+    WHERE table_schema = current_schema() AND table_name = 'broadcast_messages' AND column_name = 'mobile_no'
+""")
+
+MOBILE_NO_BACKFILL_FLAG_SQL = text("""
+    SELECT col_description('broadcast_messages'::regclass, attnum) FROM pg_attribute
+    WHERE attrelid = 'broadcast_messages'::regclass AND attname = 'mobile_no'
+""")
+
+MOBILE_NO_BACKFILL_SQL = text("""
+    WITH batch AS (
+        SELECT id FROM broadcast_messages WHERE id > :last ORDER BY id LIMIT :limit
+    ), filled AS (
+        UPDATE broadcast_messages m SET mobile_no = m.payload->>'mobileNo'
+        FROM batch
+        WHERE m.id = batch.id AND m.mobile_no IS NULL AND m.payload->>'mobileNo' IS NOT NULL
+        RETURNING 1
+    )
+    SELECT (SELECT max(id) FROM batch) AS last, (SELECT count(*) FROM filled) AS filled
+""")
+
+# Round-trip accounting: count_queries() counts every statement the current task sends
+_query_counter = ContextVar("query_counter", default=None)
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    counter = _query_counter.get()
+    if counter is not None:
+        counter["queries"] += 1
+
+@contextmanager
+def count_queries():
+    """with count_queries() as counter: ...; counter["queries"] is the number of statements executed."""
+    counter = {"queries": 0}
+    token = _query_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _query_counter.reset(token)
 
 async def get_db():
     async with AsyncSessionLocal() as session:
         yield session
 
+async def keyset_chunks(query, key, chunk_size=1000, scalars=False):
+    """
+    Walks a large result in `key` order, chunk_size rows at a time, each chunk read in
+    its own short session. Nothing outlives a chunk, so memory stays bounded however
+    many rows match. `query` must not be ordered or limited; `key` must be unique.
+    Yields lists of rows (ORM objects when scalars=True).
+    """
+    last = None
+    while True:
+        chunk_query = query if last is None else query.where(key > last)
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(chunk_query.order_by(key).limit(chunk_size))
+            rows = result.scalars().all() if scalars else result.all()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        last = getattr(rows[-1], key.key)
+
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
@@ -36,4 +107,53 @@ async def init_db():
         await conn.execute(text("ALTER TABLE unanswered_questions ADD COLUMN IF NOT EXISTS status VARCHAR DEFAULT 'pending';"))
         await conn.execute(text("ALTER TABLE unanswered_questions ADD COLUMN IF NOT EXISTS answer JSON DEFAULT NULL;"))
         await conn.execute(text("ALTER TABLE unanswered_questions ADD COLUMN IF NOT EXISTS when_answered TIMESTAMP WITH TIME ZONE DEFAULT NULL;"))
+        await conn.execute(text("ALTER TABLE messages ADD COLUMN IF NOT EXISTS media_id VARCHAR DEFAULT NULL;"))
+        await conn.execute(text("ALTER TABLE messages ADD COLUMN IF NOT EXISTS media_status VARCHAR DEFAULT NULL;"))
+        await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_media_status ON messages (media_status);"))
+        await conn.execute(text("ALTER TABLE messages ADD COLUMN IF NOT EXISTS media_claimed_at TIMESTAMP WITH TIME ZONE DEFAULT NULL;"))
+        await conn.execute(text("ALTER TABLE messages ADD COLUMN IF NOT EXISTS media_attempts INTEGER DEFAULT 0;"))
+        if not await conn.scalar(MOBILE_NO_COLUMN_SQL):
+            # Existing rows are filled in by backfill_mobile_no() once, flagged by this comment
+            await conn.execute(text("ALTER TABLE broadcast_messages ADD COLUMN IF NOT EXISTS mobile_no VARCHAR DEFAULT NULL;"))
+            await conn.execute(text(f"COMMENT ON COLUMN broadcast_messages.mobile_no IS '{MOBILE_NO_BACKFILL_PENDING}';"))
+        await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_broadcast_messages_recipient ON broadcast_messages (client_id, mobile_no, added_to_chat);"))
+        await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_broadcast_messages_broadcast ON broadcast_messages (broadcast_id, id);"))
+        await conn.execute(text("ALTER TABLE broadcast_messages ADD COLUMN IF NOT EXISTS lease_owner VARCHAR DEFAULT NULL;"))
+        await conn.execute(text("ALTER TABLE broadcast_messages ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP WITH TIME ZONE DEFAULT NULL;"))
+        await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_broadcast_messages_pending ON broadcast_messages (broadcast_id, id) WHERE status = 'pending';"))
+        await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_clients_phone_number_id ON clients (phone_number_id);"))
+        await conn.execute(text("ALTER TABLE templates ADD COLUMN IF NOT EXISTS header_format VARCHAR DEFAULT NULL;"))
+        await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_templates_client_status ON templates (client_id, status, header_format);"))
+        await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_templates_client_category ON templates (client_id, category, language);"))
+        await conn.execute(text("ALTER TABLE clients ADD COLUMN IF NOT EXISTS broadcast_concurrency INTEGER DEFAULT NULL;"))
+        await conn.execute(text("ALTER TABLE webhook_event_dedup ADD COLUMN IF NOT EXISTS state VARCHAR NOT NULL DEFAULT 'done';"))
+        await conn.execute(text("ALTER TABLE webhook_event_dedup ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP WITH TIME ZONE DEFAULT NULL;"))
+        try:
+            # Fails while duplicate contacts exist; bulk resolution then falls back to re-reading conflicts
+            async with conn.begin_nested():
+                await conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ux_contacts_client_phone ON contacts (client_id, phone_number);"))
+        except Exception as e:
+            logger.warning(f"⚠️ Could not create ux_contacts_client_phone (duplicate contacts?): {e}")
+    await backfill_mobile_no()
 
+async def backfill_mobile_no():
+    """
+    Copies payload->>'mobileNo' into broadcast_messages.mobile_no for the rows that
+    predate the column, MOBILE_NO_BACKFILL_BATCH rows per transaction in id order.
+    Clears the flag comment at the end, so an interrupted backfill starts over on
+    the next boot and finished ones cost a single catalog lookup.
+    """
+    async with engine.connect() as conn:
+        if await conn.scalar(MOBILE_NO_BACKFILL_FLAG_SQL) != MOBILE_NO_BACKFILL_PENDING:
+            return
+    logger.info("📇 Backfilling broadcast_messages.mobile_no")
+    last, filled = "", 0
+    while True:
+        async with engine.begin() as conn:
+            row = (await conn.execute(MOBILE_NO_BACKFILL_SQL, {"last": last, "limit": MOBILE_NO_BACKFILL_BATCH})).first()
+        if row.last is None:
+            break
+        last, filled = row.last, filled + row.filled
+    async with engine.begin() as conn:
+        await conn.execute(text("COMMENT ON COLUMN broadcast_messages.mobile_no IS NULL;"))
+    logger.info(f"📇 Backfilled mobile_no of {filled} broadcast messages")
@@ -5,7 +5,7 @@ from sqlalchemy.future import select
 from dotenv import load_dotenv
 import os
 import logging
-from app.routers import webhook, analytics, tools, chat, profile, templates, migration, scheduler, broadcasts, auth, clients, admins, roles, chatbot
+from app.routers import webhook, analytics, tools, chat, profile, templates, migration, scheduler, broadcasts, auth, clients, admins, roles, chatbot, monitoring
 from control.routes import router as control_router
 import control.models
 
@@ -14,6 +14,7 @@ load_dotenv()
 
 # Logger setup
 logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Business WhatsApp Backend")
 
@@ -41,10 +42,11 @@ app.include_router(clients.router)
 app.include_router(admins.router)
 app.include_router(roles.router)
 app.include_router(chatbot.router)
+app.include_router(monitoring.router)
 app.include_router(control_router)
 
 from app.database import init_db, AsyncSessionLocal
-from control.models import AppConfig
+from control.config_snapshot import app_config
 from fastapi.staticfiles import StaticFiles
 
 # Maintenance Middleware
@@ -56,27 +58,67 @@ async def check_maintenance_mode(request: Request, call_next):
     if any(request.url.path.startswith(path) for path in exempt_paths):
         return await call_next(request)
 
-    async with AsyncSessionLocal() as session:
-        try:
-            result = await session.execute(select(AppConfig).limit(1))
-            config = result.scalars().first()
-            if config and config.maintenance_mode:
-                return JSONResponse(
-                    status_code=503,
-                    content={"detail": "System is under maintenance. Please try again later."}
-                )
-        except Exception as e:
-            # If DB error, log it but let the request through to avoid locking out the app
-            print(f"Middleware DB Error: {e}")
+    try:
+        # In-memory snapshot, no query per request (see control/config_snapshot.py)
+        config = await app_config.current()
+        if config["maintenance_mode"]:
+            return JSONResponse(
+                status_code=503,
+                content={"detail": "System is under maintenance. Please try again later."}
+            )
+    except Exception as e:
+        # If DB error, log it but let the request through to avoid locking out the app
+        print(f"Middleware DB Error: {e}")
 
     return await call_next(request)
 
 from app.services.firebase_service import init_firebase
+from app.services.webhook_queue import webhook_queue, WEBHOOK_QUEUE_ENABLED
+from app.services.webhook_dedup import webhook_dedup
+from app.services.media_pipeline import media_pipeline
+from app.services.webhook_log_writer import webhook_log_writer
+from app.services.log_partitions import log_partitions
+from app.services.pg_notify import pg_notify
+from app.services.meta_client import meta_client
+from app.services.template_catalog import template_catalog
+from app.services.broadcast_engine import broadcast_engine
+from app.services.broadcast_counters import broadcast_counters
 
 @app.on_event("startup")
 async def on_startup():
     await init_db()
+    try:
+        # Partitions must exist before the log writer inserts anything
+        await log_partitions.maintain()
+    except Exception as e:
+        logger.error(f"Log partition maintenance failed on startup: {e}")
+    log_partitions.start()
+    app_config.start()
+    pg_notify.start()
     init_firebase()
+    meta_client.start()
+    template_catalog.start()
+    broadcast_engine.start()
+    broadcast_counters.start()
+    webhook_log_writer.start()
+    webhook_dedup.start()
+    media_pipeline.start()
+    if WEBHOOK_QUEUE_ENABLED:
+        webhook_queue.start()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await webhook_queue.stop()
+    await broadcast_counters.stop()
+    await webhook_dedup.stop()
+    await media_pipeline.stop()
+    await broadcast_engine.stop()
+    await template_catalog.stop()
+    await meta_client.stop()
+    await webhook_log_writer.stop()
+    await log_partitions.stop()
+    await pg_notify.stop()
+    await app_config.stop()
 
 # Mount static files for local media storage
 os.makedirs("static", exist_ok=True)
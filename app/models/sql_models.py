@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, JSON, Float, BigInteger
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, JSON, Float, BigInteger, UniqueConstraint, Index, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from sqlalchemy.dialects.postgresql import JSONB
@@ -10,7 +10,7 @@ class Client(Base):
 
     client_id = Column(String, primary_key=True, index=True)
     waba_id = Column(String)
-    phone_number_id = Column(String)
+    phone_number_id = Column(String, index=True)
     phone_number = Column(String)
     webhook_verify_token = Column(String)
     store_id = Column(String)
@@ -25,6 +25,7 @@ class Client(Base):
     is_premium = Column(Boolean, default=True)
     subscription_expiry = Column(DateTime(timezone=True), nullable=True)
     status = Column(String, default="Approved")
+    broadcast_concurrency = Column(Integer, nullable=True) # In-flight broadcast sends; null = BROADCAST_CONCURRENCY
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
@@ -36,6 +37,10 @@ class Client(Base):
 
 class Contact(Base):
     __tablename__ = "contacts"
+    __table_args__ = (
+        # One contact per number; bulk contact creation relies on it for ON CONFLICT
+        Index("ux_contacts_client_phone", "client_id", "phone_number", unique=True),
+    )
 
     id = Column(String, primary_key=True, index=True) # Using string ID to match Firestore IDs if needed, or UUID
     client_id = Column(String, ForeignKey("clients.client_id"))
@@ -147,6 +152,10 @@ class Message(Base):
     mime_type = Column(String)
     caption = Column(Text)
     context = Column(JSON) # Reply context
+    media_id = Column(String) # Meta media ID of inbound media
+    media_status = Column(String, index=True) # pending, ready, failed (inbound media only)
+    media_claimed_at = Column(DateTime(timezone=True)) # last time a worker took the pending download
+    media_attempts = Column(Integer, default=0)
     
     delivered_at = Column(DateTime(timezone=True))
     read_at = Column(DateTime(timezone=True))
@@ -172,9 +181,15 @@ class Template(Base):
     reason = Column(JSON)
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     type = Column(String) # Text & Media, etc
+    header_format = Column(String) # TEXT, IMAGE, VIDEO, DOCUMENT, LOCATION; null without a header
 
     client = relationship("Client", back_populates="templates")
 
+    __table_args__ = (
+        Index("ix_templates_client_status", "client_id", "status", "header_format"),
+        Index("ix_templates_client_category", "client_id", "category", "language"),
+    )
+
 class Broadcast(Base):
     __tablename__ = "broadcasts"
 
@@ -201,12 +216,21 @@ class Broadcast(Base):
 
 class BroadcastMessage(Base):
     __tablename__ = "broadcast_messages"
+    __table_args__ = (
+        # Inbound replies look up "the pending template message for this phone" here
+        Index("ix_broadcast_messages_recipient", "client_id", "mobile_no", "added_to_chat"),
+        # Keyset walks over one broadcast's recipients
+        Index("ix_broadcast_messages_broadcast", "broadcast_id", "id"),
+        # Work claiming only ever looks at pending rows
+        Index("ix_broadcast_messages_pending", "broadcast_id", "id", postgresql_where=text("status = 'pending'")),
+    )
 
     id = Column(String, primary_key=True) # Message ID
     broadcast_id = Column(String, ForeignKey("broadcasts.id"))
     client_id = Column(String)
     
     payload = Column(JSON)
+    mobile_no = Column(String) # Copy of payload["mobileNo"]
     status = Column(String)
     whatsapp_message_id = Column(String, index=True)
     
@@ -219,6 +243,10 @@ class BroadcastMessage(Base):
     added_to_chat = Column(Boolean, default=False)
     
     error_code = Column(Integer)
+
+    # Worker currently delivering this row, until lease_expires_at
+    lease_owner = Column(String)
+    lease_expires_at = Column(DateTime(timezone=True))
     
     broadcast = relationship("Broadcast", back_populates="messages")
 
@@ -238,12 +266,57 @@ class DailyStats(Base):
 
 class WebhookLog(Base):
     __tablename__ = "webhook_logs"
+    # Daily range partitions, managed by app.services.log_partitions
+    __table_args__ = {"postgresql_partition_by": "RANGE (created_at)"}
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     client_id = Column(String)
     type = Column(String)
     payload = Column(JSONB)  # Using JSONB for better PostgreSQL performance and indexing
     status = Column(String)
+    created_at = Column(DateTime(timezone=True), primary_key=True, server_default=func.now())  # Partition key must be part of the PK
+
+class WebhookQueueItem(Base):
+    __tablename__ = "webhook_queue"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    payload = Column(JSONB)  # Raw Meta webhook body
+    status = Column(String, default="pending", index=True)  # pending, processing, dead
+    attempts = Column(Integer, default=0)
+    visible_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)  # Visibility timeout / retry backoff
+    last_error = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class ProcessedWebhookEvent(Base):
+    __tablename__ = "webhook_event_dedup"
+    __table_args__ = (
+        UniqueConstraint("whatsapp_message_id", "kind", "status", name="uq_webhook_event_dedup_key"),
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    whatsapp_message_id = Column(String, nullable=False)
+    kind = Column(String, nullable=False)  # message, status
+    status = Column(String, nullable=False, default="")  # sent, delivered, read, failed ('' for messages)
+    state = Column(String, nullable=False, default="processing", server_default="done")  # processing, done
+    lease_expires_at = Column(DateTime(timezone=True))  # processing keys past this can be claimed again
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+class MediaBlob(Base):
+    __tablename__ = "media_blobs"
+
+    sha256 = Column(String(64), primary_key=True)  # Content address; file lives at static/media_store/ab/cd/<sha256>
+    size = Column(BigInteger, nullable=False)
+    mime_type = Column(String)
+    ref_count = Column(Integer, default=0)  # Number of media_aliases pointing at this blob
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_used_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)  # Bumped on every new reference, drives LRU eviction
+
+class MediaAlias(Base):
+    __tablename__ = "media_aliases"
+
+    path = Column(String, primary_key=True)  # Public path under static/, hard-linked to the blob
+    sha256 = Column(String(64), ForeignKey("media_blobs.sha256", ondelete="CASCADE"), nullable=False, index=True)
+    client_id = Column(String, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 class Wallet(Base):
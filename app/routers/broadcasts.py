@@ -1,18 +1,23 @@
 from fastapi import APIRouter, Request, Response, BackgroundTasks, Body, Query, HTTPException
-from app.services.broadcasts import start_broadcast, create_broadcast_record
+from fastapi.responses import StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from app.services.broadcasts import start_broadcast, create_broadcast_record, create_broadcast_from_stream
+from app.services.broadcast_engine import broadcast_engine
 from app.services.whatsapp_meta import get_secrets
-from app.database import AsyncSessionLocal
+from app.database import AsyncSessionLocal, keyset_chunks
 from app.models.sql_models import Broadcast, BroadcastMessage
 from sqlalchemy.future import select
 import logging
+import json
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 from app.schemas import BroadcastStartRequest, BroadcastCreateRequest, SendTemplateMessageRequest, BroadcastUpdate
-from app.services.firebase_service import sync_broadcast_stats, sync_chat_metadata, sync_message
-from app.services.chat import ensure_contact_and_chat, create_template_chat_message, increment_daily_stats, get_ist_time
-from app.models.sql_models import Broadcast, BroadcastMessage, Template, Message, Chat
+from app.services.firebase_service import sync_broadcast_stats
+from app.services.chat import record_template_sends, sync_template_sends, increment_daily_stats, get_ist_time
+from app.services.template_renderer import template_renderer
+from app.models.sql_models import Broadcast, BroadcastMessage
 
 @router.post("/sendTemplateMessage")
 async def send_template_message_endpoint(body: SendTemplateMessageRequest):
@@ -42,6 +47,12 @@ async def send_template_message_endpoint(body: SendTemplateMessageRequest):
         if body.buttonVariables:
             button_payloads = [b.get("payload") for b in body.buttonVariables if b.get("payload")]
 
+        # 1. Template plan; a variable count mismatch is rejected before calling Meta
+        plan = await template_renderer.get(client_id, body.templateName, body.language)
+        problem = plan.check_variables(body_vars) if plan else None
+        if problem:
+            return Response(content=problem, status_code=400)
+
         from app.services.whatsapp_meta import send_template_message
         response = await send_template_message(
             client_id=client_id,
@@ -61,18 +72,8 @@ async def send_template_message_endpoint(body: SendTemplateMessageRequest):
         # 📊 Persist to Message Table & Sync to Firestore
         async with AsyncSessionLocal() as session:
             try:
-                # 1. Get Template record
-                t_res = await session.execute(select(Template).where(Template.name == body.templateName, Template.client_id == client_id))
-                template_record = t_res.scalars().first()
-                
-                if template_record:
-                    # 2. Use helper to find/create Contact and Chat
-                    effective_chat_id, chat_name, _ = await ensure_contact_and_chat(
-                        session, client_id, body.phoneNumber, name=None
-                    )
-                    
-                    # 3. Create the template-formatted message
-                    # Consolidate payload for create_template_chat_message
+                if plan:
+                    # 2. Consolidate payload for create_template_chat_message
                     payload = {
                         "type": body.mediaType.upper() if body.mediaId else "TEXT",
                         "bodyVariables": body_vars or [],
@@ -81,54 +82,19 @@ async def send_template_message_endpoint(body: SendTemplateMessageRequest):
                             "data": {"mediaId": media_id, "text": header_text}
                         } if (media_id or header_text) else None)
                     }
-                    
-                    template_chat_msg = await create_template_chat_message(
-                        client_id,
-                        template_record,
-                        {"payload": payload}, # Pass as dict since create_template_chat_message handles it
-                        None, # No broadcast object
-                        whatsapp_message_id,
-                        "sent",
-                        get_ist_time()
-                    )
-                    
-                    if template_chat_msg:
-                        # 4. Store in Message table
-                        new_chat_msg = Message(
-                            chat_id=effective_chat_id,
-                            client_id=client_id,
-                            **template_chat_msg
-                        )
-                        session.add(new_chat_msg)
-                        
-                        # 5. Update Chat last message
-                        chat_res = await session.execute(select(Chat).where(Chat.id == effective_chat_id, Chat.client_id == client_id))
-                        chat = chat_res.scalars().first()
-                        if chat:
-                            chat.last_message = template_chat_msg.get("content", "")
-                            chat.last_message_time = get_ist_time()
-                        
-                        await session.commit()
-                        
-                        # 6. Firestore Sync
-                        await sync_chat_metadata(effective_chat_id, client_id, {
-                            "lastMessage": template_chat_msg.get("content", ""),
-                            "lastMessageTime": get_ist_time(),
-                            "phoneNumber": body.phoneNumber,
-                            "name": chat_name
-                        })
-                        
-                        await sync_message(effective_chat_id, client_id, whatsapp_message_id, {
-                            "content": template_chat_msg.get("content", ""),
-                            "timestamp": get_ist_time(),
-                            "isFromMe": True,
-                            "senderName": "Admin",
-                            "status": "sent",
-                            "whatsappMessageId": whatsapp_message_id,
-                            "messageType": template_chat_msg.get("message_type", "text"),
-                            "mediaUrl": template_chat_msg.get("media_url"),
-                            "fileName": template_chat_msg.get("file_name")
-                        })
+
+                    # 3. Contact/Chat, Message row and chat last message (same path as broadcasts)
+                    recorded = await record_template_sends(session, client_id, plan, [{
+                        "phone_number": body.phoneNumber,
+                        "payload": payload,
+                        "whatsapp_message_id": whatsapp_message_id,
+                        "at": get_ist_time()
+                    }])
+                    await session.commit()
+
+                    # 4. Firestore Sync
+                    await sync_template_sends(client_id, recorded)
+                    if recorded:
                         logger.info(f"✅ Template message {whatsapp_message_id} persisted and synced for {body.phoneNumber}")
                 else:
                     logger.warning(f"Template {body.templateName} not found in DB, skipping persistence")
@@ -157,6 +123,46 @@ async def start_broadcast_endpoint(body: BroadcastStartRequest):
         logger.error(f"Error starting broadcast: {e}")
         return Response(content=str(e), status_code=500)
 
+@router.post("/pauseBroadcast")
+async def pause_broadcast_endpoint(body: BroadcastStartRequest):
+    try:
+        if not await broadcast_engine.pause(body.clientId, body.broadcastId):
+            return Response(content="Broadcast is not sending", status_code=409)
+        return {"success": True, "status": "Paused"}
+    except Exception as e:
+        logger.error(f"Error pausing broadcast: {e}")
+        return Response(content=str(e), status_code=500)
+
+@router.post("/resumeBroadcast")
+async def resume_broadcast_endpoint(body: BroadcastStartRequest):
+    try:
+        if not await broadcast_engine.resume(body.clientId, body.broadcastId):
+            return Response(content="Broadcast is not paused", status_code=409)
+        return {"success": True, "status": "Sending"}
+    except Exception as e:
+        logger.error(f"Error resuming broadcast: {e}")
+        return Response(content=str(e), status_code=500)
+
+@router.post("/cancelBroadcast")
+async def cancel_broadcast_endpoint(body: BroadcastStartRequest):
+    try:
+        changed, cancelled = await broadcast_engine.cancel(body.clientId, body.broadcastId)
+        if not changed:
+            return Response(content="Broadcast is already finished", status_code=409)
+        # Rows in flight on a worker are cancelled and refunded when it lets go of them
+        return {"success": True, "status": "Cancelled", "cancelledMessages": cancelled}
+    except Exception as e:
+        logger.error(f"Error cancelling broadcast: {e}")
+        return Response(content=str(e), status_code=500)
+
+@router.get("/getBroadcastProgress")
+async def get_broadcast_progress(broadcastId: str = Query(...)):
+    # Live counters of a broadcast running (or recently finished) in this process
+    progress = broadcast_engine.progress(broadcastId)
+    if not progress:
+        return Response(content="Broadcast is not running on this server", status_code=404)
+    return {"success": True, "progress": progress}
+
 @router.post("/createBroadcast")
 async def create_broadcast_endpoint(body: BroadcastCreateRequest):
     try:
@@ -168,6 +174,52 @@ async def create_broadcast_endpoint(body: BroadcastCreateRequest):
         logger.error(f"Error creating broadcast: {e}")
         return Response(content=str(e), status_code=500)
 
+@router.post("/createBroadcastStream")
+async def create_broadcast_stream_endpoint(
+    request: Request,
+    clientId: str = Query(...),
+    templateId: str = Query(None),
+    templateName: str = Query(None),
+    language: str = Query(None),
+    type: str = Query(None),
+    adminName: str = Query(None),
+    attachmentId: str = Query(None),
+    audienceType: int = Query(None),
+    messageCost: float = Query(0.0),
+    headerVariables: str = Query(None),  # JSON
+    buttonVariables: str = Query(None),  # JSON
+    format: str = Query(None)  # ndjson | csv; defaults from Content-Type
+):
+    """
+    Creates a broadcast from a streamed recipient list. The body is NDJSON
+    ({"mobileNo": ..., "bodyVariables": [...]} per line) or CSV (mobileNo,var1,var2,...),
+    and is copied into broadcast_messages as it arrives.
+    """
+    fmt = (format or "").lower() or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+    if fmt not in ("ndjson", "csv"):
+        return Response(content="format must be ndjson or csv", status_code=400)
+    try:
+        data = {
+            "templateId": templateId,
+            "templateName": templateName,
+            "language": language,
+            "type": type,
+            "adminName": adminName,
+            "attachmentId": attachmentId,
+            "audienceType": audienceType,
+            "messageCost": messageCost,
+            "headerVariables": json.loads(headerVariables) if headerVariables else None,
+            "buttonVariables": json.loads(buttonVariables) if buttonVariables else None,
+        }
+    except ValueError as e:
+        return Response(content=f"Invalid JSON in query: {e}", status_code=400)
+    try:
+        result = await create_broadcast_from_stream(clientId, data, request.stream(), fmt)
+        return {"success": True, **result}
+    except Exception as e:
+        logger.error(f"Error creating broadcast from stream: {e}")
+        return Response(content=str(e), status_code=500)
+
 @router.patch("/patchBroadcast")
 async def patch_broadcast(broadcastId: str = Query(...), body: BroadcastUpdate = Body(...)):
     async with AsyncSessionLocal() as session:
@@ -212,22 +264,29 @@ async def get_broadcasts(clientId: str):
 
 @router.get("/getBroadcastDetails")
 async def get_broadcast_details(broadcastId: str):
-    async with AsyncSessionLocal() as session:
+    try:
+        async with AsyncSessionLocal() as session:
+            broadcast = await session.get(Broadcast, broadcastId)
+    except Exception as e:
+        return Response(content=str(e), status_code=500)
+    if not broadcast:
+        return Response(content="Broadcast not found", status_code=404)
+
+    # Same JSON as before, but messages are written out chunk by chunk instead of
+    # loading every recipient of the broadcast first
+    async def body():
+        yield '{"success": true, "broadcast": ' + json.dumps(jsonable_encoder(broadcast)) + ', "messages": ['
+        separator = ""
+        query = select(BroadcastMessage).where(BroadcastMessage.broadcast_id == broadcastId)
         try:
-            result = await session.execute(
-                 select(Broadcast).where(Broadcast.id == broadcastId)
-            )
-            broadcast = result.scalars().first()
-            
-            msg_result = await session.execute(
-                 select(BroadcastMessage).where(BroadcastMessage.broadcast_id == broadcastId)
-            )
-            messages = msg_result.scalars().all()
-            
-            return {
-                "success": True, 
-                "broadcast": broadcast,
-                "messages": messages
-            }
+            async for messages in keyset_chunks(query, BroadcastMessage.id, scalars=True):
+                yield separator + ",".join(json.dumps(jsonable_encoder(m)) for m in messages)
+                separator = ","
         except Exception as e:
-            return Response(content=str(e), status_code=500)
+            # The 200 is already sent: abort the response so the client sees a broken
+            # body instead of valid JSON with recipients silently missing
+            logger.error(f"Failed to stream messages of broadcast {broadcastId}: {e}")
+            raise
+        yield "]}"
+
+    return StreamingResponse(body(), media_type="application/json")
@@ -4,6 +4,7 @@ from sqlalchemy.future import select
 from app.database import AsyncSessionLocal
 from app.models.sql_models import Client, Charge, Wallet
 from app.schemas import ResponseModel, ClientCreate, ClientUpdate
+from app.services.utils import invalidate_tenant
 import logging
 import datetime
 
@@ -104,7 +105,8 @@ async def add_client(client_data: ClientCreate):
                 admin_limit=client_data.admin_limit,
                 is_premium=client_data.is_premium,
                 subscription_expiry=client_data.subscription_expiry,
-                status=client_data.status
+                status=client_data.status,
+                broadcast_concurrency=client_data.broadcast_concurrency
             )
             session.add(new_client)
             
@@ -113,6 +115,8 @@ async def add_client(client_data: ClientCreate):
             session.add(new_wallet)
             
             await session.commit()
+            # Clears a cached "unknown id" for this tenant
+            await invalidate_tenant(new_client.client_id)
             return {"success": True, "clientId": new_client.client_id}
         except Exception as e:
             logger.error(f"Error adding client: {e}")
@@ -148,6 +152,7 @@ async def update_client(clientId: str = Query(...), client_data: ClientUpdate =
 
             client.updated_at = datetime.datetime.now(datetime.timezone.utc)
             await session.commit()
+            await invalidate_tenant(clientId)
             return {"success": True}
         except Exception as e:
             logger.error(f"Error updating client: {e}")
@@ -184,6 +189,7 @@ async def patch_client(clientId: str = Query(...), client_data: ClientUpdate = B
 
             client.updated_at = datetime.datetime.now(datetime.timezone.utc)
             await session.commit()
+            await invalidate_tenant(clientId)
             return {"success": True}
         except Exception as e:
             logger.error(f"Error patching client: {e}")
@@ -203,6 +209,7 @@ async def delete_client(clientId: str = Query(...)):
             
             await session.delete(client)
             await session.commit()
+            await invalidate_tenant(clientId)
             return {"success": True}
         except Exception as e:
             logger.error(f"Error deleting client: {e}")
@@ -0,0 +1,70 @@
+from fastapi import APIRouter, Depends, Response
+from control.routes import verify_api_key
+from app.services.webhook_queue import webhook_queue
+from app.services.webhook_dedup import webhook_dedup
+from app.services.webhook_dispatcher import dispatcher
+from app.services.webhook_log_writer import webhook_log_writer
+from app.services.log_partitions import log_partitions
+from app.services.pg_notify import pg_notify
+from app.services.utils import tenant_registry
+from app.services.media_pipeline import media_pipeline
+from app.services.media_store import media_store
+from app.services.meta_client import meta_client
+from app.services.send_limiter import send_limiter
+from app.services.template_catalog import template_catalog
+from app.services.template_renderer import template_renderer
+from app.services.broadcast_engine import broadcast_engine
+from app.services.broadcast_counters import broadcast_counters
+from app.services.webhook_replay import start_replay, replay_jobs, iter_ndjson, iter_webhook_logs, capture_path
+from app.schemas import WebhookReplayRequest
+import logging
+
+router = APIRouter(prefix="/admin", tags=["monitoring"], dependencies=[Depends(verify_api_key)])
+logger = logging.getLogger(__name__)
+
+
+@router.get("/metrics")
+async def get_metrics():
+    return {
+        "success": True,
+        "webhookQueue": await webhook_queue.get_metrics(),
+        "webhookDedup": webhook_dedup.get_metrics(),
+        "webhookDispatcher": dispatcher.get_metrics(),
+        "webhookLogWriter": webhook_log_writer.get_metrics(),
+        "logPartitions": log_partitions.get_metrics(),
+        "tenantRegistry": tenant_registry.get_metrics(),
+        "pgNotify": pg_notify.get_metrics(),
+        "mediaPipeline": media_pipeline.get_metrics(),
+        "mediaStore": await media_store.get_metrics(),
+        "metaClient": meta_client.get_metrics(),
+        "sendLimiter": send_limiter.get_metrics(),
+        "templateCatalog": template_catalog.get_metrics(),
+        "templateRenderer": template_renderer.get_metrics(),
+        "broadcastEngine": broadcast_engine.get_metrics(),
+        "broadcastCounters": broadcast_counters.get_metrics()
+    }
+
+
+@router.post("/webhook-replay")
+async def start_webhook_replay(body: WebhookReplayRequest):
+    if body.file:
+        try:
+            source = iter_ndjson(capture_path(body.file), limit=body.limit)
+        except ValueError as e:
+            return Response(content=str(e), status_code=400)
+    else:
+        source = iter_webhook_logs(
+            since=body.since, until=body.until, client_id=body.clientId, types=body.types, limit=body.limit
+        )
+    try:
+        job = start_replay(source, rate=body.rate, concurrency=body.concurrency, dedup=body.dedup, allow_live=body.allowLive)
+    except RuntimeError as e:
+        return Response(content=str(e), status_code=400)
+    return {"success": True, "data": job.to_dict()}
+
+@router.get("/webhook-replay/{job_id}")
+async def get_webhook_replay(job_id: str):
+    job = replay_jobs.get(job_id)
+    if not job:
+        return Response(content="Replay job not found", status_code=404)
+    return {"success": True, "data": job.to_dict()}
@@ -1,12 +1,12 @@
 from fastapi import APIRouter, Request, Response, UploadFile, File, Form
 from app.services.whatsapp_meta import (
-    get_meta_templates,
     delete_meta_template,
     create_meta_template,
     create_media_handle,
     create_media_id
 )
 from app.services.utils import get_secrets
+from app.services.template_catalog import template_catalog, MEDIA_HEADER_FORMATS, DEFAULT_PAGE_SIZE
 from app.database import AsyncSessionLocal
 from app.models.sql_models import Template
 from sqlalchemy.future import select
@@ -31,7 +31,9 @@ async def create_template(body: TemplateCreate):
                 "success": False,
                 "message": {"error": result["error"]}
             }
-            
+
+        # Pull the new template into the local catalog; status webhooks take it from there
+        template_catalog.schedule_sync(body.clientId)
         return {"success": True, "data": result}
 
 
@@ -48,25 +50,24 @@ async def get_templates(
     before: str = Query(None),
     status: str = Query(None),
     category: str = Query(None),
-    language: str = Query(None)
+    language: str = Query(None),
+    headerFormat: str = Query(None)
 ):
     try:
         if not clientId:
              return {"success": False, "message": "Missing clientId"}
-             
-        result = await get_meta_templates(
-            clientId, 
-            limit=limit, 
-            after=after, 
-            before=before,
+
+        # Served from the local catalog (see app/services/template_catalog.py)
+        result = await template_catalog.list_templates(
+            clientId,
             status=status,
             category=category,
-            language=language
+            language=language,
+            header_formats=headerFormat.split(",") if headerFormat else None,
+            limit=limit or DEFAULT_PAGE_SIZE,
+            after=after,
+            before=before
         )
-        
-        if isinstance(result, dict) and "error" in result:
-             return {"success": False, "error": result["error"]}
-             
         return {"success": True, "data": result}
 
     except Exception as e:
@@ -77,11 +78,7 @@ async def get_templates(
 @router.get("/getApprovedTemplates")
 async def get_approved(clientId: str = Query(...)):
     try:
-        result = await get_meta_templates(clientId, status="APPROVED", fields="name,category")
-        
-        if isinstance(result, dict) and "error" in result:
-             return {"success": False, "error": result["error"]}
-             
+        result = await template_catalog.list_templates(clientId, status="APPROVED", fields=["name", "category"])
         return {"success": True, "data": result}
 
     except Exception as e:
@@ -92,28 +89,14 @@ async def get_approved(clientId: str = Query(...)):
 @router.get("/getApprovedMediaTemplates")
 async def get_approved_media(clientId: str = Query(...)):
     try:
-        # Fetch name, category, and components from Meta API
-        result = await get_meta_templates(clientId, status="APPROVED", fields="name,category,components")
-        
-        if isinstance(result, dict) and "error" in result:
-             return {"success": False, "error": result["error"]}
-             
-        approved_templates = result.get("data", [])
-        
-        media_templates = []
-        for t in approved_templates:
-            components = t.get("components", [])
-            # A template is considered a media template if it has a HEADER with IMAGE or VIDEO format
-            has_media = False
-            for comp in components:
-                if comp.get("type") == "HEADER" and comp.get("format") in ["IMAGE", "VIDEO", "DOCUMENT"]:
-                    has_media = True
-                    break
-            
-            if has_media:
-                media_templates.append(t)
-                
-        return {"success": True, "data": media_templates}
+        # A template is considered a media template if it has a HEADER with IMAGE, VIDEO or DOCUMENT format
+        result = await template_catalog.list_templates(
+            clientId,
+            status="APPROVED",
+            header_formats=MEDIA_HEADER_FORMATS,
+            fields=["name", "category", "components"]
+        )
+        return {"success": True, "data": result["data"]}
         
     except Exception as e:
         logger.error(f"Error fetching approved media templates: {e}")
@@ -130,6 +113,8 @@ async def delete_template(body: DeleteTemplateRequest):
              return Response("Missing name or clientId", status_code=400)
              
         result = await delete_meta_template(client_id, name)
+        if isinstance(result, dict) and result.get("success"):
+            await template_catalog.remove(client_id, name)
         return {"success": True, "message": "Template deleted successfully", "data": result}
     except Exception as e:
         return Response(content=str(e), status_code=500)
@@ -1,13 +1,7 @@
 from fastapi import APIRouter, Request, Response, HTTPException, Query, Body
 from fastapi.responses import PlainTextResponse
-from app.services.webhook_handlers import (
-    log_webhook,
-    handle_status_update,
-    handle_category_update,
-    handle_chat_message,
-    handle_message_status_update,
-    update_user_preference
-)
+from app.services.webhook_handlers import process_webhook_payload
+from app.services.webhook_queue import webhook_queue, WEBHOOK_QUEUE_ENABLED
 import logging
 import os
 
@@ -65,64 +59,19 @@ async def webhook_event(request: Request, body: MetaWebhookPayload = Body(None))
             logger.error(f"Failed to parse webhook JSON: {e}. Raw body: {raw_body[:500]}")
             return Response(status_code=400, content=f"Invalid JSON: {str(e)}")
 
-    # Check if this is a proper Meta webhook format
-    if not isinstance(body, dict):
-        logger.error(f"Invalid webhook body: not a dict, got {type(body)}")
-        await log_webhook(None, "invalid_payload", {"error": "Body is not a JSON object", "type": str(type(body))}, "ERROR")
-        return Response(status_code=200)
-
-    logger.info(f"Webhook event received: {body.get('object')}")
-
-    # Check for Meta webhook format
-    if body.get("object") != "whatsapp_business_account":
-        # Not a Meta webhook - could be a test payload or different format
-        logger.warning(f"Unexpected webhook format - missing 'object': {list(body.keys())}")
-        # Still try to process if it has entry, otherwise log and return 200
-        if not body.get("entry"):
-            logger.error(f"Invalid webhook body: missing 'entry' array. Keys: {list(body.keys())}")
-            await log_webhook(None, "invalid_payload", {"error": "Missing 'entry' array", "received_keys": list(body.keys()), "sample": str(body)[:500]}, "ERROR")
-            return Response(status_code=200)
-    
-    if not isinstance(body.get("entry"), list):
-        logger.error(f"Invalid webhook body: 'entry' is not an array, got {type(body.get('entry'))}")
-        await log_webhook(None, "invalid_payload", {"error": "'entry' is not an array", "entry_type": str(type(body.get("entry")))}, "ERROR")
+    if WEBHOOK_QUEUE_ENABLED:
+        # Durable mode: persist the raw body in one insert and ACK immediately.
+        # Queue workers validate and dispatch it (see app/services/webhook_queue.py).
+        try:
+            await webhook_queue.enqueue(raw_body)
+        except Exception as e:
+            # Not persisted - let Meta retry the delivery
+            logger.error(f"WEBHOOK ENQUEUE ERROR: {e}")
+            return Response(status_code=500)
         return Response(status_code=200)
 
     try:
-        for entry in body.get("entry", []):
-            for change in entry.get("changes", []):
-                field = change.get("field")
-                value = change.get("value", {})
-                
-                # metadata could be in value.metadata or value directly?
-                # JS: const phoneNumberId = value.metadata?.phone_number_id;
-                phone_number_id = value.get("metadata", {}).get("phone_number_id")
-                client_id = phone_number_id
-                logger.info(f"Processing webhook for Client ID (PhoneNumberID): {client_id}, Field: {field}")
-                
-                if field == "message_template_status_update":
-                    await log_webhook(client_id, "status_update", value)
-                    await handle_status_update(client_id, value)
-                    
-                elif field == "template_category_update":
-                    await log_webhook(client_id, "category_update", value)
-                    await handle_category_update(client_id, value)
-                    
-                elif field == "messages":
-                    if value.get("statuses"):
-                        # await log_webhook(client_id, "message_status_update", value)
-                        await handle_message_status_update(client_id, value)
-                    else:
-                        # await log_webhook(client_id, "chat_message", value)
-                        await handle_chat_message(client_id, value)
-                        
-                elif field == "user_preferences":
-                    await log_webhook(client_id, "user_preference", value)
-                    await update_user_preference(client_id, value)
-                    
-                else:
-                    await log_webhook(client_id, "unknown_event", {"field": field, "value": value})
-
+        await process_webhook_payload(body)
         return Response(status_code=200)
 
     except Exception as e:
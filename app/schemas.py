@@ -21,6 +21,7 @@ class ClientBase(BaseModel):
     is_premium: Optional[bool] = True
     subscription_expiry: Optional[datetime] = None
     status: Optional[str] = "Approved"
+    broadcast_concurrency: Optional[int] = None
     wallet_balance: Optional[float] = 0.0
 
 class ClientCreate(ClientBase):
@@ -43,6 +44,7 @@ class ClientUpdate(BaseModel):
     admin_limit: Optional[int] = None
     subscription_expiry: Optional[datetime] = None
     status: Optional[str] = None
+    broadcast_concurrency: Optional[int] = None
     wallet_balance: Optional[float] = None
 
 class Client(ClientBase):
@@ -489,6 +491,18 @@ class MetaWebhookPayload(BaseModel):
     object: str
     entry: List[WebhookEntry]
 
+class WebhookReplayRequest(BaseModel):
+    file: Optional[str] = None  # NDJSON capture name inside WEBHOOK_REPLAY_DIR; defaults to webhook_logs
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+    clientId: Optional[str] = None
+    types: Optional[List[str]] = None
+    limit: Optional[int] = None
+    rate: Optional[float] = None  # Webhooks per second; None = as fast as possible
+    concurrency: int = 32
+    dedup: bool = True
+    allowLive: bool = False
+
 class BroadcastStartRequest(BaseModel):
     clientId: str
     broadcastId: str
@@ -1,5 +1,5 @@
 from app.services.utils import get_secrets, get_base_url
-import httpx
+from app.services.meta_client import meta_client
 import os
 import datetime
 import logging
@@ -26,18 +26,17 @@ async def fetch_conversation_analytics(secrets, start, end, granularity):
         
         full_url = f"{analytics_url}?{params['fields']}"
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                full_url,
-                headers={
-                    "Authorization": f"Bearer {token}",
-                    "Content-Type": "application/json",
-                },
-                timeout=30.0
-            )
-            # response.raise_for_status() 
-            data = response.json()
-            return data.get("conversation_analytics", {}).get("data", [{}])[0].get("data_points", [])
+        response = await meta_client.get(
+            full_url,
+            headers={
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json",
+            },
+            kind="analytics"
+        )
+        # response.raise_for_status() 
+        data = response.json()
+        return data.get("conversation_analytics", {}).get("data", [{}])[0].get("data_points", [])
 
     except Exception as e:
         logger.error(f"Error fetching conversation analytics: {e}")
@@ -57,17 +56,16 @@ async def fetch_messages_analytics(secrets, start, end, granularity):
         
         logger.info(f"Using Messages Analytics URL: {full_url}")
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                full_url,
-                headers={
-                    "Authorization": f"Bearer {token}",
-                    "Content-Type": "application/json",
-                },
-                timeout=30.0
-            )
-            data = response.json()
-            return data.get("analytics", {}).get("data_points", [])
+        response = await meta_client.get(
+            full_url,
+            headers={
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json",
+            },
+            kind="analytics"
+        )
+        data = response.json()
+        return data.get("analytics", {}).get("data_points", [])
             
     except Exception as e:
         logger.error(f"Error fetching messages analytics: {e}")
@@ -0,0 +1,204 @@
+import logging
+import asyncio
+import os
+from app.database import AsyncSessionLocal
+from app.models.sql_models import Broadcast
+from app.services.firebase_service import sync_broadcast_stats
+from app.services.websocket_manager import manager
+from sqlalchemy import update, func, text
+
+logger = logging.getLogger(__name__)
+
+# Write-behind aggregator for the broadcast sent/delivered/read/failed counters.
+# Status webhooks only add their deltas to an in-memory map keyed by broadcast id;
+# one background task flushes it every BROADCAST_COUNTER_FLUSH_MS with a single
+# atomic `SET sent = sent + :d, ...` UPDATE per broadcast, then pushes one Firestore
+# stats sync and one "broadcast_stats" WebSocket event per broadcast. Deltas from a
+# failed flush are merged back for the next one and stop() flushes what is left.
+# A hard crash still loses the last window of counts (the status rows are already
+# committed, so a redelivery won't repair them); the counters are therefore rebuilt
+# from broadcast_messages, at startup and every BROADCAST_COUNTER_RECONCILE_INTERVAL.
+# Another process may hold unflushed deltas for rows the rebuild already counts, so
+# only broadcasts that stopped receiving statuses are rebuilt: finished ones created
+# between BROADCAST_COUNTER_RECONCILE_HOURS and that plus
+# BROADCAST_COUNTER_RECONCILE_WINDOW_HOURS ago.
+BROADCAST_COUNTER_FLUSH_MS = int(os.getenv("BROADCAST_COUNTER_FLUSH_MS", "300"))
+BROADCAST_COUNTER_RECONCILE_INTERVAL = int(os.getenv("BROADCAST_COUNTER_RECONCILE_INTERVAL", "3600"))  # seconds
+BROADCAST_COUNTER_RECONCILE_HOURS = int(os.getenv("BROADCAST_COUNTER_RECONCILE_HOURS", "72"))  # until statuses have stopped coming in
+BROADCAST_COUNTER_RECONCILE_WINDOW_HOURS = int(os.getenv("BROADCAST_COUNTER_RECONCILE_WINDOW_HOURS", "24"))
+
+COUNTER_FIELDS = ("sent", "delivered", "read", "failed")
+
+# The deltas count each status a message reached once (the engine's sent/failed, then
+# Meta's delivered/read/failed), so a message sent and later failed is in both; its
+# timestamps keep that history where the current status doesn't
+RECONCILE_SQL = text("""
+    UPDATE broadcasts b
+    SET sent = c.sent, delivered = c.delivered, read = c.read, failed = c.failed
+    FROM (
+        SELECT broadcast_id,
+               count(sent_at) AS sent,
+               count(delivered_at) AS delivered,
+               count(read_at) AS read,
+               count(*) FILTER (WHERE status = 'failed') AS failed
+        FROM broadcast_messages
+        WHERE broadcast_id = ANY(:ids)
+        GROUP BY broadcast_id
+    ) c
+    WHERE b.id = c.broadcast_id
+      AND (b.sent, b.delivered, b.read, b.failed) IS DISTINCT FROM (c.sent, c.delivered, c.read, c.failed)
+    RETURNING b.id, b.client_id, b.sent, b.delivered, b.read, b.failed, b.status
+""")
+
+QUIET_SQL = text("""
+    SELECT id FROM broadcasts
+    WHERE status IN ('Sent', 'Cancelled')
+      AND created_at <= now() - make_interval(hours => :hours)
+      AND created_at > now() - make_interval(hours => :hours + :window)
+""")
+
+def stats_from_row(row):
+    return {"sent": row.sent, "delivered": row.delivered, "read": row.read, "failed": row.failed, "status": row.status}
+
+
+class BroadcastCounterAggregator:
+    def __init__(self):
+        self.pending = {}  # broadcast_id -> {"client_id": ..., "deltas": {"sent": n, ...}}
+        self.stats = {"increments": 0, "flushes": 0, "updates": 0, "failedFlushes": 0, "reconciled": 0, "corrected": 0}
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._reconcile_task = None
+
+    def _merge(self, client_id, broadcast_id, deltas):
+        entry = self.pending.setdefault(broadcast_id, {"client_id": client_id, "deltas": {}})
+        for field, count in deltas.items():
+            if field in COUNTER_FIELDS and count:
+                entry["deltas"][field] = entry["deltas"].get(field, 0) + count
+
+    async def add(self, client_id, broadcast_id, deltas):
+        """Queues counter deltas for a broadcast; written inline when the flusher isn't running (scripts, replay CLI)."""
+        self._merge(client_id, broadcast_id, deltas)
+        self.stats["increments"] += sum(deltas.values())
+        if self._task is None:
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            batch, self.pending = self.pending, {}
+            batch = {broadcast_id: entry for broadcast_id, entry in batch.items() if entry["deltas"]}
+            if not batch:
+                return
+
+            broadcast_stats = {}
+            try:
+                async with AsyncSessionLocal() as session:
+                    for broadcast_id, entry in batch.items():
+                        result = await session.execute(
+                            update(Broadcast)
+                            .where(Broadcast.id == broadcast_id)
+                            .values(**{
+                                field: func.coalesce(getattr(Broadcast, field), 0) + count
+                                for field, count in entry["deltas"].items()
+                            })
+                            .returning(Broadcast.sent, Broadcast.delivered, Broadcast.read, Broadcast.failed, Broadcast.status)
+                        )
+                        row = result.first()
+                        if row:
+                            broadcast_stats[broadcast_id] = (entry["client_id"], stats_from_row(row))
+                    await session.commit()
+            except Exception as e:
+                # Keep the deltas for the next flush rather than losing the counts
+                for broadcast_id, entry in batch.items():
+                    self._merge(entry["client_id"], broadcast_id, entry["deltas"])
+                self.stats["failedFlushes"] += 1
+                logger.error(f"Broadcast counter flush failed for {len(batch)} broadcast(s): {e}")
+                return
+
+            self.stats["flushes"] += 1
+            self.stats["updates"] += len(batch)
+
+        await self._publish(broadcast_stats)
+
+    async def reconcile(self, broadcast_ids):
+        """Rebuilds the counters of these broadcasts from their broadcast_messages statuses."""
+        broadcast_ids = list(broadcast_ids)
+        if not broadcast_ids:
+            return
+        async with self._lock:
+            # Local deltas are for status rows already committed, so the rebuild includes them
+            for broadcast_id in broadcast_ids:
+                self.pending.pop(broadcast_id, None)
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(RECONCILE_SQL, {"ids": broadcast_ids})
+                rows = result.all()
+                await session.commit()
+        self.stats["reconciled"] += len(broadcast_ids)
+        self.stats["corrected"] += len(rows)
+        if rows:
+            logger.info(f"🧮 Rebuilt counters of {len(rows)} broadcast(s) from their messages")
+        await self._publish({row.id: (row.client_id, stats_from_row(row)) for row in rows})
+
+    async def reconcile_quiet(self):
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(QUIET_SQL, {
+                "hours": BROADCAST_COUNTER_RECONCILE_HOURS, "window": BROADCAST_COUNTER_RECONCILE_WINDOW_HOURS
+            })
+            broadcast_ids = result.scalars().all()
+        await self.reconcile(broadcast_ids)
+
+    async def _publish(self, broadcast_stats):
+        for broadcast_id, (client_id, stats) in broadcast_stats.items():
+            await sync_broadcast_stats(broadcast_id, client_id, dict(stats))
+            await manager.broadcast_to_client(client_id, {
+                "type": "broadcast_stats",
+                "broadcastId": broadcast_id,
+                **stats
+            })
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(BROADCAST_COUNTER_FLUSH_MS / 1000)
+            try:
+                # Shielded so stop() never cuts a flush off between its UPDATEs and commit
+                await asyncio.shield(self.flush())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Broadcast counter flush error: {e}")
+
+    async def _reconcile_loop(self):
+        # Whatever a crashed process lost is repaired once the broadcast has gone quiet
+        while True:
+            try:
+                await self.reconcile_quiet()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Broadcast counter reconcile error: {e}")
+            await asyncio.sleep(BROADCAST_COUNTER_RECONCILE_INTERVAL)
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+            self._reconcile_task = asyncio.create_task(self._reconcile_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._reconcile_task.cancel()
+            await asyncio.gather(self._task, self._reconcile_task, return_exceptions=True)
+            self._task = None
+            self._reconcile_task = None
+        # Write out what the last window collected so a clean shutdown loses nothing
+        await self.flush()
+
+    def get_metrics(self):
+        increments = self.stats["increments"]
+        return {
+            "pendingBroadcasts": len(self.pending),
+            "flushIntervalMs": BROADCAST_COUNTER_FLUSH_MS,
+            **self.stats,
+            "incrementsPerUpdate": round(increments / self.stats["updates"], 1) if self.stats["updates"] else 0.0
+        }
+
+broadcast_counters = BroadcastCounterAggregator()
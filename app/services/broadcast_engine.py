@@ -0,0 +1,659 @@
+import logging
+import asyncio
+import os
+import socket
+import time
+import uuid
+from collections import deque
+import httpx
+from app.database import AsyncSessionLocal
+from app.models.sql_models import Broadcast, BroadcastMessage
+from app.services.whatsapp_meta import send_template_message
+from app.services.chat import (
+    add_daily_stats,
+    refund_message_costs,
+    record_template_sends,
+    sync_template_sends,
+    get_ist_time
+)
+from app.services.firebase_service import sync_broadcast_stats
+from app.services.broadcast_counters import broadcast_counters
+from app.services.template_renderer import template_renderer
+from app.services.utils import get_secrets
+from sqlalchemy.future import select
+from sqlalchemy import update, text, or_, func
+
+logger = logging.getLogger(__name__)
+
+# Pipelined broadcast delivery:
+#   producer  -> claims pending BroadcastMessage rows in batches into a bounded queue
+#   senders   -> up to the tenant's concurrency limit of send_template_message calls
+#                in flight (shared Meta client, paced per number by send_limiter)
+#   persister -> writes results in batches: one bulk UPDATE of broadcast_messages,
+#                refunds and daily stats per transaction (retried with backoff; a
+#                batch that still fails stops the run), then the chat Messages in a
+#                transaction of their own and the Firestore syncs for the batch
+# The concurrency slots are per tenant, so two broadcasts of one client share them;
+# a changed limit resizes them in place rather than starting a second set.
+#
+# Rows are claimed with FOR UPDATE SKIP LOCKED and leased to this worker
+# (lease_owner/lease_expires_at), and a heartbeat keeps the lease alive while the
+# run lasts. Any number of processes can therefore work on one broadcast. The
+# supervisor in every process joins "Sending" broadcasts that still have unleased
+# rows, which also resumes runs whose worker died once its leases expire (rows sent
+# but not yet persisted by a dead worker are sent again). Pause and cancel are
+# broadcast statuses; workers see them at their next claim or heartbeat.
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "16"))  # default; clients.broadcast_concurrency overrides
+BROADCAST_CLAIM_BATCH = int(os.getenv("BROADCAST_CLAIM_BATCH", "500"))  # recipients claimed per query
+BROADCAST_LEASE_SECONDS = int(os.getenv("BROADCAST_LEASE_SECONDS", "120"))
+BROADCAST_HEARTBEAT_INTERVAL = int(os.getenv("BROADCAST_HEARTBEAT_INTERVAL", "20"))  # seconds
+BROADCAST_SUPERVISOR_INTERVAL = int(os.getenv("BROADCAST_SUPERVISOR_INTERVAL", "15"))  # seconds
+BROADCAST_PERSIST_BATCH = int(os.getenv("BROADCAST_PERSIST_BATCH", "200"))
+BROADCAST_PERSIST_FLUSH_MS = int(os.getenv("BROADCAST_PERSIST_FLUSH_MS", "500"))
+BROADCAST_PERSIST_RETRIES = int(os.getenv("BROADCAST_PERSIST_RETRIES", "4"))  # backoff 0.5s, 1s, 2s, ...
+BROADCAST_RATE_WINDOW = 10  # seconds used for the live msgs/s figure
+BROADCAST_PROGRESS_KEEP = 100  # finished runs kept for /getBroadcastProgress
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+CLAIM_SQL = text("""
+    UPDATE broadcast_messages
+    SET lease_owner = :owner,
+        lease_expires_at = now() + make_interval(secs => :lease)
+    WHERE id IN (
+        SELECT m.id FROM broadcast_messages m
+        WHERE m.broadcast_id = :broadcast_id
+          AND m.status = 'pending'
+          AND (m.lease_expires_at IS NULL OR m.lease_expires_at < now())
+          AND EXISTS (SELECT 1 FROM broadcasts b WHERE b.id = :broadcast_id AND b.status = 'Sending')
+        ORDER BY m.id
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, payload, cost
+""")
+
+HEARTBEAT_SQL = text("""
+    UPDATE broadcast_messages
+    SET lease_expires_at = now() + make_interval(secs => :lease)
+    WHERE broadcast_id = :broadcast_id AND lease_owner = :owner AND status = 'pending'
+""")
+
+# Sending broadcasts with work nobody holds, and cancelled ones with rows left to sweep
+UNCLAIMED_SQL = text("""
+    SELECT b.id, b.client_id, b.status FROM broadcasts b
+    WHERE b.status IN ('Sending', 'Cancelled') AND EXISTS (
+        SELECT 1 FROM broadcast_messages m
+        WHERE m.broadcast_id = b.id
+          AND m.status = 'pending'
+          AND (m.lease_expires_at IS NULL OR m.lease_expires_at < now())
+    )
+""")
+
+FINISHED_CONDITION = """
+    b.status = 'Sending' AND NOT EXISTS (
+        SELECT 1 FROM broadcast_messages m WHERE m.broadcast_id = b.id AND m.status = 'pending'
+    )
+"""
+FINISH_SQL = text(f"UPDATE broadcasts b SET status = 'Sent' WHERE {FINISHED_CONDITION} RETURNING b.id, b.client_id")
+FINISH_ONE_SQL = text(
+    f"UPDATE broadcasts b SET status = 'Sent' WHERE b.id = :broadcast_id AND {FINISHED_CONDITION} RETURNING b.id, b.client_id"
+)
+
+def template_send_args(payload):
+    """Maps a BroadcastMessage payload onto send_template_message arguments."""
+    header_vars = payload.get("headerVariables") or {}
+    button_vars = payload.get("buttonVariables") or []
+
+    media_id = None
+    media_type = "image"
+    header_text = None
+    if header_vars:
+        h_type = header_vars.get("type")
+        if h_type == "text":
+            header_text = header_vars.get("data", {}).get("text")
+        else:
+            media_id = header_vars.get("data", {}).get("mediaId")
+            media_type = h_type or "image"
+
+    return {
+        "template_name": payload.get("template"),
+        "language": payload.get("language"),
+        "body_vars": payload.get("bodyVariables", []),
+        "media_id": media_id,
+        "phone_number": payload.get("mobileNo"),
+        "header_text": header_text,
+        "media_type": media_type,
+        "button_payloads": [b.get("payload") for b in button_vars] if button_vars else None
+    }
+
+def meta_error_code(error):
+    """Graph API error code of a failed send, when Meta returned one."""
+    if isinstance(error, httpx.HTTPStatusError):
+        try:
+            code = (error.response.json().get("error") or {}).get("code")
+            return int(code) if code is not None else None
+        except Exception:
+            return None
+    return None
+
+async def cancel_pending(session, client_id, broadcast_id, ids=None):
+    """
+    Marks pending rows cancelled and refunds them. With ids, only those rows (this
+    worker's own leases); otherwise every row no live lease holds. The caller commits.
+    """
+    query = update(BroadcastMessage).where(
+        BroadcastMessage.broadcast_id == broadcast_id, BroadcastMessage.status == "pending"
+    )
+    if ids is not None:
+        query = query.where(BroadcastMessage.id.in_(ids))
+    else:
+        query = query.where(or_(
+            BroadcastMessage.lease_expires_at.is_(None), BroadcastMessage.lease_expires_at < func.now()
+        ))
+    result = await session.execute(
+        query.values(status="cancelled", lease_owner=None, lease_expires_at=None)
+        .returning(BroadcastMessage.cost)
+        .execution_options(synchronize_session=False)
+    )
+    costs = result.scalars().all()
+    await refund_message_costs(session, client_id, broadcast_id, len(costs), sum(c or 0.0 for c in costs))
+    return len(costs)
+
+
+class TenantSlots:
+    """A tenant's send slots: a semaphore whose limit can be changed while runs hold slots."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self._waiters = deque()
+
+    def set_limit(self, limit):
+        # Lowering only stops new grants; sends already in flight finish
+        self.limit = limit
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_use < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_use += 1
+                waiter.set_result(None)
+
+    async def __aenter__(self):
+        if self.in_use < self.limit and not self._waiters:
+            self.in_use += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as we were cancelled: hand the slot on
+                self.in_use -= 1
+                self._wake()
+            raise
+
+    async def __aexit__(self, *exc):
+        self.in_use -= 1
+        self._wake()
+
+
+class BroadcastRun:
+    def __init__(self, client_id, broadcast_id, concurrency):
+        self.client_id = client_id
+        self.broadcast_id = broadcast_id
+        self.concurrency = concurrency
+        self.status = "running"
+        self.halted = None  # broadcast status (Paused, Cancelled) that stopped this run, or Failed
+        self.stats = {"queued": 0, "sent": 0, "failed": 0, "persisted": 0, "released": 0, "unpersisted": 0, "chatCopyErrors": 0}
+        self.error = None
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self._recent = deque()  # completion times inside BROADCAST_RATE_WINDOW
+
+    def record_send(self, ok):
+        self.stats["sent" if ok else "failed"] += 1
+        now = time.monotonic()
+        self._recent.append(now)
+        while self._recent and self._recent[0] < now - BROADCAST_RATE_WINDOW:
+            self._recent.popleft()
+
+    def to_dict(self):
+        now = time.monotonic()
+        elapsed = (self.finished_at or now) - self.started_at
+        recent = [t for t in self._recent if t >= now - BROADCAST_RATE_WINDOW]
+        done = self.stats["sent"] + self.stats["failed"]
+        return {
+            "broadcastId": self.broadcast_id,
+            "clientId": self.client_id,
+            "status": self.status,
+            "concurrency": self.concurrency,
+            **self.stats,
+            "elapsedSeconds": round(elapsed, 1),
+            "msgsPerSecond": round(len(recent) / min(BROADCAST_RATE_WINDOW, elapsed), 2) if recent and elapsed else 0.0,
+            "avgMsgsPerSecond": round(done / elapsed, 2) if elapsed else 0.0,
+            "error": self.error
+        }
+
+
+class BroadcastEngine:
+    def __init__(self):
+        self.runs = {}          # broadcast_id -> BroadcastRun (running and recently finished)
+        self.tasks = {}         # broadcast_id -> Task of the run in this process
+        self.tenant_slots = {}  # client_id -> TenantSlots
+        self.stats = {"resumed": 0, "finished": 0, "swept": 0}
+        self._task = None
+
+    def slots_for(self, client_id, limit):
+        slots = self.tenant_slots.get(client_id)
+        if slots is None:
+            slots = self.tenant_slots[client_id] = TenantSlots(limit)
+        elif slots.limit != limit:
+            # Runs already going share the new limit with this one
+            slots.set_limit(limit)
+        return slots
+
+    async def _claim(self, run):
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(CLAIM_SQL, {
+                "owner": WORKER_ID,
+                "lease": BROADCAST_LEASE_SECONDS,
+                "broadcast_id": run.broadcast_id,
+                "limit": BROADCAST_CLAIM_BATCH
+            })
+            rows = result.all()
+            await session.commit()
+            if not rows:
+                status = await session.scalar(select(Broadcast.status).where(Broadcast.id == run.broadcast_id))
+                if status != "Sending":
+                    run.halted = status or "Deleted"
+            return rows
+
+    async def _produce(self, run, queue, sender_count):
+        # One claimed batch (plus the queue) is held at a time, whatever the audience size
+        while not run.halted:
+            rows = await self._claim(run)
+            if not rows:
+                break
+            for row in rows:
+                run.stats["queued"] += 1
+                await queue.put(row)
+        for _ in range(sender_count):
+            await queue.put(None)
+
+    async def _send(self, run, secrets, slots, queue, results):
+        while True:
+            row = await queue.get()
+            if row is None:
+                return
+            if run.halted:
+                # Paused or cancelled: hand the lease back instead of sending
+                await results.put({"id": row.id, "cost": row.cost or 0.0, "released": True})
+                continue
+            payload = row.payload or {}
+            outcome = {"id": row.id, "payload": payload, "cost": row.cost or 0.0}
+            try:
+                # Meta rejects a variable count mismatch anyway; fail it here without a send
+                plan = await template_renderer.get(run.client_id, payload.get("template"), payload.get("language"))
+                problem = plan.check_variables(payload.get("bodyVariables")) if plan else None
+                if problem:
+                    raise ValueError(problem)
+                async with slots:
+                    response = await send_template_message(run.client_id, secrets, **template_send_args(payload))
+                outcome["whatsapp_message_id"] = response.get("messages", [{}])[0].get("id")
+                run.record_send(True)
+            except Exception as e:
+                logger.error(f"Failed to send broadcast message {row.id}: {e}")
+                outcome["error"] = e
+                run.record_send(False)
+            outcome["at"] = get_ist_time()
+            await results.put(outcome)
+
+    async def _persist(self, run, broadcast, results):
+        batch = []
+        done = False
+        while not done:
+            item = await results.get()
+            if item is None:
+                done = True
+            else:
+                batch.append(item)
+                # Gather more results until the batch is full or the flush interval passes
+                deadline = time.monotonic() + BROADCAST_PERSIST_FLUSH_MS / 1000
+                while len(batch) < BROADCAST_PERSIST_BATCH:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(results.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                    if item is None:
+                        done = True
+                        break
+                    batch.append(item)
+            if batch:
+                # Keeps consuming after a failure so the senders can hand their rows back
+                if await self._persist_with_retry(run, broadcast, batch):
+                    run.stats["persisted"] += len(batch)
+                else:
+                    run.stats["unpersisted"] += len(batch)
+                batch = []
+
+    async def _persist_with_retry(self, run, broadcast, batch):
+        for attempt in range(BROADCAST_PERSIST_RETRIES + 1):
+            try:
+                await self.persist_batch(run, broadcast, batch)
+                return True
+            except Exception as e:
+                logger.error(
+                    f"Failed to persist {len(batch)} results of broadcast {run.broadcast_id} "
+                    f"(attempt {attempt + 1}/{BROADCAST_PERSIST_RETRIES + 1}): {e}"
+                )
+                if attempt < BROADCAST_PERSIST_RETRIES:
+                    await asyncio.sleep(0.5 * (2 ** attempt))
+        # The rows stay pending under this worker's lease. Stop claiming and sending
+        # now rather than treat them as done; they are only retried once the lease expires.
+        run.error = f"{len(batch)} results could not be persisted"
+        if not run.halted:
+            run.halted = "Failed"
+        return False
+
+    async def persist_batch(self, run, broadcast, batch):
+        """
+        Marks the batch sent / failed / released, with refunds and daily stats, in one
+        transaction, then writes the chat copies separately: a failed chat insert must
+        not roll back the record that Meta already accepted these messages.
+        """
+        client_id = run.client_id
+        released = [r["id"] for r in batch if r.get("released")]
+        sent = [r for r in batch if not r.get("released") and "error" not in r]
+        failed = [r for r in batch if "error" in r]
+
+        async with AsyncSessionLocal() as session:
+            # Bulk UPDATE by primary key, one statement for the batch
+            if sent or failed:
+                await session.execute(update(BroadcastMessage), [
+                    {"id": r["id"], "status": "sent", "whatsapp_message_id": r["whatsapp_message_id"], "sent_at": r["at"],
+                     "lease_owner": None, "lease_expires_at": None}
+                    for r in sent
+                ] + [
+                    {"id": r["id"], "status": "failed", "error_code": meta_error_code(r["error"]), "failed_at": r["at"],
+                     "lease_owner": None, "lease_expires_at": None}
+                    for r in failed
+                ])
+
+            if released:
+                if run.halted == "Cancelled":
+                    await cancel_pending(session, client_id, run.broadcast_id, released)
+                else:
+                    await session.execute(
+                        update(BroadcastMessage)
+                        .where(BroadcastMessage.id.in_(released), BroadcastMessage.status == "pending")
+                        .values(lease_owner=None, lease_expires_at=None)
+                        .execution_options(synchronize_session=False)
+                    )
+
+            if failed:
+                await refund_message_costs(
+                    session, client_id, run.broadcast_id, len(failed), sum(r["cost"] for r in failed)
+                )
+
+            if sent:
+                await add_daily_stats(session, client_id, get_ist_time().strftime("%Y-%m-%d"), {"sent": len(sent)})
+            await session.commit()
+        run.stats["released"] += len(released)
+        if sent or failed:
+            # Meta's own "sent" status for these rows is then skipped as a repeat, so the
+            # live counters move here. Not retried with the batch: it is already committed.
+            try:
+                await broadcast_counters.add(client_id, run.broadcast_id, {"sent": len(sent), "failed": len(failed)})
+            except Exception as e:
+                logger.error(f"Failed to count {len(sent) + len(failed)} results of broadcast {run.broadcast_id}: {e}")
+
+        if not sent:
+            return
+        try:
+            synced = await self._record_chat_copies(run, broadcast, sent)
+        except Exception as e:
+            # Delivery is recorded; only the chat history misses these messages
+            run.stats["chatCopyErrors"] += len(sent)
+            logger.error(f"Failed to add {len(sent)} messages of broadcast {run.broadcast_id} to chats: {e}")
+            return
+
+        # Firestore after the commit, so it never shows rows that were rolled back
+        await sync_template_sends(client_id, synced, broadcast.admin_name)
+
+    async def _record_chat_copies(self, run, broadcast, sent):
+        client_id = run.client_id
+        synced = []
+        async with AsyncSessionLocal() as session:
+            # Contacts and chats are resolved per template group in a fixed number of queries
+            groups = {}
+            for r in sent:
+                key = (r["payload"].get("template"), r["payload"].get("language"))
+                groups.setdefault(key, []).append({
+                    "phone_number": r["payload"].get("mobileNo"),
+                    "payload": r["payload"],
+                    "whatsapp_message_id": r["whatsapp_message_id"],
+                    "at": r["at"]
+                })
+            for (template_name, language), sends in groups.items():
+                plan = await template_renderer.get(client_id, template_name, language)
+                if not plan:
+                    logger.warning(f"Template {template_name} not found in DB, skipping persistence for {len(sends)} messages")
+                    continue
+                synced += await record_template_sends(session, client_id, plan, sends, broadcast)
+            await session.commit()
+        return synced
+
+    async def _heartbeat(self, run):
+        while True:
+            await asyncio.sleep(BROADCAST_HEARTBEAT_INTERVAL)
+            try:
+                async with AsyncSessionLocal() as session:
+                    await session.execute(HEARTBEAT_SQL, {
+                        "owner": WORKER_ID, "lease": BROADCAST_LEASE_SECONDS, "broadcast_id": run.broadcast_id
+                    })
+                    status = await session.scalar(select(Broadcast.status).where(Broadcast.id == run.broadcast_id))
+                    await session.commit()
+                if status != "Sending" and not run.halted:
+                    run.halted = status or "Deleted"
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Broadcast {run.broadcast_id} heartbeat failed: {e}")
+
+    async def run(self, client_id, broadcast_id):
+        """Works on a Sending broadcast until nothing is left to claim or it is paused/cancelled."""
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(Broadcast).where(Broadcast.id == broadcast_id, Broadcast.client_id == client_id)
+            )
+            broadcast = result.scalars().first()
+        if not broadcast:
+            logger.error(f"Broadcast {broadcast_id} not found")
+            return
+        if broadcast.status != "Sending":
+            logger.info(f"Broadcast {broadcast_id} is {broadcast.status}, not sending")
+            return
+
+        secrets = await get_secrets(client_id)
+        limit = max(1, (secrets or {}).get("broadcastConcurrency") or BROADCAST_CONCURRENCY)
+        run = BroadcastRun(client_id, broadcast_id, limit)
+        self.runs[broadcast_id] = run
+        self._prune()
+
+        queue = asyncio.Queue(maxsize=limit * 2)
+        results = asyncio.Queue(maxsize=BROADCAST_PERSIST_BATCH * 2)
+        slots = self.slots_for(client_id, limit)
+        heartbeat = asyncio.create_task(self._heartbeat(run))
+        persister = asyncio.create_task(self._persist(run, broadcast, results))
+        senders = [asyncio.create_task(self._send(run, secrets, slots, queue, results)) for _ in range(limit)]
+        producer = asyncio.create_task(self._produce(run, queue, len(senders)))
+        try:
+            # Returns once everything finished or as soon as any task died, so a dead
+            # producer or sender never leaves the others blocked on the queue
+            done, _ = await asyncio.wait([producer, *senders], return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if not task.cancelled() and task.exception():
+                    raise task.exception()
+        except Exception as e:
+            # Leases run out and the supervisor picks the broadcast up again
+            logger.error(f"Critical error in broadcast {broadcast_id}: {e}")
+            run.error = str(e)
+        finally:
+            for task in (producer, *senders):
+                task.cancel()
+            await asyncio.gather(producer, *senders, return_exceptions=True)
+            await results.put(None)
+            await persister
+            heartbeat.cancel()
+
+        if run.error:
+            run.status = "failed"
+        elif run.halted:
+            run.status = run.halted.lower()
+        else:
+            # Other workers may still hold leased rows; the last one to finish marks it Sent
+            await self.finish(broadcast_id)
+            run.status = "completed"
+        run.finished_at = time.monotonic()
+        logger.info(f"✅ Broadcast {broadcast_id} run {run.status}: {run.to_dict()}")
+
+    async def finish(self, broadcast_id=None):
+        """Marks Sending broadcasts without pending rows as Sent (one broadcast, or all of them)."""
+        async with AsyncSessionLocal() as session:
+            if broadcast_id:
+                result = await session.execute(FINISH_ONE_SQL, {"broadcast_id": broadcast_id})
+            else:
+                result = await session.execute(FINISH_SQL)
+            finished = result.all()
+            await session.commit()
+        for row in finished:
+            self.stats["finished"] += 1
+            logger.info(f"🏁 Broadcast {row.id} Sent")
+            await sync_broadcast_stats(row.id, row.client_id, {"status": "Sent"})
+        return bool(finished)
+
+    def launch(self, client_id, broadcast_id):
+        """Starts a run in this process unless one is already going. Returns whether it started."""
+        task = self.tasks.get(broadcast_id)
+        if task and not task.done():
+            return False
+        task = self.tasks[broadcast_id] = asyncio.create_task(self.run(client_id, broadcast_id))
+        task.add_done_callback(lambda t: self.tasks.pop(broadcast_id, None) if self.tasks.get(broadcast_id) is t else None)
+        return True
+
+    async def _set_status(self, client_id, broadcast_id, status, condition):
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id, Broadcast.client_id == client_id, condition)
+                .values(status=status)
+                .returning(Broadcast.id)
+                .execution_options(synchronize_session=False)
+            )
+            changed = result.first() is not None
+            cancelled = 0
+            if changed and status == "Cancelled":
+                cancelled = await cancel_pending(session, client_id, broadcast_id)
+            await session.commit()
+        if changed:
+            await sync_broadcast_stats(broadcast_id, client_id, {"status": status})
+        return changed, cancelled
+
+    async def begin(self, client_id, broadcast_id):
+        changed, _ = await self._set_status(client_id, broadcast_id, "Sending", or_(
+            Broadcast.status.is_(None), Broadcast.status.not_in(["Sent", "Cancelled"])
+        ))
+        if changed:
+            self.launch(client_id, broadcast_id)
+        return changed
+
+    async def pause(self, client_id, broadcast_id):
+        changed, _ = await self._set_status(client_id, broadcast_id, "Paused", Broadcast.status == "Sending")
+        run = self.runs.get(broadcast_id)
+        if changed and run and not run.finished_at:
+            run.halted = "Paused"
+        return changed
+
+    async def resume(self, client_id, broadcast_id):
+        changed, _ = await self._set_status(client_id, broadcast_id, "Sending", Broadcast.status == "Paused")
+        if changed:
+            self.launch(client_id, broadcast_id)
+        return changed
+
+    async def cancel(self, client_id, broadcast_id):
+        """Cancels the broadcast; returns (changed, rows cancelled and refunded right away)."""
+        changed, cancelled = await self._set_status(
+            client_id, broadcast_id, "Cancelled", Broadcast.status.in_(["Draft", "Sending", "Paused"])
+        )
+        run = self.runs.get(broadcast_id)
+        if changed and run and not run.finished_at:
+            run.halted = "Cancelled"
+        return changed, cancelled
+
+    async def supervise(self):
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(UNCLAIMED_SQL)
+            rows = result.all()
+        for row in rows:
+            if row.status == "Sending":
+                if self.launch(row.client_id, row.id):
+                    self.stats["resumed"] += 1
+                    logger.info(f"🔁 Joining broadcast {row.id} (unclaimed recipients left)")
+            else:
+                # Rows a worker still held when the broadcast was cancelled
+                async with AsyncSessionLocal() as session:
+                    swept = await cancel_pending(session, row.client_id, row.id)
+                    await session.commit()
+                self.stats["swept"] += swept
+        await self.finish()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.supervise()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Broadcast supervisor error: {e}")
+            await asyncio.sleep(BROADCAST_SUPERVISOR_INTERVAL)
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Runs are dropped; their leases expire and any worker resumes them
+        tasks = [task for task in (self._task, *self.tasks.values()) if task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self.tasks = {}
+
+    def _prune(self):
+        finished = [key for key, run in self.runs.items() if run.finished_at]
+        for key in finished[:-BROADCAST_PROGRESS_KEEP]:
+            del self.runs[key]
+
+    def progress(self, broadcast_id):
+        run = self.runs.get(broadcast_id)
+        return run.to_dict() if run else None
+
+    def get_metrics(self):
+        active = [run for run in self.runs.values() if not run.finished_at]
+        return {
+            "workerId": WORKER_ID,
+            "activeBroadcasts": len(active),
+            **self.stats,
+            "msgsPerSecond": round(sum(run.to_dict()["msgsPerSecond"] for run in active), 2),
+            "runs": [run.to_dict() for run in active]
+        }
+
+broadcast_engine = BroadcastEngine()
@@ -1,18 +1,14 @@
 import logging
 import asyncio
-from app.database import AsyncSessionLocal
+import codecs
+import csv
+import json
+import time
+from app.database import AsyncSessionLocal, engine
 from app.models.sql_models import Broadcast, BroadcastMessage, Wallet, WalletHistory, Template, Contact, Message
-from app.services.whatsapp_meta import send_template_message
-from app.services.chat import (
-    refund_message_cost, 
-    increment_daily_stats, 
-    ensure_contact_and_chat, 
-    create_template_chat_message
-)
-from app.services.firebase_service import sync_chat_metadata, sync_message
-from app.services.utils import get_secrets
-from sqlalchemy.future import select
-from sqlalchemy import update, func
+from app.services.broadcast_engine import broadcast_engine
+from app.services.template_renderer import template_renderer
+from sqlalchemy import update, insert
 import datetime
 import uuid
 import os
@@ -20,206 +16,87 @@ from datetime import timezone, timedelta
 
 logger = logging.getLogger(__name__)
 
+# Recipients are written with COPY in chunks of BROADCAST_COPY_CHUNK rows, in the same
+# transaction as the Broadcast, Wallet and WalletHistory writes, so a failed upload
+# leaves nothing behind. Uploads (NDJSON or CSV) are parsed line by line as they
+# arrive; at most one chunk of rows is held in memory.
+BROADCAST_COPY_CHUNK = int(os.getenv("BROADCAST_COPY_CHUNK", "5000"))
+BROADCAST_UPLOAD_ERRORS_KEPT = 20  # rejected rows echoed back in the upload response
+BROADCAST_MESSAGE_COLUMNS = ["id", "broadcast_id", "client_id", "payload", "mobile_no", "status", "cost", "added_to_chat"]
+
 def get_ist_time():
     return datetime.datetime.now(timezone(timedelta(hours=5, minutes=30)))
 
 async def start_broadcast(client_id: str, broadcast_id: str):
     """
-    Initializes a broadcast. This would be called by the router after creating the Broadcast record.
-    In this implementation, we assume the Broadcast record and its associated BroadcastMessage records 
-    already exist in the database (created when the user uploads the CSV/Contacts).
+    Marks the broadcast Sending and starts delivering it from this process. Its
+    BroadcastMessage rows already exist (created with the broadcast); other workers
+    join through the broadcast engine's supervisor.
     """
     logger.info(f"🚀 Starting broadcast {broadcast_id} for client {client_id}")
-    
-    # Run in background
-    asyncio.create_task(process_broadcast(client_id, broadcast_id))
+    if not await broadcast_engine.begin(client_id, broadcast_id):
+        return {"success": False, "message": "Broadcast not found or already finished"}
     return {"success": True, "message": "Broadcast started in background"}
 
-async def process_broadcast(client_id: str, broadcast_id: str):
-    async with AsyncSessionLocal() as session:
-        try:
-            # 1. Fetch Broadcast and Template
-            result = await session.execute(
-                select(Broadcast).where(Broadcast.id == broadcast_id, Broadcast.client_id == client_id)
-            )
-            broadcast = result.scalars().first()
-            if not broadcast:
-                logger.error(f"Broadcast {broadcast_id} not found")
-                return
-
-            broadcast.status = "Sending"
-            await session.commit()
-
-            secrets = await get_secrets(client_id)
-            
-            # 2. Fetch all messages for this broadcast
-            msg_result = await session.execute(
-                select(BroadcastMessage).where(BroadcastMessage.broadcast_id == broadcast_id)
-            )
-            messages = msg_result.scalars().all()
-            
-            logger.info(f"Processing {len(messages)} messages for broadcast {broadcast_id}")
-
-            # 3. Process messages
-            for msg in messages:
-                try:
-                    payload = msg.payload or {}
-                    
-                    template_name = payload.get("template")
-                    language = payload.get("language")
-                    mobile_no = payload.get("mobileNo")
-                    body_vars = payload.get("bodyVariables", [])
-                    header_vars = payload.get("headerVariables", {})
-                    button_vars = payload.get("buttonVariables", [])
-                    
-                    media_id = None
-                    media_type = "image"
-                    header_text = None
-                    
-                    if header_vars:
-                        h_type = header_vars.get("type")
-                        if h_type == "text":
-                            header_text = header_vars.get("data", {}).get("text")
-                        else:
-                            media_id = header_vars.get("data", {}).get("mediaId")
-                            media_type = h_type or "image"
-                    
-                    button_payloads = [b.get("payload") for b in button_vars] if button_vars else None
+def normalize_mobile_no(value):
+    """Digits-only number with country code, or None when it cannot be one."""
+    digits = "".join(c for c in str(value or "") if c.isdigit())
+    if str(value or "").strip().startswith("00"):
+        digits = digits[2:]
+    return digits if 8 <= len(digits) <= 15 else None
 
-                    # Send message
-                    response = await send_template_message(
-                        client_id, 
-                        secrets, 
-                        template_name, 
-                        language, 
-                        body_vars, 
-                        media_id, 
-                        mobile_no, 
-                        header_text, 
-                        media_type,
-                        button_payloads
-                    )
-                    
-                    # Update message status
-                    whatsapp_message_id = response.get("messages", [{}])[0].get("id")
-                    
-                    msg.status = "sent"
-                    msg.whatsapp_message_id = whatsapp_message_id
-                    msg.sent_at = get_ist_time()
-                    
-                    # 📊 Persist to Message Table & Sync to Firestore
-                    try:
-                        # 1. Get Template record for create_template_chat_message
-                        if not hasattr(process_broadcast, "_template_cache"):
-                            process_broadcast._template_cache = {}
-                        
-                        t_key = f"{client_id}_{template_name}"
-                        if t_key not in process_broadcast._template_cache:
-                            # Search by name and clientId
-                            t_res = await session.execute(select(Template).where(Template.name == template_name, Template.client_id == client_id))
-                            process_broadcast._template_cache[t_key] = t_res.scalars().first()
-                        
-                        template_record = process_broadcast._template_cache[t_key]
-                        
-                        if template_record:
-                            # 2. Use helper to find/create Contact and Chat
-                            effective_chat_id, chat_name, _ = await ensure_contact_and_chat(
-                                session, client_id, mobile_no, name=None # Mobile no is used as fallback name
-                            )
-                            
-                            # 3. Create the template-formatted message
-                            template_chat_msg = await create_template_chat_message(
-                                client_id,
-                                template_record,
-                                msg, # BroadcastMessage model
-                                broadcast, # Broadcast model
-                                whatsapp_message_id,
-                                "sent",
-                                get_ist_time()
-                            )
-                            
-                            if template_chat_msg:
-                                # 4. Store in Message table
-                                new_chat_msg = Message(
-                                    chat_id=effective_chat_id,
-                                    client_id=client_id,
-                                    **template_chat_msg
-                                )
-                                session.add(new_chat_msg)
-                                
-                                # 5. Update Chat last message
-                                chat_res = await session.execute(select(Chat).where(Chat.id == effective_chat_id, Chat.client_id == client_id))
-                                chat = chat_res.scalars().first()
-                                if chat:
-                                    chat.last_message = template_chat_msg.get("content", "")
-                                    chat.last_message_time = get_ist_time()
-                                
-                                await session.commit() # Commit each to ensure Firestore syncs valid data
-                                
-                                # 6. Firestore Sync
-                                await sync_chat_metadata(effective_chat_id, client_id, {
-                                    "lastMessage": template_chat_msg.get("content", ""),
-                                    "lastMessageTime": get_ist_time(),
-                                    "phoneNumber": mobile_no,
-                                    "name": chat_name
-                                })
-                                
-                                await sync_message(effective_chat_id, client_id, whatsapp_message_id, {
-                                    "content": template_chat_msg.get("content", ""),
-                                    "timestamp": get_ist_time(),
-                                    "isFromMe": True,
-                                    "senderName": broadcast.admin_name,
-                                    "status": "sent",
-                                    "whatsappMessageId": whatsapp_message_id,
-                                    "messageType": template_chat_msg.get("message_type", "text"),
-                                    "mediaUrl": template_chat_msg.get("media_url"),
-                                    "fileName": template_chat_msg.get("file_name")
-                                })
-                                logger.info(f"✅ Broadcast message {whatsapp_message_id} persisted and synced for {mobile_no}")
-                        else:
-                            logger.warning(f"Template {template_name} not found in DB, skipping persistence for {mobile_no}")
-                            await session.commit()
+def parse_recipient_line(line, fmt):
+    """One NDJSON object or CSV row -> {mobileNo, bodyVariables}. CSV is mobileNo,var1,var2,..."""
+    if fmt == "csv":
+        row = next(csv.reader([line]))
+        return {"mobileNo": row[0] if row else None, "bodyVariables": row[1:]}
+    item = json.loads(line)
+    if not isinstance(item, dict):
+        raise ValueError("expected a JSON object")
+    return item
 
-                    except Exception as persistence_err:
-                        logger.error(f"Failed to persist broadcast message: {persistence_err}")
-                        await session.rollback()
+async def iter_lines(chunks):
+    """Splits a byte stream into decoded, non-empty lines without reading it whole."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            line = line.strip()
+            if line:
+                yield line
+    pending = (pending + decoder.decode(b"", final=True)).strip()
+    if pending:
+        yield pending
 
-                    # Update stats
-                    today = get_ist_time().strftime("%Y-%m-%d")
-                    await increment_daily_stats(client_id, today, 'sent')
-                    
-                except Exception as e:
-                    logger.error(f"Failed to send message {msg.id}: {e}")
-                    msg.status = "failed"
-                    msg.error_code = str(e)
-                    msg.failed_at = get_ist_time()
-                    
-                    await refund_message_cost(client_id, broadcast_id, msg.cost)
-                
-                await session.commit()
-                await asyncio.sleep(0.1)
+def message_record(broadcast_id, client_id, data, contact):
+    payload = {
+        "template": data.get("templateName"),
+        "language": data.get("language"),
+        "type": data.get("type"),
+        "bodyVariables": contact.get("bodyVariables"),
+        "headerVariables": data.get("headerVariables"),
+        "mobileNo": contact.get("mobileNo"),
+        "buttonVariables": data.get("buttonVariables")
+    }
+    # Same column order as BROADCAST_MESSAGE_COLUMNS; json columns are copied as text
+    return (
+        str(uuid.uuid4()), broadcast_id, client_id, json.dumps(payload), contact.get("mobileNo"),
+        "pending", float(data.get("messageCost") or 0.0), False
+    )
 
-            # 4. Finalize broadcast
-            broadcast.status = "Sent"
-            broadcast.updated_at = get_ist_time()
-            await session.commit()
-            logger.info(f"✅ Broadcast {broadcast_id} completed")
-
-        except Exception as e:
-            logger.error(f"Critical error in process_broadcast: {e}")
-            if broadcast:
-                broadcast.status = "Failed"
-                await session.commit()
-
-async def create_broadcast_record(client_id: str, data: dict):
+async def write_broadcast(client_id: str, data: dict, contacts, total_cost=None):
     """
-    Creates Broadcast and BroadcastMessage hooks.
-    Data format: {templateId, adminName, attachmentId, audienceType, contacts: [{mobileNo, bodyVariables, ...}], totalCost}
+    Writes a Broadcast, its BroadcastMessages (COPY, BROADCAST_COPY_CHUNK rows at a time),
+    the wallet deduction and WalletHistory in one transaction.
+    `contacts` is an async iterable of {mobileNo, bodyVariables}; when total_cost is None
+    it is messageCost per recipient. Returns (broadcast_id, recipient count).
     """
-    async with AsyncSessionLocal() as session:
-        broadcast_id = str(uuid.uuid4())
-        
-        new_broadcast = Broadcast(
+    broadcast_id = str(uuid.uuid4())
+    count = 0
+    async with engine.begin() as conn:
+        await conn.execute(insert(Broadcast).values(
             id=broadcast_id,
             client_id=client_id,
             template_id=data.get("templateId"),
@@ -232,49 +109,92 @@ async def create_broadcast_record(client_id: str, data: dict):
             read=0,
             failed=0,
             created_at=get_ist_time()
-        )
-        session.add(new_broadcast)
-        
-        # Add messages
-        contacts = data.get("contacts", [])
-        for c in contacts:
-            msg_id = str(uuid.uuid4())
-            # Construct payload for BroadcastMessage
-            payload = {
-                "template": data.get("templateName"),
-                "language": data.get("language"),
-                "type": data.get("type"),
-                "bodyVariables": c.get("bodyVariables"),
-                "headerVariables": data.get("headerVariables"),
-                "mobileNo": c.get("mobileNo"),
-                "buttonVariables": data.get("buttonVariables")
-            }
-            
-            b_msg = BroadcastMessage(
-                id=msg_id,
-                broadcast_id=broadcast_id,
-                client_id=client_id,
-                payload=payload,
-                status="pending",
-                cost=data.get("messageCost", 0.0)
-            )
-            session.add(b_msg)
-            
-        # Deduct wallet
-        total_cost = data.get("totalCost", 0.0)
-        await session.execute(
+        ))
+        # COPY runs on the same driver connection, inside the transaction opened above
+        raw = await conn.get_raw_connection()
+        driver = raw.driver_connection
+
+        records = []
+        async for contact in contacts:
+            records.append(message_record(broadcast_id, client_id, data, contact))
+            if len(records) >= BROADCAST_COPY_CHUNK:
+                await driver.copy_records_to_table("broadcast_messages", records=records, columns=BROADCAST_MESSAGE_COLUMNS)
+                count += len(records)
+                records = []
+        if records:
+            await driver.copy_records_to_table("broadcast_messages", records=records, columns=BROADCAST_MESSAGE_COLUMNS)
+            count += len(records)
+
+        if total_cost is None:
+            total_cost = count * float(data.get("messageCost") or 0.0)
+        await conn.execute(
             update(Wallet).where(Wallet.client_id == client_id).values(balance=Wallet.balance - total_cost)
         )
-        
-        # History
-        history = WalletHistory(
+        await conn.execute(insert(WalletHistory).values(
             id=str(uuid.uuid4()),
             client_id=client_id,
             broadcast_id=broadcast_id,
-            chargeable_messages=len(contacts),
+            chargeable_messages=count,
             chargeable_amount=total_cost
-        )
-        session.add(history)
-        
-        await session.commit()
-        return broadcast_id
+        ))
+    return broadcast_id, count
+
+async def create_broadcast_record(client_id: str, data: dict):
+    """
+    Creates Broadcast and BroadcastMessage hooks.
+    Data format: {templateId, adminName, attachmentId, audienceType, contacts: [{mobileNo, bodyVariables, ...}], totalCost}
+    """
+    async def contacts():
+        for c in data.get("contacts", []):
+            yield c
+
+    broadcast_id, _ = await write_broadcast(client_id, data, contacts(), total_cost=data.get("totalCost", 0.0))
+    return broadcast_id
+
+async def create_broadcast_from_stream(client_id: str, data: dict, chunks, fmt: str):
+    """
+    Creates a broadcast from an NDJSON or CSV recipient upload, parsed and copied as it
+    arrives. Rows without a usable mobileNo are skipped and reported.
+    """
+    started = time.monotonic()
+    stats = {"rejected": 0, "errors": []}
+    plan = await template_renderer.get(client_id, data.get("templateName"), data.get("language")) if data.get("templateName") else None
+
+    async def contacts():
+        first = True
+        async for line in iter_lines(chunks):
+            try:
+                contact = parse_recipient_line(line, fmt)
+                mobile_no = normalize_mobile_no(contact.get("mobileNo"))
+                body_vars = contact.get("bodyVariables") or []
+                if not mobile_no:
+                    raise ValueError(f"invalid mobileNo {contact.get('mobileNo')!r}")
+                if not isinstance(body_vars, list):
+                    raise ValueError("bodyVariables must be a list")
+                problem = plan.check_variables(body_vars) if plan else None
+                if problem:
+                    raise ValueError(problem)
+            except Exception as e:
+                if first and fmt == "csv" and not any(c.isdigit() for c in line.split(",")[0]):
+                    first = False
+                    continue  # header row
+                stats["rejected"] += 1
+                if len(stats["errors"]) < BROADCAST_UPLOAD_ERRORS_KEPT:
+                    stats["errors"].append({"line": line[:200], "error": str(e)})
+                continue
+            finally:
+                first = False
+            yield {"mobileNo": mobile_no, "bodyVariables": [str(v) for v in body_vars]}
+
+    broadcast_id, count = await write_broadcast(client_id, data, contacts())
+    elapsed = time.monotonic() - started
+    rows_per_second = round(count / elapsed, 1) if elapsed else 0.0
+    logger.info(f"📥 Broadcast {broadcast_id}: {count} recipients copied in {elapsed:.1f}s ({rows_per_second} rows/s), {stats['rejected']} rejected")
+    return {
+        "broadcastId": broadcast_id,
+        "recipients": count,
+        "rejected": stats["rejected"],
+        "errors": stats["errors"],
+        "seconds": round(elapsed, 2),
+        "rowsPerSecond": rows_per_second
+    }
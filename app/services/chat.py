@@ -1,8 +1,9 @@
 from app.database import AsyncSessionLocal
 from app.models.sql_models import DailyStats, Chat, Message, Wallet, WalletHistory, Contact
-from app.services.utils import get_secrets, get_base_url
+from app.services.utils import get_secrets, get_base_url, any_of
 from sqlalchemy.future import select
-from sqlalchemy import update
+from sqlalchemy import update, func, and_
+from sqlalchemy.dialects.postgresql import insert
 import httpx
 import os
 import datetime
@@ -12,77 +13,104 @@ import string
 import time
 import asyncio
 import aiofiles
+import hashlib
 
 from datetime import timezone, timedelta
 
 from app.services.firebase_service import sync_chat_metadata, sync_message
+from app.services.media_store import media_store
+from app.services.meta_client import meta_client
+from app.services.send_limiter import send_limiter
+from app.services.template_renderer import template_renderer
 import uuid
 
 logger = logging.getLogger(__name__)
 
+MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_BYTES", str(100 * 1024 * 1024)))  # WhatsApp documents max out at 100 MB
+MEDIA_DOWNLOAD_CHUNK_SIZE = int(os.getenv("MEDIA_DOWNLOAD_CHUNK_SIZE", str(64 * 1024)))
+
 def get_ist_time():
     return datetime.datetime.now(timezone(timedelta(hours=5, minutes=30)))
 
-async def increment_daily_stats(client_id: str, date_str: str, type_str: str):
+DAILY_STATS_COLUMNS = {
+    "sent": DailyStats.total_sent,
+    "delivered": DailyStats.total_delivered,
+    "read": DailyStats.total_read,
+    "failed": DailyStats.total_failed,
+}
+
+async def add_daily_stats(session, client_id: str, date_str: str, deltas: dict):
+    """
+    Adds aggregated counts ({"sent": n, "delivered": n, ...}) to the day's stats row
+    with a single atomic UPDATE, creating the row if needed. The caller commits.
+    """
+    values = {}
+    initial = {}
+    for type_str, count in deltas.items():
+        col = DAILY_STATS_COLUMNS.get(type_str)
+        if col is None or not count:
+            continue
+        values[col.key] = func.coalesce(col, 0) + count
+        initial[col.key] = count
+
+    if not values:
+        return
+
+    result = await session.execute(
+        update(DailyStats)
+        .where(DailyStats.client_id == client_id, DailyStats.date == date_str)
+        .values(**values)
+        .returning(DailyStats.id)
+    )
+    if result.first() is None:
+        session.add(DailyStats(client_id=client_id, date=date_str, **initial))
+
+async def increment_daily_stats(client_id: str, date_str: str, type_str: str, count: int = 1):
     async with AsyncSessionLocal() as session:
         try:
-            # Check if stats exist for the day
-            result = await session.execute(
-                select(DailyStats).where(
-                    DailyStats.client_id == client_id,
-                    DailyStats.date == date_str
-                )
-            )
-            stats = result.scalars().first()
-            
-            if not stats:
-                stats = DailyStats(client_id=client_id, date=date_str)
-                session.add(stats)
-            
-            if type_str == 'sent':
-                if stats.total_sent is None:
-                    stats.total_sent = 0
-                stats.total_sent += 1
-            elif type_str == 'delivered':
-                if stats.total_delivered is None:
-                    stats.total_delivered = 0
-                stats.total_delivered += 1
-            elif type_str == 'read':
-                if stats.total_read is None:
-                    stats.total_read = 0
-                stats.total_read += 1
-            elif type_str == 'failed':
-                if stats.total_failed is None:
-                    stats.total_failed = 0
-                stats.total_failed += 1
-                
+            await add_daily_stats(session, client_id, date_str, {type_str: count})
             await session.commit()
             logger.info(f"📊 Daily stats updated for {date_str}: {type_str}")
         except Exception as e:
             logger.error(f"❌ Error updating daily stats: {e}")
             await session.rollback()
 
-async def ensure_contact_and_chat(session, client_id, phone_number, chat_id=None, formatted_phone=None, name=None, country_code=None):
+async def load_contact_and_chat(session, client_id, phone_number):
+    """Loads the contact for a phone number and its chat in one query. Returns (contact, chat), either may be None."""
+    result = await session.execute(
+        select(Contact, Chat)
+        .outerjoin(Chat, and_(Chat.id == Contact.id, Chat.client_id == client_id))
+        .where(Contact.client_id == client_id, Contact.phone_number == phone_number)
+        .limit(1)
+    )
+    row = result.first()
+    return (row[0], row[1]) if row else (None, None)
+
+async def ensure_contact_and_chat(session, client_id, phone_number, chat_id=None, formatted_phone=None, name=None, country_code=None, preloaded=None):
     """
     Ensures a contact and chat exist for the given phone number.
+    `preloaded` is a (contact, chat) pair from load_contact_and_chat; its lookups are skipped.
     Returns (contact_id, chat_name, phone_number)
     """
     if not formatted_phone:
         formatted_phone = phone_number.replace("+", "").replace(" ", "").replace("-", "")
 
     # 1. Determine Contact/Chat ID
-    contact = None
-    if chat_id and chat_id != "test":
-        contact_res = await session.execute(
-            select(Contact).where(Contact.id == chat_id, Contact.client_id == client_id)
-        )
-        contact = contact_res.scalars().first()
-    
-    if not contact:
-        contact_res = await session.execute(
-            select(Contact).where(Contact.client_id == client_id, Contact.phone_number == phone_number)
-        )
-        contact = contact_res.scalars().first()
+    if preloaded:
+        contact, chat = preloaded
+    else:
+        contact = None
+        if chat_id and chat_id != "test":
+            contact_res = await session.execute(
+                select(Contact).where(Contact.id == chat_id, Contact.client_id == client_id)
+            )
+            contact = contact_res.scalars().first()
+        
+        if not contact:
+            contact_res = await session.execute(
+                select(Contact).where(Contact.client_id == client_id, Contact.phone_number == phone_number)
+            )
+            contact = contact_res.scalars().first()
     
     if contact:
         contact_id = contact.id
@@ -103,10 +131,11 @@ async def ensure_contact_and_chat(session, client_id, phone_number, chat_id=None
     effective_chat_id = contact_id
     
     # 2. Ensure Chat exists
-    chat_res = await session.execute(
-        select(Chat).where(Chat.client_id == client_id, Chat.id == effective_chat_id)
-    )
-    chat = chat_res.scalars().first()
+    if not preloaded:
+        chat_res = await session.execute(
+            select(Chat).where(Chat.client_id == client_id, Chat.id == effective_chat_id)
+        )
+        chat = chat_res.scalars().first()
     
     if not chat:
         chat = Chat(
@@ -123,122 +152,163 @@ async def ensure_contact_and_chat(session, client_id, phone_number, chat_id=None
     
     return effective_chat_id, chat.name, phone_number
 
-async def create_template_chat_message(client_id, template, message, broadcast, whatsapp_message_id, status, status_timestamp):
-    # template is now SQL model, message is BroadcastMessage model (or dict), broadcast is Broadcast model (optional)
-    
-    payload = message.payload if hasattr(message, 'payload') else (message.get('payload') if isinstance(message, dict) else {})
-    payload_type = payload.get("type", "").upper()
-    template_message = None
-    
-    def replace_body_params(text, variables):
-        for i, var in enumerate(variables):
-            text = text.replace(f"{{{{{i+1}}}}}", str(var))
-        return text
+async def resolve_contacts_and_chats(session, client_id, phone_numbers, names=None, contact_ids=None):
+    """
+    Bulk ensure_contact_and_chat for a chunk of recipients in a constant number of
+    round trips: one = ANY() lookup each for contacts and chats, then
+    INSERT ... ON CONFLICT DO NOTHING RETURNING for the missing ones (rows a
+    concurrent writer inserted first are read back).
+    `names` maps phone numbers to display names for new contacts/chats; `contact_ids`
+    maps phone numbers to contacts the caller already has, skipping their lookup.
+    Returns {phone_number: (chat_id, chat_name)}. The caller commits.
+    """
+    names = names or {}
+    resolved = dict(contact_ids or {})
+    numbers = list(dict.fromkeys(p for p in phone_numbers if p))
+    if not numbers:
+        return {}
+    now = get_ist_time()
+
+    # 1. Contacts
+    lookup = [p for p in numbers if p not in resolved]
+    if lookup:
+        result = await session.execute(
+            select(Contact.phone_number, Contact.id)
+            .where(Contact.client_id == client_id, Contact.phone_number == any_of(lookup))
+            .order_by(Contact.created_at)
+        )
+        for phone_number, contact_id in result.all():
+            resolved.setdefault(phone_number, contact_id)
+
+    missing = [p for p in numbers if p not in resolved]
+    if missing:
+        result = await session.execute(
+            insert(Contact)
+            .values([{
+                "id": str(uuid.uuid4()),
+                "client_id": client_id,
+                "phone_number": p,
+                "f_name": names.get(p) or "",
+                "l_name": "",
+                "created_at": now
+            } for p in missing])
+            .on_conflict_do_nothing()
+            .returning(Contact.phone_number, Contact.id)
+        )
+        resolved.update(result.all())
+        lost = [p for p in missing if p not in resolved]
+        if lost:
+            result = await session.execute(
+                select(Contact.phone_number, Contact.id)
+                .where(Contact.client_id == client_id, Contact.phone_number == any_of(lost))
+            )
+            for phone_number, contact_id in result.all():
+                resolved.setdefault(phone_number, contact_id)
 
-    components = template.components or []
-    
-    header_comp = next((c for c in components if c['type'] == 'HEADER'), {})
-    body_comp = next((c for c in components if c['type'] == 'BODY'), {})
-    footer_comp = next((c for c in components if c['type'] == 'FOOTER'), {})
-    buttons_comp = next((c for c in components if c['type'] == 'BUTTONS'), {})
-
-    body_text = body_comp.get("text", "")
-    body_vars = payload.get("bodyVariables", [])
-    content = replace_body_params(body_text, body_vars)
-    
-    sender_name = broadcast.admin_name if broadcast else "Admin"
-    
-    base_msg = {
-        "is_from_me": True,
-        "sender_name": sender_name,
-        "status": status,
-        "whatsapp_message_id": whatsapp_message_id,
-        "sender_avatar": None,
-        "caption": None,
-        "media_url": None,
-        "file_name": None,
-        "message_type": "text"
-    }
-    
-    # If footer exists, maybe append to content?
-    footer_text = footer_comp.get("text")
-    if footer_text:
-        content += f"\n\n{footer_text}"
-    
-    if status == 'delivered':
-        base_msg['delivered_at'] = status_timestamp
-    elif status == 'read':
-        base_msg['read_at'] = status_timestamp
-    else:
-        base_msg['sent_at'] = status_timestamp # Default
-
-    if payload_type == 'TEXT':
-        header_text = header_comp.get("text")
-        if header_text:
-             content = f"*{header_text}*\n{content}"
-             
-        base_msg.update({
-             "content": content,
-        })
-        template_message = base_msg
-        
-    elif payload_type == 'MEDIA':
-        header_vars = payload.get("headerVariables", {})
-        file_name = header_vars.get("data", {}).get("fileName")
-        
-        # message_id_val could be from model or dict
-        def get_msg_val(obj, key):
-            if hasattr(obj, key): return getattr(obj, key)
-            if isinstance(obj, dict): return obj.get(key)
-            return None
+    # 2. Chats (a chat shares its contact's id)
+    chat_ids = list(dict.fromkeys(resolved[p] for p in numbers if p in resolved))
+    result = await session.execute(
+        select(Chat.id, Chat.name).where(Chat.client_id == client_id, Chat.id == any_of(chat_ids))
+    )
+    chat_names = dict(result.all())
+
+    missing = [(p, resolved[p]) for p in numbers if p in resolved and resolved[p] not in chat_names]
+    missing = list({chat_id: (p, chat_id) for p, chat_id in missing}.values())
+    if missing:
+        result = await session.execute(
+            insert(Chat)
+            .values([{
+                "id": chat_id,
+                "client_id": client_id,
+                "contact_id": chat_id,
+                "phone_number": p,
+                "name": names.get(p) or p.replace("+", "").replace(" ", "").replace("-", ""),
+                "is_active": True,
+                "un_read": False,
+                "created_at": now
+            } for p, chat_id in missing])
+            .on_conflict_do_nothing()
+            .returning(Chat.id, Chat.name)
+        )
+        chat_names.update(result.all())
+        lost = [chat_id for _, chat_id in missing if chat_id not in chat_names]
+        if lost:
+            result = await session.execute(select(Chat.id, Chat.name).where(Chat.id == any_of(lost)))
+            chat_names.update(result.all())
 
-        attachment_id = broadcast.attachment_id if broadcast else get_msg_val(message, 'attachment_id')
-        
-        media_url = None
-        if file_name and attachment_id:
-            # Local File Storage URL
-            dir_rel_path = f"broadcasts_media/{client_id}/{attachment_id}"
-            server_url = os.getenv("SERVER_URL", "http://localhost:8000").rstrip("/")
-            media_url = f"{server_url}/static/{dir_rel_path}/{file_name}"
-
-        base_msg.update({
-            "content": content,
-            "file_name": file_name,
-            "media_url": media_url,
-            "message_type": header_vars.get("type", "").lower() if header_vars.get("type") else "image"
-        })
-        template_message = base_msg
-        
-    elif payload_type == 'INTERACTIVE':
-        # simplifying interactive checks
-        header_vars = payload.get("headerVariables", {})
-        media_url = None
-        file_name = None
-        
-        if header_vars:
-             if header_vars.get("type") not in ['text', None]:
-                file_name = header_vars.get("data", {}).get("fileName")
-                attachment_id = broadcast.attachment_id if broadcast else get_msg_val(message, 'attachment_id')
-                if file_name and attachment_id:
-                    dir_rel_path = f"broadcasts_media/{client_id}/{attachment_id}"
-                    server_url = os.getenv("SERVER_URL", "http://localhost:8000").rstrip("/")
-                    media_url = f"{server_url}/static/{dir_rel_path}/{file_name}"
-
-        # Buttons - not stored in Message model explicitly aside from context?
-        # appending buttons to content for visibility
-        if buttons_comp:
-            buttons_text = "\n".join([f"[{b.get('text')}]" for b in buttons_comp.get("buttons", [])])
-            content += f"\n\n{buttons_text}"
-
-        base_msg.update({
-            "content": content,
-            "file_name": file_name,
-            "media_url": media_url,
-            "message_type": 'interactive',
-        })
-        template_message = base_msg
-
-    return template_message
+    return {p: (resolved[p], chat_names.get(resolved[p])) for p in numbers if p in resolved}
+
+async def record_template_sends(session, client_id, plan, sends, broadcast=None):
+    """
+    Persists a chunk of sent template messages: contacts/chats resolved in bulk, the
+    chunk rendered from the template plan in one call, one chat Message per send and
+    each chat's last message moved forward in one UPDATE.
+    Each send is a dict with phone_number, payload, whatsapp_message_id, at and
+    optionally name/contact_id. Returns [(send, chat_id, chat_name, template_chat_msg)]
+    for sync_template_sends. The caller commits.
+    """
+    if not sends:
+        return []
+    chats = await resolve_contacts_and_chats(
+        session, client_id, [s["phone_number"] for s in sends],
+        names={s["phone_number"]: s["name"] for s in sends if s.get("name")},
+        contact_ids={s["phone_number"]: s["contact_id"] for s in sends if s.get("contact_id")}
+    )
+
+    recorded = []
+    last_messages = {}
+    for send, template_chat_msg in zip(sends, plan.render_chunk(client_id, sends, broadcast)):
+        if send["phone_number"] not in chats or not template_chat_msg:
+            continue
+        chat_id, chat_name = chats[send["phone_number"]]
+        session.add(Message(chat_id=chat_id, client_id=client_id, **template_chat_msg))
+        last_messages[chat_id] = {
+            "id": chat_id, "last_message": template_chat_msg.get("content", ""), "last_message_time": send["at"]
+        }
+        recorded.append((send, chat_id, chat_name, template_chat_msg))
+
+    if last_messages:
+        await session.execute(update(Chat), list(last_messages.values()))
+    return recorded
+
+async def sync_template_sends(client_id, recorded, sender_name="Admin"):
+    """Firestore side of record_template_sends, run after the commit."""
+    async def sync(send, chat_id, chat_name, template_chat_msg):
+        try:
+            await sync_chat_metadata(chat_id, client_id, {
+                "lastMessage": template_chat_msg.get("content", ""),
+                "lastMessageTime": send["at"],
+                "phoneNumber": send["phone_number"],
+                "name": chat_name
+            })
+            await sync_message(chat_id, client_id, send["whatsapp_message_id"], {
+                "content": template_chat_msg.get("content", ""),
+                "timestamp": send["at"],
+                "isFromMe": True,
+                "senderName": sender_name,
+                "status": "sent",
+                "whatsappMessageId": send["whatsapp_message_id"],
+                "messageType": template_chat_msg.get("message_type", "text"),
+                "mediaUrl": template_chat_msg.get("media_url"),
+                "fileName": template_chat_msg.get("file_name")
+            })
+        except Exception as e:
+            logger.error(f"❌ Firebase Sync Error for template message {send['whatsapp_message_id']}: {e}")
+    await asyncio.gather(*(sync(*item) for item in recorded))
+
+async def create_template_chat_message(client_id, template, message, broadcast, whatsapp_message_id, status, status_timestamp):
+    # template is a SQL model, message a BroadcastMessage model (or dict), broadcast a Broadcast model (optional)
+    if hasattr(message, "payload"):
+        payload = message.payload
+    else:
+        payload = message.get("payload") if isinstance(message, dict) else {}
+    attachment_id = broadcast.attachment_id if broadcast else (
+        getattr(message, "attachment_id", None) if not isinstance(message, dict) else message.get("attachment_id")
+    )
+    return template_renderer.plan_for(template).render(
+        client_id, payload, whatsapp_message_id, status, status_timestamp,
+        broadcast.admin_name if broadcast else "Admin", attachment_id
+    )
 
 async def send_whatsapp_message_helper(request_body: dict):
     try:
@@ -305,10 +375,9 @@ async def send_whatsapp_message_helper(request_body: dict):
 
         url = f"{base_url}/{secrets.get('phoneNumberId')}/messages"
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-            data = response.json()
+        response = await send_limiter.post(secrets.get('phoneNumberId'), url, json=payload, headers=headers)
+        response.raise_for_status()
+        data = response.json()
 
         whatsapp_message_id = data.get("messages", [{}])[0].get("id")
 
@@ -414,45 +483,83 @@ async def mark_message_as_read(secrets, message_id, add_typing_indicator=False):
                 "type": "text"
             }
             
-        async with httpx.AsyncClient() as client:
-            await client.post(
-                f"{base_url}/{secrets['phoneNumberId']}/messages",
-                json=payload,
-                headers={
-                    "Authorization": f"Bearer {token}",
-                    "Content-Type": "application/json",
-                }
-            )
+        await send_limiter.post(
+            secrets['phoneNumberId'],
+            f"{base_url}/{secrets['phoneNumberId']}/messages",
+            json=payload,
+            headers={
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json",
+            }
+        )
         logger.info("Message marked as read successfully.")
     except Exception as e:
         logger.error(f"Error marking message as read: {e}")
         # throw error ? or just log
         raise e
 
+async def refund_message_costs(session, client_id, broadcast_id, count, amount):
+    """Atomically refunds `count` messages worth `amount` to the wallet and broadcast history. The caller commits."""
+    if not count:
+        return
+    await session.execute(
+        update(Wallet)
+        .where(Wallet.client_id == client_id)
+        .values(balance=Wallet.balance + amount)
+    )
+    # Assuming one history entry per broadcast
+    await session.execute(
+        update(WalletHistory)
+        .where(WalletHistory.broadcast_id == broadcast_id, WalletHistory.client_id == client_id)
+        .values(
+            chargeable_messages=WalletHistory.chargeable_messages - count,
+            chargeable_amount=WalletHistory.chargeable_amount - amount
+        )
+    )
+
 async def refund_message_cost(client_id, broadcast_id, cost):
     async with AsyncSessionLocal() as session:
         try:
-            # Update Wallet
-            wallet_result = await session.execute(select(Wallet).where(Wallet.client_id == client_id))
-            wallet = wallet_result.scalars().first()
-            if wallet:
-                wallet.balance += cost
-            
-            # Update History
-            history_result = await session.execute(
-                select(WalletHistory)
-                .where(WalletHistory.broadcast_id == broadcast_id, WalletHistory.client_id == client_id)
-            )
-            history = history_result.scalars().first() # Assuming one history entry per broadcast
-            if history:
-                history.chargeable_messages -= 1
-                history.chargeable_amount -= cost
-                
+            await refund_message_costs(session, client_id, broadcast_id, 1, cost or 0.0)
             await session.commit()
         except Exception as e:
             logger.error(f"Error refunding message cost: {e}")
             await session.rollback()
 
+class MediaTooLargeError(ValueError):
+    pass
+
+async def stream_media_to_file(client, url, file_path, media_id, headers=None, timeout=90.0):
+    """
+    Streams a media download into file_path in MEDIA_DOWNLOAD_CHUNK_SIZE chunks, so memory
+    stays flat regardless of file size. Content type and size are checked as bytes arrive.
+    Returns (size, content_type, sha256 hex digest).
+    """
+    async with client.stream("GET", url, headers=headers, timeout=timeout, follow_redirects=True) as response:
+        response.raise_for_status()
+
+        # Check if we got an error page instead of an image
+        content_type = response.headers.get("Content-Type", "").lower()
+        if "text/html" in content_type or "application/json" in content_type:
+            logger.error(f"[Media {media_id}] Downloaded unexpected content type: {content_type}")
+            raise ValueError(f"Downloaded {content_type} instead of binary media")
+
+        declared_size = int(response.headers.get("Content-Length") or 0)
+        if declared_size > MEDIA_MAX_BYTES:
+            raise MediaTooLargeError(f"Media is {declared_size} bytes, limit is {MEDIA_MAX_BYTES}")
+
+        file_size = 0
+        digest = hashlib.sha256()
+        async with aiofiles.open(file_path, 'wb') as f:
+            async for chunk in response.aiter_bytes(MEDIA_DOWNLOAD_CHUNK_SIZE):
+                file_size += len(chunk)
+                if file_size > MEDIA_MAX_BYTES:
+                    raise MediaTooLargeError(f"Media exceeded {MEDIA_MAX_BYTES} bytes while downloading")
+                digest.update(chunk)
+                await f.write(chunk)
+
+    return file_size, content_type, digest.hexdigest()
+
 async def download_and_upload_media(client_id, secrets, media_id, mime_type, original_filename=None, message_id=None):
     max_retries = 2
     base_url = get_base_url()
@@ -467,99 +574,98 @@ async def download_and_upload_media(client_id, secrets, media_id, mime_type, ori
         try:
             logger.info(f"[Media {media_id}] Attempt {retry + 1}: Fetching signed URL...")
             
-            async with httpx.AsyncClient(follow_redirects=True) as client:
-                # 1. Get the media metadata (includes the URL)
-                meta_res = await client.get(
-                    f"{base_url}/{media_id}",
-                    headers={"Authorization": f"Bearer {token}"},
-                    timeout=20.0 + (retry * 5)
-                )
-                meta_res.raise_for_status()
-                signed_url = meta_res.json().get("url")
-                
-                if not signed_url:
-                    raise ValueError(f"No signed URL in response: {meta_res.text}")
-                
-                logger.info(f"[Media {media_id}] Signed URL fetched. Downloading content...")
-                
-                # 2. Download the actual content
-                # Note: Sometimes Meta signed URLs don't want the Authorization header.
-                # We'll try with it first, then without if it fails.
+            # 1. Get the media metadata (includes the URL)
+            meta_res = await meta_client.get(
+                f"{base_url}/{media_id}",
+                headers={"Authorization": f"Bearer {token}"},
+                timeout=20.0 + (retry * 5),
+                follow_redirects=True,
+                retries=0  # this loop already retries
+            )
+            meta_res.raise_for_status()
+            signed_url = meta_res.json().get("url")
+            
+            if not signed_url:
+                raise ValueError(f"No signed URL in response: {meta_res.text}")
+            
+            logger.info(f"[Media {media_id}] Signed URL fetched. Downloading content...")
+
+            now = get_ist_time()
+            year = now.year
+            month = f"{now.month:02d}"
+
+            # Local File Storage
+            dir_rel_path = f"whatsapp_media/{client_id}/{year}/{month}"
+            dir_path = os.path.join("static", dir_rel_path)
+            os.makedirs(dir_path, exist_ok=True)
+
+            # 2. Stream the content into a temp file in the target directory
+            # Note: Sometimes Meta signed URLs don't want the Authorization header.
+            # We'll try with it first, then without if it fails.
+            temp_path = os.path.join(dir_path, f".{uuid.uuid4().hex}.part")
+            try:
                 try:
-                    download_res = await client.get(
-                        signed_url,
+                    file_size, content_type, sha256 = await stream_media_to_file(
+                        meta_client, signed_url, temp_path, media_id,
                         headers={"Authorization": f"Bearer {token}"},
                         timeout=90.0 + (retry * 10)
                     )
-                    download_res.raise_for_status()
                 except httpx.HTTPStatusError as e:
                     if e.response.status_code in [401, 403]:
                         logger.warning(f"[Media {media_id}] Auth failed on CDNs, retrying without Authorization header...")
-                        download_res = await client.get(
-                            signed_url,
+                        file_size, content_type, sha256 = await stream_media_to_file(
+                            meta_client, signed_url, temp_path, media_id,
                             timeout=90.0 + (retry * 10)
                         )
-                        download_res.raise_for_status()
                     else:
                         raise e
 
-                buffer = download_res.content
-                file_size = len(buffer)
-                
-                # Check if we got an error page instead of an image
-                content_type = download_res.headers.get("Content-Type", "").lower()
-                if "text/html" in content_type or "application/json" in content_type:
-                    logger.error(f"[Media {media_id}] Downloaded unexpected content type: {content_type}")
-                    raise ValueError(f"Downloaded {content_type} instead of binary media")
-
                 if file_size < 100: # Files too small are likely errors
                      raise ValueError(f"Downloaded file too small: {file_size} bytes")
-                
+
                 logger.info(f"[Media {media_id}] Downloaded {file_size} bytes ({content_type})")
-                
+
                 # Determine extension
                 ext = mime_type.split("/")[1].split("+")[0] if mime_type else None
                 if not ext:
                     # Fallback to content type from download
                     ext = content_type.split("/")[1] if "/" in content_type else "file"
-                
+
                 timestamp = int(time.time() * 1000)
                 random_str = ''.join(random.choices(string.ascii_lowercase + string.digits, k=6))
-                
+
                 safe_original = None
                 if original_filename:
                     safe_original = "".join([c if c.isalnum() or c in "._-" else "_" for c in original_filename])
-                
+
                 final_filename = safe_original or f"{(message_id or media_id)[-8:]}_{timestamp}_{random_str}.{ext}"
-                
-                now = get_ist_time()
-                year = now.year
-                month = f"{now.month:02d}"
-                
-                # Local File Storage
-                dir_rel_path = f"whatsapp_media/{client_id}/{year}/{month}"
-                dir_path = os.path.join("static", dir_rel_path)
-                os.makedirs(dir_path, exist_ok=True)
-                
-                file_path = os.path.join(dir_path, final_filename)
-                
-                async with aiofiles.open(file_path, 'wb') as f:
-                    await f.write(buffer)
-                
-                public_url = f"{server_url}/static/{dir_rel_path}/{final_filename}"
-                     
-                logger.info(f"[Media {media_id}] ✅ Uploaded to: {public_url}")
-                
-                return {
-                    "url": public_url,
-                    "filename": original_filename or final_filename,
-                    "mimeType": mime_type or content_type,
-                    "size": file_size
-                }
+
+                # Renamed into the content-addressed store and hard-linked at the public path;
+                # readers never see a partial file
+                await media_store.put_file(
+                    client_id, temp_path, sha256, file_size, mime_type or content_type,
+                    f"{dir_rel_path}/{final_filename}"
+                )
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+            public_url = f"{server_url}/static/{dir_rel_path}/{final_filename}"
+                 
+            logger.info(f"[Media {media_id}] ✅ Uploaded to: {public_url}")
+            
+            return {
+                "url": public_url,
+                "filename": original_filename or final_filename,
+                "mimeType": mime_type or content_type,
+                "size": file_size
+            }
 
         except Exception as err:
             last_error = err
             logger.warning(f"[Media {media_id}] Attempt {retry + 1} failed: {err}")
+            if isinstance(err, MediaTooLargeError):
+                break
             if retry < max_retries:
                 await asyncio.sleep(2 * (retry + 1))
                 
@@ -572,15 +678,11 @@ async def upload_media_from_base64(client_id, file_name, mime_type, base64_file)
         file_data = base64.b64decode(base64_file)
         
         dir_rel_path = f"chat_media/{client_id}"
-        dir_path = os.path.join("static", dir_rel_path)
-        os.makedirs(dir_path, exist_ok=True)
         
         timestamp = int(time.time() * 1000)
         final_filename = f"{timestamp}_{file_name}"
-        file_path = os.path.join(dir_path, final_filename)
         
-        async with aiofiles.open(file_path, 'wb') as f:
-            await f.write(file_data)
+        await media_store.put_bytes(client_id, file_data, mime_type, f"{dir_rel_path}/{final_filename}")
         
         server_url = os.getenv("SERVER_URL", "http://localhost:8000").rstrip("/")
         public_url = f"{server_url}/static/{dir_rel_path}/{final_filename}"
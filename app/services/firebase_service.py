@@ -103,6 +103,17 @@ async def sync_message_status(chat_id: str, client_id: str, message_id: str, sta
     except Exception as e:
         logger.error(f"Error updating message status in Firestore: {e}")
 
+async def sync_message_media(chat_id: str, client_id: str, message_id: str, updates: Dict[str, Any]):
+    """Merge media fields (URL, file name, status) into an existing Firestore message."""
+    if not db:
+        return
+
+    try:
+        message_ref = db.collection("chats").document(client_id).collection("data").document(chat_id).collection("messages").document(message_id)
+        message_ref.set(updates, merge=True)
+    except Exception as e:
+        logger.error(f"Error updating message media in Firestore: {e}")
+
 async def sync_broadcast_stats(broadcast_id: str, client_id: str, stats: Dict[str, Any]):
     """Sync broadcast statistics to Firestore."""
     if not db:
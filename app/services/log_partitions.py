@@ -0,0 +1,184 @@
+import logging
+import asyncio
+import os
+import datetime
+from datetime import timezone, timedelta
+from app.database import engine
+from app.models.sql_models import WebhookLog
+from control.models import AppLog
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Native range partitioning for the append-only log tables.
+# webhook_logs is split per IST day and app_logs per UTC month. The maintenance task
+# keeps LOG_PARTITIONS_AHEAD periods created in advance and drops (or detaches)
+# partitions whose whole range is older than the table's retention, so cleanup is a
+# metadata operation instead of a bulk DELETE.
+# A pre-existing unpartitioned table is converted once: it is renamed to <table>_legacy
+# and attached as the partition covering everything before the first new period.
+LOG_PARTITION_MAINTENANCE_INTERVAL = int(os.getenv("LOG_PARTITION_MAINTENANCE_INTERVAL", "3600"))  # seconds
+LOG_PARTITIONS_AHEAD = int(os.getenv("LOG_PARTITIONS_AHEAD", "3"))
+WEBHOOK_LOG_RETENTION_DAYS = int(os.getenv("WEBHOOK_LOG_RETENTION_DAYS", "30"))  # 0 keeps logs forever
+APP_LOG_RETENTION_DAYS = int(os.getenv("APP_LOG_RETENTION_DAYS", "180"))
+WEBHOOK_LOG_EXPIRE_MODE = os.getenv("WEBHOOK_LOG_EXPIRE_MODE", "drop")  # drop | detach
+APP_LOG_EXPIRE_MODE = os.getenv("APP_LOG_EXPIRE_MODE", "drop")
+
+IST = timezone(timedelta(hours=5, minutes=30))
+
+PARTITIONED_TABLES = [
+    {"model": WebhookLog, "period": "day", "tz": IST, "retention_days": WEBHOOK_LOG_RETENTION_DAYS, "expire_mode": WEBHOOK_LOG_EXPIRE_MODE},
+    # app_logs.created_at is a naive UTC timestamp
+    {"model": AppLog, "period": "month", "tz": None, "retention_days": APP_LOG_RETENTION_DAYS, "expire_mode": APP_LOG_EXPIRE_MODE},
+]
+
+PARTITIONS_SQL = text(r"""
+    SELECT child.relname AS name,
+           (regexp_match(pg_get_expr(child.relpartbound, child.oid), 'TO \(''([^'']+)''\)'))[1] AS upper_bound
+    FROM pg_inherits
+    JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+    JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+    WHERE parent.relname = :table
+""")
+
+def now_for(spec):
+    if spec["tz"]:
+        return datetime.datetime.now(spec["tz"])
+    return datetime.datetime.now(timezone.utc).replace(tzinfo=None)
+
+def period_start(spec, moment):
+    start = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if spec["period"] == "month":
+        start = start.replace(day=1)
+    return start
+
+def next_period(spec, start):
+    if spec["period"] == "month":
+        return (start + timedelta(days=32)).replace(day=1)
+    return start + timedelta(days=1)
+
+def partition_name(spec, start):
+    table = spec["model"].__tablename__
+    return f"{table}_p{start:%Y%m}" if spec["period"] == "month" else f"{table}_p{start:%Y%m%d}"
+
+def bound_literal(moment):
+    return moment.isoformat(sep=" ")
+
+def parse_bound(spec, value):
+    if value is None:
+        return None
+    moment = datetime.datetime.fromisoformat(value)
+    if spec["tz"]:
+        return moment.astimezone(spec["tz"])
+    return moment
+
+
+class LogPartitionMaintainer:
+    def __init__(self):
+        self.stats = {"created": 0, "dropped": 0, "detached": 0, "runs": 0}
+        self._task = None
+
+    async def convert_legacy(self, conn, spec):
+        """Turns an existing plain table into a partitioned one, keeping its rows as the _legacy partition."""
+        table = spec["model"].__tablename__
+        legacy = f"{table}_legacy"
+        result = await conn.execute(text("SELECT relkind FROM pg_class WHERE relname = :table AND relnamespace = 'public'::regnamespace"), {"table": table})
+        relkind = result.scalar()
+        if relkind != "r":
+            return
+
+        logger.info(f"🔧 Converting {table} to a partitioned table")
+        await conn.execute(text(f'ALTER TABLE "{table}" RENAME TO "{legacy}"'))
+        result = await conn.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = :table"), {"table": legacy})
+        for index_name in result.scalars().all():
+            await conn.execute(text(f'ALTER INDEX "{index_name}" RENAME TO "{index_name}_legacy"'))
+        await conn.execute(text(f'ALTER SEQUENCE IF EXISTS "{table}_id_seq" RENAME TO "{legacy}_id_seq"'))
+
+        await conn.run_sync(lambda sync_conn: spec["model"].__table__.create(sync_conn))
+        await conn.execute(text(f"""SELECT setval('"{table}_id_seq"', (SELECT coalesce(max(id), 0) + 1 FROM "{legacy}"), false)"""))
+
+        # Legacy rows cover everything up to the end of the period of the newest row (or now)
+        result = await conn.execute(text(f'SELECT max(created_at) FROM "{legacy}"'))
+        newest = result.scalar()
+        current = now_for(spec)
+        if newest is not None and spec["tz"]:
+            newest = newest.astimezone(spec["tz"])
+        upper = next_period(spec, period_start(spec, max(current, newest) if newest else current))
+
+        epoch = datetime.datetime(1970, 1, 1, tzinfo=spec["tz"]) if spec["tz"] else datetime.datetime(1970, 1, 1)
+        await conn.execute(text(f'UPDATE "{legacy}" SET created_at = :epoch WHERE created_at IS NULL'), {"epoch": epoch})
+        await conn.execute(text(f'ALTER TABLE "{legacy}" ALTER COLUMN created_at SET NOT NULL'))
+        await conn.execute(text(f"""ALTER TABLE "{table}" ATTACH PARTITION "{legacy}" FOR VALUES FROM (MINVALUE) TO ('{bound_literal(upper)}')"""))
+
+    async def existing_partitions(self, conn, spec):
+        result = await conn.execute(PARTITIONS_SQL, {"table": spec["model"].__tablename__})
+        return {row.name: parse_bound(spec, row.upper_bound) for row in result.all()}
+
+    async def create_partitions(self, conn, spec, existing):
+        table = spec["model"].__tablename__
+        covered_until = existing.get(f"{table}_legacy")
+        start = period_start(spec, now_for(spec))
+        for _ in range(LOG_PARTITIONS_AHEAD + 1):
+            end = next_period(spec, start)
+            name = partition_name(spec, start)
+            if name not in existing and (covered_until is None or start >= covered_until):
+                await conn.execute(text(
+                    f"""CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table}" FOR VALUES FROM ('{bound_literal(start)}') TO ('{bound_literal(end)}')"""
+                ))
+                self.stats["created"] += 1
+                logger.info(f"🗂️ Created partition {name}")
+            start = end
+
+    async def expire_partitions(self, conn, spec, existing):
+        if not spec["retention_days"]:
+            return
+        table = spec["model"].__tablename__
+        cutoff = now_for(spec) - timedelta(days=spec["retention_days"])
+        for name, upper_bound in existing.items():
+            if upper_bound is None or upper_bound > cutoff:
+                continue
+            if spec["expire_mode"] == "detach":
+                await conn.execute(text(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"'))
+                self.stats["detached"] += 1
+                logger.info(f"🧹 Detached expired partition {name}")
+            else:
+                await conn.execute(text(f'DROP TABLE "{name}"'))
+                self.stats["dropped"] += 1
+                logger.info(f"🧹 Dropped expired partition {name}")
+
+    async def maintain(self):
+        for spec in PARTITIONED_TABLES:
+            # One transaction per table; the advisory lock keeps several processes from racing
+            async with engine.begin() as conn:
+                await conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('log_partitions'))"))
+                await self.convert_legacy(conn, spec)
+                existing = await self.existing_partitions(conn, spec)
+                await self.create_partitions(conn, spec, existing)
+                await self.expire_partitions(conn, spec, existing)
+        self.stats["runs"] += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(LOG_PARTITION_MAINTENANCE_INTERVAL)
+            try:
+                await self.maintain()
+            except Exception as e:
+                logger.error(f"Log partition maintenance error: {e}")
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def get_metrics(self):
+        return {
+            "retentionDays": {spec["model"].__tablename__: spec["retention_days"] for spec in PARTITIONED_TABLES},
+            **self.stats
+        }
+
+log_partitions = LogPartitionMaintainer()
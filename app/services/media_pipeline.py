@@ -0,0 +1,182 @@
+import logging
+import asyncio
+import os
+from app.database import AsyncSessionLocal
+from app.models.sql_models import Message
+from app.services.chat import download_and_upload_media
+from app.services.utils import get_secrets
+from app.services.firebase_service import sync_message_media
+from app.services.websocket_manager import manager
+from sqlalchemy import update, text
+
+logger = logging.getLogger(__name__)
+
+# Inbound media is stored with media_status="pending" and fetched here, off the
+# webhook path. A bounded pool of workers downloads each file, patches the Message
+# row and pushes a Firestore / WebSocket update. Rows left pending (queue full,
+# process restart, worker error) are picked up again by the recovery sweep once
+# their claim is MEDIA_RECOVERY_AGE old. Every process sweeps, so rows are claimed
+# with FOR UPDATE SKIP LOCKED, and each claim counts an attempt: a row still pending
+# after MEDIA_MAX_ATTEMPTS is marked failed instead of being retried forever.
+MEDIA_WORKERS = int(os.getenv("MEDIA_WORKERS", "4"))
+MEDIA_QUEUE_SIZE = int(os.getenv("MEDIA_QUEUE_SIZE", "1000"))
+MEDIA_RECOVERY_INTERVAL = int(os.getenv("MEDIA_RECOVERY_INTERVAL", "300"))  # seconds
+MEDIA_RECOVERY_AGE = int(os.getenv("MEDIA_RECOVERY_AGE", "600"))  # seconds a row may stay pending before re-queueing
+MEDIA_RECOVERY_BATCH = int(os.getenv("MEDIA_RECOVERY_BATCH", "500"))
+MEDIA_MAX_ATTEMPTS = int(os.getenv("MEDIA_MAX_ATTEMPTS", "3"))
+
+# The webhook handler inserts rows already claimed (media_claimed_at = insert time)
+RECOVERY_CLAIM_SQL = text("""
+    UPDATE messages
+    SET media_claimed_at = now(), media_attempts = coalesce(media_attempts, 0) + 1
+    WHERE id IN (
+        SELECT id FROM messages
+        WHERE media_status = 'pending'
+          AND (media_claimed_at IS NULL OR media_claimed_at < now() - make_interval(secs => :age))
+        ORDER BY id
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, client_id, chat_id, whatsapp_message_id, media_id, mime_type, file_name, message_type, media_attempts
+""")
+
+def failed_media_text(message_type, file_name):
+    if message_type == "document":
+        return f"[Failed to save document: {file_name or 'document'}]"
+    if message_type in ("audio", "voice"):
+        return "[Failed to save audio]"
+    return f"[Failed to save {message_type}]"
+
+def media_job_from_message(message):
+    return {
+        "id": message.id,
+        "clientId": message.client_id,
+        "chatId": message.chat_id,
+        "whatsappMessageId": message.whatsapp_message_id,
+        "mediaId": message.media_id,
+        "mimeType": message.mime_type,
+        "fileName": message.file_name,
+        "messageType": message.message_type,
+        "attempts": message.media_attempts or 1,
+    }
+
+
+class MediaPipeline:
+    def __init__(self):
+        self.queue = None
+        self.workers = []
+        self.pending_ids = set()
+        self.stats = {"queued": 0, "ready": 0, "failed": 0, "deferred": 0}
+        self._recovery_task = None
+
+    def submit(self, job):
+        """Queues a media job without blocking the caller. When full, the recovery sweep retries it later."""
+        if self.queue is None or job["id"] in self.pending_ids:
+            return
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.stats["deferred"] += 1
+            logger.warning(f"Media queue full, deferring message {job['id']} to recovery sweep")
+            return
+        self.pending_ids.add(job["id"])
+        self.stats["queued"] += 1
+
+    async def process(self, job):
+        uploaded = None
+        secrets = None
+        if job["attempts"] > MEDIA_MAX_ATTEMPTS:
+            logger.warning(f"[Media {job['mediaId']}] Giving up on message {job['id']} after {MEDIA_MAX_ATTEMPTS} attempts")
+        else:
+            secrets = await get_secrets(job["clientId"])
+        if secrets:
+            uploaded = await download_and_upload_media(
+                job["clientId"], secrets, job["mediaId"], job["mimeType"], job["fileName"], job["whatsappMessageId"]
+            )
+
+        if uploaded:
+            values = {"media_url": uploaded["url"], "file_name": uploaded["filename"], "media_status": "ready"}
+            firestore_updates = {"mediaUrl": uploaded["url"], "fileName": uploaded["filename"], "mediaStatus": "ready"}
+            self.stats["ready"] += 1
+        else:
+            content = failed_media_text(job["messageType"], job["fileName"])
+            values = {"content": content, "media_status": "failed"}
+            firestore_updates = {"content": content, "mediaStatus": "failed"}
+            self.stats["failed"] += 1
+
+        async with AsyncSessionLocal() as session:
+            await session.execute(update(Message).where(Message.id == job["id"]).values(**values))
+            await session.commit()
+
+        await sync_message_media(job["chatId"], job["clientId"], job["whatsappMessageId"], firestore_updates)
+        await manager.broadcast_to_client(job["clientId"], {
+            "type": "media_update",
+            "chatId": job["chatId"],
+            "whatsappMessageId": job["whatsappMessageId"],
+            "media_status": values["media_status"],
+            "media_url": values.get("media_url"),
+            "file_name": values.get("file_name"),
+            "content": values.get("content"),
+        })
+        logger.info(f"[Media {job['mediaId']}] Message {job['id']} media {values['media_status']}")
+
+    async def worker(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self.process(job)
+            except Exception as e:
+                # Row stays pending; the recovery sweep will retry it
+                logger.error(f"Media pipeline error for message {job['id']}: {e}")
+            finally:
+                self.pending_ids.discard(job["id"])
+                self.queue.task_done()
+
+    async def recover(self):
+        """Claims pending rows whose last claim is older than MEDIA_RECOVERY_AGE and queues them."""
+        # Only claim what the queue can take now; a claimed row waits a full age otherwise
+        limit = min(MEDIA_RECOVERY_BATCH, self.queue.maxsize - self.queue.qsize()) if self.queue else 0
+        if limit <= 0:
+            return
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(RECOVERY_CLAIM_SQL, {"age": MEDIA_RECOVERY_AGE, "limit": limit})
+            messages = result.all()
+            await session.commit()
+        for message in messages:
+            self.submit(media_job_from_message(message))
+        if messages:
+            logger.info(f"♻️ Re-queued {len(messages)} pending media download(s)")
+
+    async def _recovery_loop(self):
+        while True:
+            try:
+                await self.recover()
+            except Exception as e:
+                logger.error(f"Media recovery error: {e}")
+            await asyncio.sleep(MEDIA_RECOVERY_INTERVAL)
+
+    def start(self):
+        if self.workers:
+            return
+        self.queue = asyncio.Queue(maxsize=MEDIA_QUEUE_SIZE)
+        self.workers = [asyncio.create_task(self.worker()) for _ in range(MEDIA_WORKERS)]
+        self._recovery_task = asyncio.create_task(self._recovery_loop())
+        logger.info(f"🚀 Media pipeline started with {MEDIA_WORKERS} worker(s)")
+
+    async def stop(self):
+        tasks = [*self.workers, self._recovery_task] if self._recovery_task else list(self.workers)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.workers = []
+        self._recovery_task = None
+
+    def get_metrics(self):
+        return {
+            "workers": len(self.workers),
+            "queueDepth": self.queue.qsize() if self.queue else 0,
+            "inFlight": len(self.pending_ids),
+            **self.stats
+        }
+
+media_pipeline = MediaPipeline()
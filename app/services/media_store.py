@@ -0,0 +1,175 @@
+import logging
+import os
+import shutil
+import uuid
+import aiofiles
+import hashlib
+from app.database import AsyncSessionLocal
+from app.models.sql_models import MediaBlob, MediaAlias
+from sqlalchemy.future import select
+from sqlalchemy import update, delete, func, text
+
+logger = logging.getLogger(__name__)
+
+# Content-addressed media storage.
+# Each distinct file is stored once under static/media_store/ab/cd/<sha256>. The public
+# per-tenant paths (whatsapp_media/..., chat_media/...) are hard links to that blob, so
+# existing URLs keep working while a forwarded image stored a thousand times takes the
+# disk space of one. media_blobs.ref_count tracks the number of aliases per blob. Chat
+# media is never deleted, so there is no size- or age-based eviction: media a chat points
+# at is kept indefinitely. The only way a blob loses its last reference is an alias being
+# re-pointed to other content, and put_file deletes such a blob right away.
+MEDIA_STORE_DIR = "media_store"
+
+UPSERT_BLOB_SQL = text("""
+    INSERT INTO media_blobs (sha256, size, mime_type, ref_count, created_at, last_used_at)
+    VALUES (:sha256, :size, :mime_type, 1, now(), now())
+    ON CONFLICT (sha256) DO UPDATE
+    SET ref_count = media_blobs.ref_count + 1, last_used_at = now()
+    RETURNING (xmax = 0) AS inserted
+""")
+
+# Re-pointing an existing alias returns the blob it used to reference
+UPSERT_ALIAS_SQL = text("""
+    WITH previous AS (
+        SELECT sha256 FROM media_aliases WHERE path = :path FOR UPDATE
+    )
+    INSERT INTO media_aliases (path, sha256, client_id, created_at)
+    VALUES (:path, :sha256, :client_id, now())
+    ON CONFLICT (path) DO UPDATE SET sha256 = EXCLUDED.sha256, client_id = EXCLUDED.client_id
+    RETURNING (SELECT sha256 FROM previous) AS previous_sha256
+""")
+
+def blob_rel_path(sha256: str):
+    return f"{MEDIA_STORE_DIR}/{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class MediaStore:
+    def __init__(self):
+        self.stats = {"stored": 0, "deduplicated": 0, "bytesSaved": 0, "evicted": 0, "bytesEvicted": 0}
+
+    def _link_alias(self, blob_path, alias_path):
+        """Hard-links the alias to the blob, atomically replacing whatever was at that path."""
+        os.makedirs(os.path.dirname(alias_path), exist_ok=True)
+        temp_path = f"{alias_path}.{uuid.uuid4().hex}.link"
+        try:
+            os.link(blob_path, temp_path)
+        except OSError:
+            # Filesystem without hard links: fall back to a private copy
+            shutil.copyfile(blob_path, temp_path)
+        os.replace(temp_path, alias_path)
+
+    async def put_file(self, client_id, temp_path, sha256, size, mime_type, alias_rel_path):
+        """
+        Moves a fully written temp file into the store and exposes it at static/<alias_rel_path>.
+        The temp file must be on the same filesystem as static/ (it is renamed, not copied).
+        """
+        blob_path = os.path.join("static", blob_rel_path(sha256))
+
+        # Reference the blob first: from then on evict() skips it (it only deletes
+        # unreferenced blobs not used since they were released)
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(UPSERT_BLOB_SQL, {"sha256": sha256, "size": size, "mime_type": mime_type})
+            inserted = result.scalar()
+            result = await session.execute(UPSERT_ALIAS_SQL, {"path": alias_rel_path, "sha256": sha256, "client_id": client_id})
+            previous_sha256 = result.scalar()
+            released = None
+            if previous_sha256:
+                # The alias was already counted against a blob (possibly this one): drop that reference
+                result = await session.execute(
+                    update(MediaBlob)
+                    .where(MediaBlob.sha256 == previous_sha256)
+                    .values(ref_count=MediaBlob.ref_count - 1)
+                    .returning(MediaBlob.sha256, MediaBlob.size, MediaBlob.ref_count, MediaBlob.last_used_at)
+                )
+                released = result.first()
+            await session.commit()
+
+        # An eviction of the blob just before our reference may still remove its file;
+        # the temp file is kept until the alias is linked so it can be restored
+        alias_path = os.path.join("static", alias_rel_path)
+        try:
+            if not os.path.exists(blob_path):
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                os.replace(temp_path, blob_path)
+            try:
+                self._link_alias(blob_path, alias_path)
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                os.replace(temp_path, blob_path)
+                self._link_alias(blob_path, alias_path)
+        finally:
+            remove_file(temp_path)
+
+        if inserted:
+            self.stats["stored"] += 1
+        else:
+            self.stats["deduplicated"] += 1
+            self.stats["bytesSaved"] += size
+            logger.info(f"♻️ Media {sha256[:12]} already stored, linked {alias_rel_path}")
+
+        if released and released.ref_count <= 0:
+            try:
+                async with AsyncSessionLocal() as session:
+                    await self.evict(session, released)
+            except Exception as e:
+                logger.error(f"Failed to delete unreferenced media {released.sha256[:12]}: {e}")
+
+    async def put_bytes(self, client_id, data: bytes, mime_type, alias_rel_path):
+        os.makedirs(os.path.join("static", MEDIA_STORE_DIR), exist_ok=True)
+        temp_path = os.path.join("static", MEDIA_STORE_DIR, f".{uuid.uuid4().hex}.part")
+        try:
+            async with aiofiles.open(temp_path, 'wb') as f:
+                await f.write(data)
+            await self.put_file(client_id, temp_path, hashlib.sha256(data).hexdigest(), len(data), mime_type, alias_rel_path)
+        finally:
+            remove_file(temp_path)
+
+    async def evict(self, session, blob):
+        """Deletes an unreferenced blob and its alias rows. Skips blobs referenced again since they were released."""
+        result = await session.execute(
+            delete(MediaBlob)
+            .where(
+                MediaBlob.sha256 == blob.sha256,
+                MediaBlob.ref_count <= 0,
+                MediaBlob.last_used_at <= blob.last_used_at
+            )
+            .returning(MediaBlob.sha256)
+        )
+        if result.scalar() is None:
+            return False
+        result = await session.execute(
+            delete(MediaAlias).where(MediaAlias.sha256 == blob.sha256).returning(MediaAlias.path)
+        )
+        alias_paths = result.scalars().all()
+        await session.commit()
+
+        for alias_path in alias_paths:
+            remove_file(os.path.join("static", alias_path))
+        remove_file(os.path.join("static", blob_rel_path(blob.sha256)))
+        self.stats["evicted"] += 1
+        self.stats["bytesEvicted"] += blob.size
+        return True
+
+    async def get_metrics(self):
+        usage = {}
+        try:
+            async with AsyncSessionLocal() as session:
+                row = (await session.execute(
+                    select(func.count(MediaBlob.sha256), func.coalesce(func.sum(MediaBlob.size), 0), func.coalesce(func.sum(MediaBlob.ref_count), 0))
+                )).one()
+                usage = {"blobs": row[0], "bytes": int(row[1]), "references": int(row[2])}
+        except Exception as e:
+            logger.error(f"Media store metrics error: {e}")
+        return {
+            **usage,
+            **self.stats
+        }
+
+media_store = MediaStore()
@@ -0,0 +1,198 @@
+import logging
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# One pooled httpx client for every Graph API call (and the media CDN downloads that
+# follow them). Connections to graph.facebook.com are kept alive and, with h2
+# installed, multiplexed over HTTP/2, so a send no longer pays TCP+TLS setup.
+# Each call names an endpoint kind that picks its timeout; idempotent calls (GET)
+# are retried with full-jitter backoff on transport errors, 429 and 5xx. Other
+# methods are only retried when the connection could not be opened, since the
+# request never reached Meta.
+META_HTTP2 = os.getenv("META_HTTP2", "true").lower() == "true"
+META_MAX_CONNECTIONS = int(os.getenv("META_MAX_CONNECTIONS", "100"))
+META_MAX_KEEPALIVE = int(os.getenv("META_MAX_KEEPALIVE", "20"))
+META_KEEPALIVE_EXPIRY = float(os.getenv("META_KEEPALIVE_EXPIRY", "60"))  # seconds
+META_CONNECT_TIMEOUT = float(os.getenv("META_CONNECT_TIMEOUT", "5"))  # seconds
+META_MAX_RETRIES = int(os.getenv("META_MAX_RETRIES", "2"))
+META_RETRY_BASE_DELAY = float(os.getenv("META_RETRY_BASE_DELAY", "0.5"))  # seconds
+META_RETRY_MAX_DELAY = float(os.getenv("META_RETRY_MAX_DELAY", "30"))  # cap for Retry-After
+# Serve every call from meta_stub/main.py in-process (benchmarks, offline runs)
+META_STUB_IN_PROCESS = os.getenv("META_STUB_IN_PROCESS", "false").lower() == "true"
+
+# Read/write/pool timeout per endpoint kind, in seconds
+META_TIMEOUTS = {
+    "send": float(os.getenv("META_SEND_TIMEOUT", "15")),
+    "default": float(os.getenv("META_DEFAULT_TIMEOUT", "30")),
+    "analytics": float(os.getenv("META_ANALYTICS_TIMEOUT", "30")),
+    "upload": float(os.getenv("META_UPLOAD_TIMEOUT", "60")),
+    "download": float(os.getenv("META_DOWNLOAD_TIMEOUT", "90")),
+}
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+LATENCY_SAMPLES = 500
+
+def http2_available():
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class MetaClient:
+    def __init__(self):
+        self._client = None
+        self.http2 = False
+        self.stats = {
+            "requests": 0,
+            "errors": 0,
+            "retries": 0,
+            "connectionsOpened": 0,
+            "http2Responses": 0,
+        }
+        self.latency = {}  # endpoint kind -> deque of recent latencies in ms
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created on first use so scripts and the CLI tools work without start()
+        if self._client is None:
+            self.start()
+        return self._client
+
+    def start(self):
+        if self._client is not None:
+            return
+        self.http2 = META_HTTP2 and http2_available()
+        if META_HTTP2 and not self.http2:
+            logger.warning("META_HTTP2 is enabled but the h2 package is missing; using HTTP/1.1")
+        transport = None
+        if META_STUB_IN_PROCESS:
+            from meta_stub.main import app as stub_app
+            transport = httpx.ASGITransport(app=stub_app)
+            logger.warning("⚠️ Meta API calls are served by the in-process stub")
+        self._client = httpx.AsyncClient(
+            transport=transport,
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=META_MAX_CONNECTIONS,
+                max_keepalive_connections=META_MAX_KEEPALIVE,
+                keepalive_expiry=META_KEEPALIVE_EXPIRY,
+            ),
+            timeout=self.timeout_for("default"),
+        )
+
+    async def stop(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def timeout_for(self, kind, timeout=None):
+        return httpx.Timeout(timeout or META_TIMEOUTS.get(kind, META_TIMEOUTS["default"]), connect=META_CONNECT_TIMEOUT)
+
+    async def _trace(self, event_name, info):
+        # httpcore emits this once per new TCP connection; reused connections skip it
+        if event_name == "connection.connect_tcp.complete":
+            self.stats["connectionsOpened"] += 1
+
+    def _record(self, kind, started, response=None):
+        self.stats["requests"] += 1
+        samples = self.latency.get(kind)
+        if samples is None:
+            samples = self.latency[kind] = deque(maxlen=LATENCY_SAMPLES)
+        samples.append((time.monotonic() - started) * 1000)
+        if response is not None and response.http_version == "HTTP/2":
+            self.stats["http2Responses"] += 1
+
+    def _backoff(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), META_RETRY_MAX_DELAY)
+        return random.uniform(0, META_RETRY_BASE_DELAY * (2 ** attempt))
+
+    async def request(self, method, url, *, kind="default", timeout=None, retries=None, **kwargs):
+        """
+        Sends one Graph API request through the shared pool and returns the response.
+        Callers keep their own raise_for_status(); the last response is returned even
+        when every retry came back 429/5xx.
+        """
+        method = method.upper()
+        idempotent = method in IDEMPOTENT_METHODS
+        retries = META_MAX_RETRIES if retries is None else retries
+        extensions = {"trace": self._trace}
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                response = await self.client.request(
+                    method, url, timeout=self.timeout_for(kind, timeout), extensions=extensions, **kwargs
+                )
+            except httpx.TransportError as e:
+                self._record(kind, started)
+                self.stats["errors"] += 1
+                if attempt >= retries or not (idempotent or isinstance(e, CONNECT_ERRORS)):
+                    raise
+                delay = self._backoff(attempt)
+            else:
+                self._record(kind, started, response)
+                if not (idempotent and response.status_code in RETRY_STATUSES and attempt < retries):
+                    return response
+                delay = self._backoff(attempt, response)
+            attempt += 1
+            self.stats["retries"] += 1
+            logger.warning(f"Meta API {method} {kind} retry {attempt}/{retries} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def delete(self, url, **kwargs):
+        return await self.request("DELETE", url, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method, url, *, kind="download", timeout=None, **kwargs):
+        """Streaming variant for media downloads; latency covers the whole body."""
+        started = time.monotonic()
+        response = None
+        try:
+            async with self.client.stream(
+                method, url, timeout=self.timeout_for(kind, timeout), extensions={"trace": self._trace}, **kwargs
+            ) as response:
+                yield response
+        except httpx.TransportError:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            self._record(kind, started, response)
+
+    def get_metrics(self):
+        requests = self.stats["requests"]
+        latency = {}
+        for kind, samples in self.latency.items():
+            ordered = sorted(samples)
+            latency[kind] = {
+                "samples": len(ordered),
+                "avgMs": round(sum(ordered) / len(ordered), 1),
+                "p50Ms": round(ordered[len(ordered) // 2], 1),
+                "p95Ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1),
+            }
+        return {
+            "http2": self.http2,
+            **self.stats,
+            "connectionReuseRatio": round(max(0.0, 1 - self.stats["connectionsOpened"] / requests), 3) if requests else 0.0,
+            "latency": latency
+        }
+
+meta_client = MetaClient()
@@ -0,0 +1,90 @@
+import logging
+import asyncio
+import os
+import asyncpg
+from app.database import AsyncSessionLocal, DATABASE_URL
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Postgres LISTEN/NOTIFY fan-out between API workers.
+# Caches that are invalidated locally (tenant registry, app config) also publish a
+# NOTIFY so every other process drops its copy. The listener keeps one dedicated
+# asyncpg connection outside the SQLAlchemy pool and reconnects if it drops.
+PG_NOTIFY_ENABLED = os.getenv("PG_NOTIFY_ENABLED", "false").lower() == "true"
+PG_NOTIFY_RECONNECT_DELAY = float(os.getenv("PG_NOTIFY_RECONNECT_DELAY", "5"))  # seconds
+
+
+class PgNotifyListener:
+    def __init__(self):
+        self.handlers = {}  # channel -> [callback(payload)]
+        self.stats = {"published": 0, "received": 0, "reconnects": 0}
+        self._task = None
+        self._connected = False
+
+    def subscribe(self, channel: str, callback):
+        """Registers a sync callback(payload: str) for a channel. Call before start()."""
+        self.handlers.setdefault(channel, []).append(callback)
+
+    async def publish(self, channel: str, payload: str = ""):
+        if not PG_NOTIFY_ENABLED:
+            return
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": channel, "payload": payload})
+                await session.commit()
+            self.stats["published"] += 1
+        except Exception as e:
+            logger.error(f"pg_notify publish error on {channel}: {e}")
+
+    def _dispatch(self, connection, pid, channel, payload):
+        self.stats["received"] += 1
+        for callback in self.handlers.get(channel, []):
+            try:
+                callback(payload)
+            except Exception as e:
+                logger.error(f"pg_notify handler error on {channel}: {e}")
+
+    async def _run(self):
+        dsn = DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://", 1)
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(dsn)
+                closed = asyncio.Event()
+                connection.add_termination_listener(lambda _: closed.set())
+                for channel in self.handlers:
+                    await connection.add_listener(channel, self._dispatch)
+                self._connected = True
+                logger.info(f"📡 Listening for notifications on {', '.join(self.handlers)}")
+                await closed.wait()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"pg_notify listener error: {e}")
+            finally:
+                self._connected = False
+                if connection and not connection.is_closed():
+                    await connection.close()
+            self.stats["reconnects"] += 1
+            await asyncio.sleep(PG_NOTIFY_RECONNECT_DELAY)
+
+    def start(self):
+        if PG_NOTIFY_ENABLED and self.handlers and not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def get_metrics(self):
+        return {
+            "enabled": PG_NOTIFY_ENABLED,
+            "connected": self._connected,
+            "channels": list(self.handlers),
+            **self.stats
+        }
+
+pg_notify = PgNotifyListener()
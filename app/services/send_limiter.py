@@ -0,0 +1,176 @@
+import logging
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from app.services.meta_client import meta_client
+
+logger = logging.getLogger(__name__)
+
+# Outbound pacing per WhatsApp number. Every POST to /{phoneNumberId}/messages
+# (broadcasts, agent and AI replies, read receipts) takes a token from that number's
+# bucket, so they share one budget instead of racing each other.
+# The refill rate follows AIMD: each accepted send nudges it up by
+# SEND_RATE_INCREASE per second of sending, each throttle (HTTP 429 or a throughput
+# error code) multiplies it by SEND_RATE_DECREASE and, with Retry-After, pauses the
+# number. The pair rate limit (131056) concerns one recipient only: it puts that
+# sender/recipient pair on a cooldown and leaves the number's rate alone. Throttled
+# sends are retried a few times before the error is returned to the caller. Buckets
+# and cooldowns are per process.
+SEND_RATE_INITIAL = float(os.getenv("SEND_RATE_INITIAL", "20"))  # messages per second
+SEND_RATE_MIN = float(os.getenv("SEND_RATE_MIN", "1"))
+SEND_RATE_MAX = float(os.getenv("SEND_RATE_MAX", "80"))  # Meta's default throughput tier
+SEND_RATE_INCREASE = float(os.getenv("SEND_RATE_INCREASE", "1"))
+SEND_RATE_DECREASE = float(os.getenv("SEND_RATE_DECREASE", "0.5"))
+SEND_THROTTLE_RETRIES = int(os.getenv("SEND_THROTTLE_RETRIES", "2"))
+SEND_THROTTLE_DELAY = float(os.getenv("SEND_THROTTLE_DELAY", "1"))  # seconds, when Meta sends no Retry-After
+
+# Meta error codes that mean "slow down"
+THROTTLE_CODES = {
+    4,       # application request limit
+    80007,   # WABA rate limit
+    130429,  # cloud API throughput reached
+    131048,  # spam rate limit
+}
+PAIR_RATE_LIMIT_CODE = 131056  # pair rate limit (same sender/recipient)
+PAIR_RATE_LIMIT_DELAY = 6.0  # Meta allows about one message per pair every 6 seconds
+
+def meta_error_code(response):
+    try:
+        return (response.json().get("error") or {}).get("code")
+    except Exception:
+        return None
+
+
+class TokenBucket:
+    def __init__(self):
+        self.rate = SEND_RATE_INITIAL
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+        self.stats = {"sent": 0, "throttled": 0, "waitSeconds": 0.0}
+        self.last_throttle = None
+
+    def _refill(self, now):
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        # The lock keeps waiters in FIFO order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                self.stats["waitSeconds"] += wait
+                await asyncio.sleep(wait)
+
+    def on_success(self):
+        self.stats["sent"] += 1
+        self.rate = min(SEND_RATE_MAX, self.rate + SEND_RATE_INCREASE / self.rate)
+
+    def on_throttle(self, code, retry_after):
+        now = time.monotonic()
+        self.stats["throttled"] += 1
+        self.rate = max(SEND_RATE_MIN, self.rate * SEND_RATE_DECREASE)
+        self.tokens = 0.0
+        self.updated = now
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+        self.last_throttle = {"code": code, "retryAfter": retry_after, "at": time.time()}
+
+    def to_dict(self):
+        return {
+            "rate": round(self.rate, 2),
+            "tokens": round(self.tokens, 2),
+            "blockedForSeconds": round(max(0.0, self.blocked_until - time.monotonic()), 2),
+            **self.stats,
+            "waitSeconds": round(self.stats["waitSeconds"], 2),
+            "lastThrottle": self.last_throttle
+        }
+
+
+class SendRateLimiter:
+    def __init__(self):
+        self.buckets = {}  # phoneNumberId -> TokenBucket
+        self.pair_cooldowns = OrderedDict()  # (phoneNumberId, recipient) -> cooldown end, oldest first
+        self.stats = {"pairThrottled": 0}
+
+    def bucket(self, phone_number_id) -> TokenBucket:
+        bucket = self.buckets.get(phone_number_id)
+        if bucket is None:
+            bucket = self.buckets[phone_number_id] = TokenBucket()
+        return bucket
+
+    def _cool_pair(self, pair, seconds):
+        now = time.monotonic()
+        self.pair_cooldowns.pop(pair, None)
+        self.pair_cooldowns[pair] = now + seconds
+        # Cooldowns are about the same length, so expired ones sit at the front
+        while self.pair_cooldowns and next(iter(self.pair_cooldowns.values())) <= now:
+            self.pair_cooldowns.popitem(last=False)
+
+    async def post(self, phone_number_id, url, **kwargs):
+        """
+        Paced POST to a /messages endpoint through the shared Meta client.
+        Returns the last response; callers keep their own raise_for_status().
+        """
+        bucket = self.bucket(phone_number_id)
+        recipient = (kwargs.get("json") or {}).get("to")
+        pair = (phone_number_id, recipient) if recipient else None
+        attempt = 0
+        while True:
+            if pair:
+                # Wait out this recipient's cooldown before taking a token from the number
+                wait = self.pair_cooldowns.get(pair, 0.0) - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            await bucket.acquire()
+            response = await meta_client.post(url, kind="send", **kwargs)
+            code = meta_error_code(response) if response.status_code >= 400 else None
+            throttled = response.status_code == 429 or code in THROTTLE_CODES
+            if not throttled and code != PAIR_RATE_LIMIT_CODE:
+                if response.status_code < 400:
+                    bucket.on_success()
+                return response
+
+            retry_after = response.headers.get("Retry-After")
+            retry_after = float(retry_after) if retry_after and retry_after.isdigit() else None
+            if throttled:
+                bucket.on_throttle(code or 429, retry_after)
+                logger.warning(
+                    f"🚦 Meta throttled {phone_number_id} (code {code or 429}); rate now {bucket.rate:.1f}/s"
+                )
+                # With Retry-After the bucket itself is blocked
+                delay = 0 if retry_after else SEND_THROTTLE_DELAY
+            else:
+                # One chatty recipient must not slow the whole number down
+                self.stats["pairThrottled"] += 1
+                delay = retry_after or PAIR_RATE_LIMIT_DELAY
+                logger.warning(f"🚦 Pair rate limit for {phone_number_id} -> {recipient}; cooling down {delay:.0f}s")
+                if pair:
+                    # Waited out at the top of the loop, by this and any other send to the pair
+                    self._cool_pair(pair, delay)
+                    delay = 0
+            if attempt >= SEND_THROTTLE_RETRIES:
+                return response
+            attempt += 1
+            if delay:
+                await asyncio.sleep(delay)
+
+    def get_metrics(self):
+        return {
+            "numbers": {phone_number_id: bucket.to_dict() for phone_number_id, bucket in self.buckets.items()},
+            "throttled": sum(bucket.stats["throttled"] for bucket in self.buckets.values()),
+            "pairCooldowns": len(self.pair_cooldowns),
+            **self.stats,
+            "sent": sum(bucket.stats["sent"] for bucket in self.buckets.values())
+        }
+
+send_limiter = SendRateLimiter()
@@ -0,0 +1,280 @@
+import logging
+import asyncio
+import base64
+import json
+import os
+import datetime
+from app.database import AsyncSessionLocal, engine
+from app.models.sql_models import Template, Client
+from app.services.whatsapp_meta import get_meta_templates
+from app.services.template_renderer import template_renderer
+from sqlalchemy.future import select
+from sqlalchemy import delete, tuple_, text
+from sqlalchemy.dialects.postgresql import insert
+from datetime import timezone, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Local copy of every WABA's message templates in the templates table.
+# The template list endpoints read from here instead of calling Meta per request.
+# A background sync pages through each WABA's templates (several WABAs at once, the
+# next page is fetched while the previous one is upserted) and drops rows Meta no
+# longer returns. Between syncs, template status/category webhooks update rows in
+# place. The Meta API is only needed for creating and deleting templates.
+TEMPLATE_SYNC_INTERVAL = int(os.getenv("TEMPLATE_SYNC_INTERVAL", "3600"))  # seconds
+TEMPLATE_SYNC_CONCURRENCY = int(os.getenv("TEMPLATE_SYNC_CONCURRENCY", "4"))  # WABAs synced at once
+TEMPLATE_SYNC_PAGE_SIZE = int(os.getenv("TEMPLATE_SYNC_PAGE_SIZE", "100"))
+
+TEMPLATE_FIELDS = "id,name,status,category,language,components"
+MEDIA_HEADER_FORMATS = ["IMAGE", "VIDEO", "DOCUMENT"]
+DEFAULT_PAGE_SIZE = 25  # Meta's default for message_templates
+
+def get_ist_time():
+    return datetime.datetime.now(timezone(timedelta(hours=5, minutes=30)))
+
+def header_format(components):
+    for comp in components or []:
+        if isinstance(comp, dict) and comp.get("type") == "HEADER":
+            return (comp.get("format") or "TEXT").upper()
+    return None
+
+def template_to_dict(template, fields=None):
+    """Same shape as a message_templates entry from the Graph API."""
+    data = {
+        "id": template.id,
+        "name": template.name,
+        "status": template.status,
+        "category": template.category,
+        "language": template.language,
+        "components": template.components or [],
+    }
+    if fields:
+        wanted = set(fields) | {"id"}
+        data = {key: value for key, value in data.items() if key in wanted}
+    return data
+
+def encode_cursor(template):
+    return base64.urlsafe_b64encode(json.dumps([template.name or "", template.id]).encode()).decode()
+
+def decode_cursor(cursor):
+    name, template_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return name, template_id
+
+
+class TemplateCatalog:
+    def __init__(self):
+        self.loaded = set()   # client ids known to have a catalog
+        self._syncing = {}    # client_id -> Future, so concurrent first reads share one sync
+        self.stats = {"syncs": 0, "syncErrors": 0, "templatesUpserted": 0, "templatesRemoved": 0}
+        self.last_sync = {}   # client_id -> {"at", "templates"} or {"at", "error"}
+        self._task = None
+
+    async def _upsert(self, client_id, rows):
+        if not rows:
+            return
+        now = get_ist_time()
+        values = [{
+            "id": str(row["id"]),
+            "client_id": client_id,
+            "name": row.get("name"),
+            "status": row.get("status"),
+            "category": row.get("category"),
+            "language": row.get("language"),
+            "components": row.get("components") or [],
+            "header_format": header_format(row.get("components")),
+            "updated_at": now,
+        } for row in rows if row.get("id")]
+        stmt = insert(Template).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Template.id],
+            set_={column: stmt.excluded[column] for column in values[0] if column != "id"}
+        )
+        async with AsyncSessionLocal() as session:
+            await session.execute(stmt)
+            await session.commit()
+        self.stats["templatesUpserted"] += len(values)
+
+    async def _fetch_page(self, client_id, after):
+        page = await get_meta_templates(client_id, limit=TEMPLATE_SYNC_PAGE_SIZE, after=after, fields=TEMPLATE_FIELDS)
+        if not isinstance(page, dict) or "error" in page or "data" not in page:
+            raise RuntimeError(f"Template fetch failed: {page.get('error') if isinstance(page, dict) else page}")
+        return page
+
+    async def _sync(self, client_id):
+        seen = set()
+        after = None
+        write = None
+        try:
+            while True:
+                page = await self._fetch_page(client_id, after)
+                if write:
+                    await write
+                rows = page["data"]
+                seen.update(str(row["id"]) for row in rows if row.get("id"))
+                # Upsert this page while the next one is being fetched
+                write = asyncio.create_task(self._upsert(client_id, rows))
+                paging = page.get("paging") or {}
+                after = (paging.get("cursors") or {}).get("after") if paging.get("next") else None
+                if not after:
+                    break
+            await write
+            write = None
+
+            async with AsyncSessionLocal() as session:
+                query = delete(Template).where(Template.client_id == client_id)
+                if seen:
+                    query = query.where(Template.id.not_in(seen))
+                result = await session.execute(query)
+                await session.commit()
+            self.stats["templatesRemoved"] += result.rowcount or 0
+        except Exception as e:
+            self.stats["syncErrors"] += 1
+            self.last_sync[client_id] = {"at": get_ist_time().isoformat(), "error": str(e)}
+            raise
+        finally:
+            if write:
+                write.cancel()
+
+        self.loaded.add(client_id)
+        self.stats["syncs"] += 1
+        await template_renderer.invalidate_everywhere(client_id=client_id)
+        self.last_sync[client_id] = {"at": get_ist_time().isoformat(), "templates": len(seen)}
+        logger.info(f"📋 Synced {len(seen)} templates for {client_id}")
+
+    async def sync_client(self, client_id):
+        future = self._syncing.get(client_id)
+        if future is None:
+            future = asyncio.ensure_future(self._sync(client_id))
+            self._syncing[client_id] = future
+            future.add_done_callback(lambda _: self._syncing.pop(client_id, None))
+        await asyncio.shield(future)
+
+    def schedule_sync(self, client_id):
+        async def run():
+            try:
+                await self.sync_client(client_id)
+            except Exception as e:
+                logger.error(f"Template sync failed for {client_id}: {e}")
+        asyncio.create_task(run())
+
+    async def sync_all(self):
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(select(Client.client_id).where(Client.waba_id.isnot(None)))
+            client_ids = result.scalars().all()
+
+        slots = asyncio.Semaphore(TEMPLATE_SYNC_CONCURRENCY)
+        async def sync_one(client_id):
+            async with slots:
+                try:
+                    await self.sync_client(client_id)
+                except Exception as e:
+                    logger.error(f"Template sync failed for {client_id}: {e}")
+        await asyncio.gather(*(sync_one(client_id) for client_id in client_ids))
+
+    async def ensure_loaded(self, client_id):
+        """Syncs a client inline the first time it is read and has no rows yet."""
+        if client_id in self.loaded:
+            return
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(select(Template.id).where(Template.client_id == client_id).limit(1))
+            exists = result.first() is not None
+        if not exists:
+            await self.sync_client(client_id)
+        self.loaded.add(client_id)
+
+    async def list_templates(self, client_id, status=None, category=None, language=None, header_formats=None,
+                             limit=None, after=None, before=None, fields=None):
+        """
+        Filtered, name-ordered page of the local catalog in the Graph API response shape.
+        With no limit every matching template is returned and paging is omitted.
+        """
+        await self.ensure_loaded(client_id)
+
+        query = select(Template).where(Template.client_id == client_id)
+        if status:
+            query = query.where(Template.status == status.upper())
+        if category:
+            query = query.where(Template.category == category.upper())
+        if language:
+            query = query.where(Template.language == language)
+        if header_formats:
+            query = query.where(Template.header_format.in_([f.upper() for f in header_formats]))
+
+        key = tuple_(Template.name, Template.id)
+        backwards = bool(before) and not after
+        if after:
+            query = query.where(key > tuple_(*decode_cursor(after)))
+        elif before:
+            query = query.where(key < tuple_(*decode_cursor(before)))
+        if backwards:
+            query = query.order_by(Template.name.desc(), Template.id.desc())
+        else:
+            query = query.order_by(Template.name, Template.id)
+        if limit:
+            query = query.limit(limit + 1)
+
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(query)
+            templates = result.scalars().all()
+
+        if not limit:
+            return {"data": [template_to_dict(t, fields) for t in templates]}
+
+        has_more = len(templates) > limit
+        templates = templates[:limit]
+        if backwards:
+            templates.reverse()
+        response = {"data": [template_to_dict(t, fields) for t in templates]}
+        if templates:
+            cursors = {"before": encode_cursor(templates[0]), "after": encode_cursor(templates[-1])}
+            has_next, has_previous = (True, has_more) if backwards else (has_more, bool(after))
+            paging = {"cursors": cursors}
+            if has_next:
+                paging["next"] = cursors["after"]
+            if has_previous:
+                paging["previous"] = cursors["before"]
+            response["paging"] = paging
+        return response
+
+    async def remove(self, client_id, name):
+        """Drops a template deleted through the API; Meta sends no webhook for deletions."""
+        async with AsyncSessionLocal() as session:
+            await session.execute(delete(Template).where(Template.client_id == client_id, Template.name == name))
+            await session.commit()
+
+    async def _run(self):
+        while True:
+            try:
+                # One worker syncs at a time; the others skip this round
+                async with engine.connect() as conn:
+                    locked = await conn.scalar(text("SELECT pg_try_advisory_lock(hashtext('template_catalog'))"))
+                    if locked:
+                        try:
+                            await self.sync_all()
+                        finally:
+                            await conn.execute(text("SELECT pg_advisory_unlock(hashtext('template_catalog'))"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Template catalog sync error: {e}")
+            await asyncio.sleep(TEMPLATE_SYNC_INTERVAL)
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def get_metrics(self):
+        return {
+            "clients": len(self.loaded),
+            "syncing": len(self._syncing),
+            **self.stats,
+            "lastSync": self.last_sync
+        }
+
+template_catalog = TemplateCatalog()
@@ -0,0 +1,244 @@
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from app.database import AsyncSessionLocal
+from app.models.sql_models import Template
+from app.services.pg_notify import pg_notify
+from sqlalchemy.future import select
+
+logger = logging.getLogger(__name__)
+
+# Chat copies of template messages are rendered from a plan compiled once per template:
+# the body split into literal segments and {{n}} slots, header/footer/button text and
+# the media URL root. Plans sit in a size-bounded LRU with a TTL. Template status and
+# category webhooks and catalog syncs drop them in every worker (pg_notify), and a
+# Template row newer than its plan recompiles it.
+TEMPLATE_PLAN_CACHE_SIZE = int(os.getenv("TEMPLATE_PLAN_CACHE_SIZE", "1000"))
+TEMPLATE_PLAN_TTL = int(os.getenv("TEMPLATE_PLAN_TTL", "600"))  # seconds
+TEMPLATE_MISSING_TTL = int(os.getenv("TEMPLATE_MISSING_TTL", "30"))  # seconds a "not in the catalog" answer is reused
+TEMPLATE_NOTIFY_CHANNEL = "template_invalidate"
+
+PLACEHOLDER = re.compile(r"\{\{(\d+)\}\}")
+
+
+class TemplatePlan:
+    def __init__(self, template):
+        self.template_id = template.id
+        self.client_id = template.client_id
+        self.name = template.name
+        self.language = template.language
+        self.updated_at = template.updated_at
+
+        components = {}
+        for comp in template.components or []:
+            if isinstance(comp, dict):
+                components.setdefault(comp.get("type"), comp)
+        header = components.get("HEADER", {})
+        body = components.get("BODY", {})
+        footer = components.get("FOOTER", {})
+        buttons = components.get("BUTTONS", {})
+
+        # Literal strings alternating with 1-based variable numbers
+        text = body.get("text", "")
+        self.segments = []
+        pos = 0
+        for match in PLACEHOLDER.finditer(text):
+            self.segments.append(text[pos:match.start()])
+            self.segments.append(int(match.group(1)))
+            pos = match.end()
+        self.segments.append(text[pos:])
+        self.variable_count = max((s for s in self.segments if isinstance(s, int)), default=0)
+
+        self.header_text = header.get("text")
+        self.footer = f"\n\n{footer['text']}" if footer.get("text") else ""
+        self.buttons = "\n\n" + "\n".join(f"[{b.get('text')}]" for b in buttons.get("buttons", [])) if buttons else ""
+        self.media_root = f"{os.getenv('SERVER_URL', 'http://localhost:8000').rstrip('/')}/static/broadcasts_media"
+
+    def check_variables(self, variables):
+        """Error message when the body variables don't match the template's {{n}} slots, else None."""
+        count = len(variables or [])
+        if count != self.variable_count:
+            return f"Template {self.name} expects {self.variable_count} body variables, got {count}"
+        return None
+
+    def body(self, variables):
+        variables = variables or []
+        parts = []
+        for segment in self.segments:
+            if isinstance(segment, str):
+                parts.append(segment)
+            elif 0 < segment <= len(variables):
+                parts.append(str(variables[segment - 1]))
+            else:
+                parts.append(f"{{{{{segment}}}}}")  # left as-is when no value was given
+        return "".join(parts)
+
+    def media_url(self, client_id, attachment_id, file_name):
+        if file_name and attachment_id:
+            return f"{self.media_root}/{client_id}/{attachment_id}/{file_name}"
+        return None
+
+    def render(self, client_id, payload, whatsapp_message_id, status, status_timestamp, sender_name="Admin", attachment_id=None):
+        """Message column values for one send, or None for payload types without a chat copy."""
+        payload = payload or {}
+        payload_type = (payload.get("type") or "").upper()
+        if payload_type not in ("TEXT", "MEDIA", "INTERACTIVE"):
+            return None
+
+        content = self.body(payload.get("bodyVariables", [])) + self.footer
+        message = {
+            "is_from_me": True,
+            "sender_name": sender_name,
+            "status": status,
+            "whatsapp_message_id": whatsapp_message_id,
+            "sender_avatar": None,
+            "caption": None,
+            "media_url": None,
+            "file_name": None,
+            "message_type": "text"
+        }
+        if status == "delivered":
+            message["delivered_at"] = status_timestamp
+        elif status == "read":
+            message["read_at"] = status_timestamp
+        else:
+            message["sent_at"] = status_timestamp
+
+        header_vars = payload.get("headerVariables") or {}
+        if payload_type == "TEXT":
+            if self.header_text:
+                content = f"*{self.header_text}*\n{content}"
+        elif payload_type == "MEDIA":
+            file_name = header_vars.get("data", {}).get("fileName")
+            message.update({
+                "file_name": file_name,
+                "media_url": self.media_url(client_id, attachment_id, file_name),
+                "message_type": header_vars.get("type", "").lower() if header_vars.get("type") else "image"
+            })
+        else:
+            if header_vars and header_vars.get("type") not in ["text", None]:
+                file_name = header_vars.get("data", {}).get("fileName")
+                media_url = self.media_url(client_id, attachment_id, file_name)
+                message.update({"file_name": file_name, "media_url": media_url})
+            content += self.buttons
+            message["message_type"] = "interactive"
+
+        message["content"] = content
+        return message
+
+    def render_chunk(self, client_id, sends, broadcast=None, status="sent"):
+        """render() for a chunk of sends (dicts with payload, whatsapp_message_id, at)."""
+        sender_name = broadcast.admin_name if broadcast else "Admin"
+        attachment_id = broadcast.attachment_id if broadcast else None
+        return [
+            self.render(
+                client_id, send["payload"], send["whatsapp_message_id"], status, send["at"],
+                sender_name, attachment_id or send.get("attachment_id")
+            )
+            for send in sends
+        ]
+
+
+class TemplateRenderer:
+    def __init__(self):
+        self.plans = OrderedDict()  # template id -> (TemplatePlan, expires_at), least recently used first
+        self.names = {}             # (client_id, name, language) -> template id
+        self.missing = OrderedDict()  # (client_id, name, language) -> expires_at, oldest first
+        self.stats = {"hits": 0, "misses": 0, "negativeHits": 0, "compiles": 0, "evictions": 0, "invalidations": 0}
+
+    def _cached(self, template_id, now):
+        entry = self.plans.get(template_id)
+        if entry and entry[1] > now:
+            self.plans.move_to_end(template_id)
+            return entry[0]
+        return None
+
+    def plan_for(self, template):
+        """Plan for a Template row already in hand; recompiled when the row changed since."""
+        now = time.monotonic()
+        plan = self._cached(template.id, now)
+        if plan and plan.updated_at == template.updated_at:
+            self.stats["hits"] += 1
+            return plan
+
+        self.stats["misses"] += 1
+        self.stats["compiles"] += 1
+        plan = TemplatePlan(template)
+        self.plans[template.id] = (plan, now + TEMPLATE_PLAN_TTL)
+        self.plans.move_to_end(template.id)
+        while len(self.plans) > TEMPLATE_PLAN_CACHE_SIZE:
+            evicted, _ = self.plans.popitem(last=False)
+            self.stats["evictions"] += 1
+            for key in [key for key, template_id in self.names.items() if template_id == evicted]:
+                del self.names[key]
+        return plan
+
+    async def get(self, client_id, name, language=None):
+        """Plan by template name (and language, when given). None if the template is not in the catalog."""
+        key = (client_id, name, language)
+        now = time.monotonic()
+        template_id = self.names.get(key)
+        plan = self._cached(template_id, now) if template_id else None
+        if plan:
+            self.stats["hits"] += 1
+            return plan
+        if self.missing.get(key, 0) > now:
+            # A deleted template would otherwise cost two queries per broadcast recipient
+            self.stats["negativeHits"] += 1
+            return None
+
+        async with AsyncSessionLocal() as session:
+            query = select(Template).where(Template.client_id == client_id, Template.name == name)
+            template = None
+            if language:
+                result = await session.execute(query.where(Template.language == language))
+                template = result.scalars().first()
+            if not template:
+                result = await session.execute(query)
+                template = result.scalars().first()
+        if not template:
+            self.missing.pop(key, None)
+            self.missing[key] = now + TEMPLATE_MISSING_TTL
+            while self.missing and (len(self.missing) > TEMPLATE_PLAN_CACHE_SIZE or next(iter(self.missing.values())) <= now):
+                self.missing.popitem(last=False)
+            return None
+        self.missing.pop(key, None)
+        self.names[key] = template.id
+        return self.plan_for(template)
+
+    def invalidate(self, template_id=None, client_id=None):
+        """Drops one template's plan, a client's plans or, with neither, every plan."""
+        self.stats["invalidations"] += 1
+        # A template may have been added; forget every "not found" answer
+        self.missing.clear()
+        if template_id:
+            self.plans.pop(template_id, None)
+        elif client_id:
+            for key in [key for key, (plan, _) in self.plans.items() if plan.client_id == client_id]:
+                del self.plans[key]
+        else:
+            self.plans.clear()
+            self.names.clear()
+
+    def handle_notification(self, payload: str):
+        kind, _, value = (payload or "").partition(":")
+        if kind == "template":
+            self.invalidate(template_id=value)
+        elif kind == "client":
+            self.invalidate(client_id=value)
+        else:
+            self.invalidate()
+
+    async def invalidate_everywhere(self, template_id=None, client_id=None):
+        """invalidate() here and in the other workers."""
+        self.invalidate(template_id, client_id)
+        payload = f"template:{template_id}" if template_id else (f"client:{client_id}" if client_id else "")
+        await pg_notify.publish(TEMPLATE_NOTIFY_CHANNEL, payload)
+
+    def get_metrics(self):
+        return {"plans": len(self.plans), "names": len(self.names), "missing": len(self.missing), **self.stats}
+
+template_renderer = TemplateRenderer()
+pg_notify.subscribe(TEMPLATE_NOTIFY_CHANNEL, template_renderer.handle_notification)
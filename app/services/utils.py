@@ -1,38 +1,153 @@
 from app.database import AsyncSessionLocal
 from app.models.sql_models import Client
+from app.services.pg_notify import pg_notify
 from sqlalchemy.future import select
 import os
+import time
+import asyncio
+from collections import OrderedDict
 
-from sqlalchemy import or_
+from sqlalchemy import or_, any_, literal, String
+from sqlalchemy.dialects.postgresql import ARRAY
 
-async def get_secrets(client_id: str):
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(
-            select(Client).where(
-                or_(
-                    Client.client_id == client_id,
-                    Client.phone_number_id == client_id
+# In-process tenant registry in front of the clients table.
+# Webhooks, sends and chatbot calls resolve a tenant by client_id or phone_number_id on
+# every request; entries live for TENANT_CACHE_TTL seconds and unknown ids are cached
+# negatively for TENANT_NEGATIVE_TTL (at most TENANT_NEGATIVE_MAX of them, since
+# /webhook accepts any phone_number_id). The clients router invalidates on writes and,
+# with PG_NOTIFY_ENABLED, the invalidation is broadcast to the other workers.
+TENANT_CACHE_TTL = int(os.getenv("TENANT_CACHE_TTL", "300"))  # seconds
+TENANT_NEGATIVE_TTL = int(os.getenv("TENANT_NEGATIVE_TTL", "60"))  # seconds
+TENANT_NEGATIVE_MAX = int(os.getenv("TENANT_NEGATIVE_MAX", "10000"))
+TENANT_NOTIFY_CHANNEL = "tenant_invalidate"
+
+def secrets_from_client(client):
+    return {
+        "clientId": client.client_id,
+        "wabaId": client.waba_id,
+        "phoneNumberId": client.phone_number_id,
+        "phoneNumber": client.phone_number,
+        "webhookVerifyToken": client.webhook_verify_token,
+        "storeId": client.store_id,
+        "qnaStoreId": client.qna_store_id,
+        "googleApiKey": client.google_api_key,
+        "isBotActivated": client.is_bot_activated,
+        "isUploadQuestionsEnabled": client.is_upload_questions_enabled,
+        "broadcastConcurrency": client.broadcast_concurrency
+    }
+
+
+class TenantRegistry:
+    def __init__(self):
+        self.by_client_id = {}        # client_id -> (secrets, expires_at)
+        self.by_phone_number_id = {}  # phone_number_id -> (secrets, expires_at)
+        self.missing = OrderedDict()  # unknown id -> expires_at, oldest first
+        self._loading = {}            # id -> Future, so concurrent misses share one query
+        self.generation = 0           # bumped by invalidate(); loads started before it don't store
+        self.stats = {"hits": 0, "misses": 0, "negativeHits": 0, "invalidations": 0}
+
+    def _lookup(self, key, now):
+        for index in (self.by_client_id, self.by_phone_number_id):
+            entry = index.get(key)
+            if entry and entry[1] > now:
+                return entry[0]
+        return None
+
+    def _remember_missing(self, key, now):
+        self.missing.pop(key, None)
+        self.missing[key] = now + TENANT_NEGATIVE_TTL
+        # Same TTL for every entry, so expired ones are at the front
+        while self.missing and (len(self.missing) > TENANT_NEGATIVE_MAX or next(iter(self.missing.values())) <= now):
+            self.missing.popitem(last=False)
+
+    async def _load(self, key, generation):
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(Client).where(
+                    or_(
+                        Client.client_id == key,
+                        Client.phone_number_id == key
+                    )
                 )
             )
-        )
-        client = result.scalars().first()
-        
+            client = result.scalars().first()
+
+        now = time.monotonic()
+        secrets = secrets_from_client(client) if client else None
+        if generation != self.generation:
+            # Invalidated while the query ran: the result may predate the write
+            return secrets
         if not client:
+            self._remember_missing(key, now)
             return None
-            
+
+        expires_at = now + TENANT_CACHE_TTL
+        self.by_client_id[client.client_id] = (secrets, expires_at)
+        if client.phone_number_id:
+            self.by_phone_number_id[client.phone_number_id] = (secrets, expires_at)
+        self.missing.pop(key, None)
+        return secrets
+
+    async def get(self, key):
+        now = time.monotonic()
+        secrets = self._lookup(key, now)
+        if secrets:
+            self.stats["hits"] += 1
+            return dict(secrets)
+        if self.missing.get(key, 0) > now:
+            self.stats["negativeHits"] += 1
+            return None
+
+        self.stats["misses"] += 1
+        future = self._loading.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._load(key, self.generation))
+            self._loading[key] = future
+            future.add_done_callback(lambda f: self._loading.pop(key, None) if self._loading.get(key) is f else None)
+        secrets = await asyncio.shield(future)
+        return dict(secrets) if secrets else None
+
+    def invalidate(self, client_id=None):
+        """Drops one tenant (under both keys) or, without client_id, everything. Clears the negative cache."""
+        self.stats["invalidations"] += 1
+        self.generation += 1
+        self._loading.clear()  # later misses query again instead of joining a stale load
+        self.missing.clear()
+        if not client_id:
+            self.by_client_id.clear()
+            self.by_phone_number_id.clear()
+            return
+        self.by_client_id.pop(client_id, None)
+        for key, (secrets, _) in list(self.by_phone_number_id.items()):
+            if secrets["clientId"] == client_id or key == client_id:
+                del self.by_phone_number_id[key]
+
+    def handle_notification(self, payload: str):
+        self.invalidate(payload or None)
+
+    def get_metrics(self):
         return {
-            "clientId": client.client_id,
-            "wabaId": client.waba_id,
-            "phoneNumberId": client.phone_number_id,
-            "phoneNumber": client.phone_number,
-            "webhookVerifyToken": client.webhook_verify_token,
-            "storeId": client.store_id,
-            "qnaStoreId": client.qna_store_id,
-            "googleApiKey": client.google_api_key,
-            "isBotActivated": client.is_bot_activated,
-            "isUploadQuestionsEnabled": client.is_upload_questions_enabled
+            "clients": len(self.by_client_id),
+            "phoneNumberIds": len(self.by_phone_number_id),
+            "negative": len(self.missing),
+            **self.stats
         }
 
+tenant_registry = TenantRegistry()
+pg_notify.subscribe(TENANT_NOTIFY_CHANNEL, tenant_registry.handle_notification)
+
+async def get_secrets(client_id: str):
+    return await tenant_registry.get(client_id)
+
+async def invalidate_tenant(client_id: str = None):
+    """Call after any write to a client row: drops it here and tells the other workers."""
+    tenant_registry.invalidate(client_id)
+    await pg_notify.publish(TENANT_NOTIFY_CHANNEL, client_id or "")
+
+def any_of(values, type_=String):
+    """Use as `column == any_of(ids)`: renders `column = ANY(:ids)` with one array parameter."""
+    return any_(literal(list(values), ARRAY(type_)))
+
 def get_base_url():
     # In JS it was process.env.BASE_URL. 
     # Since we are moving to Python, we should ensure this is set in .env
@@ -0,0 +1,176 @@
+import logging
+import asyncio
+import os
+from collections import OrderedDict
+from contextvars import ContextVar
+from app.database import AsyncSessionLocal
+from app.models.sql_models import ProcessedWebhookEvent
+from sqlalchemy import delete, update, tuple_, func
+from sqlalchemy.dialects.postgresql import insert
+import datetime
+
+logger = logging.getLogger(__name__)
+
+# Meta redelivers webhooks on timeouts, so the same message / status can arrive many times.
+# Every event is keyed by (whatsapp_message_id, kind, status). The unique constraint on
+# webhook_event_dedup is the source of truth; a bounded in-process LRU answers repeats
+# of recently completed keys without a DB round trip.
+# A claimed key is only a lease ('processing') until its handler returns and marks it
+# 'done'. If the process dies or the handler is cancelled mid-way, the lease expires
+# and Meta's redelivery or the webhook queue's retry can claim the key again, so
+# delivery stays at-least-once. Keep the lease shorter than the queue's visibility timeout.
+WEBHOOK_DEDUP_LRU_SIZE = int(os.getenv("WEBHOOK_DEDUP_LRU_SIZE", "50000"))
+WEBHOOK_DEDUP_RETENTION_HOURS = int(os.getenv("WEBHOOK_DEDUP_RETENTION_HOURS", "168"))  # Meta retries for up to 7 days
+WEBHOOK_DEDUP_PRUNE_INTERVAL = int(os.getenv("WEBHOOK_DEDUP_PRUNE_INTERVAL", "3600"))  # seconds
+WEBHOOK_DEDUP_LEASE_SECONDS = int(os.getenv("WEBHOOK_DEDUP_LEASE_SECONDS", "240"))
+
+# Set by the replay tool to push already-processed events through the handlers again
+dedup_bypassed = ContextVar("dedup_bypassed", default=False)
+
+
+class WebhookDeduplicator:
+    def __init__(self, max_size: int = WEBHOOK_DEDUP_LRU_SIZE):
+        self.max_size = max_size
+        self._seen = OrderedDict()
+        self.stats = {"lruHits": 0, "dbDuplicates": 0, "accepted": 0, "errors": 0}
+        self._prune_task = None
+
+    def _remember(self, key):
+        self._seen[key] = True
+        self._seen.move_to_end(key)
+        while len(self._seen) > self.max_size:
+            self._seen.popitem(last=False)
+
+    async def claim(self, keys):
+        """
+        Claims a list of (whatsapp_message_id, kind, status) keys.
+        Returns the set of keys seen for the first time or whose previous lease expired;
+        everything else is a redelivery. Claimed keys must be complete()d or release()d.
+        """
+        if dedup_bypassed.get():
+            return set(keys)
+
+        candidates = []
+        for key in dict.fromkeys(keys):  # de-duplicate within the batch, keep order
+            if key in self._seen:
+                self._seen.move_to_end(key)
+                self.stats["lruHits"] += 1
+            else:
+                candidates.append(key)
+
+        if not candidates:
+            return set()
+
+        lease_expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=WEBHOOK_DEDUP_LEASE_SECONDS)
+        try:
+            async with AsyncSessionLocal() as session:
+                stmt = insert(ProcessedWebhookEvent).values([
+                    {"whatsapp_message_id": m_id, "kind": kind, "status": status,
+                     "state": "processing", "lease_expires_at": lease_expires_at}
+                    for m_id, kind, status in candidates
+                ])
+                stmt = stmt.on_conflict_do_update(
+                    constraint="uq_webhook_event_dedup_key",
+                    set_={"lease_expires_at": stmt.excluded.lease_expires_at},
+                    # Only take over a lease whose holder died; done / live keys are duplicates
+                    where=(ProcessedWebhookEvent.state == "processing") & (ProcessedWebhookEvent.lease_expires_at < func.now())
+                ).returning(
+                    ProcessedWebhookEvent.whatsapp_message_id,
+                    ProcessedWebhookEvent.kind,
+                    ProcessedWebhookEvent.status
+                )
+                result = await session.execute(stmt)
+                claimed = {tuple(row) for row in result.all()}
+                await session.commit()
+        except Exception as e:
+            # Fail open: processing a duplicate is better than dropping a new event
+            logger.error(f"Webhook dedup error, processing without dedup: {e}")
+            self.stats["errors"] += 1
+            return set(candidates)
+
+        self.stats["accepted"] += len(claimed)
+        self.stats["dbDuplicates"] += len(candidates) - len(claimed)
+        return claimed
+
+    async def complete(self, keys):
+        """Marks keys whose handler finished as done; only done keys are answered from the LRU."""
+        keys = list(keys)
+        if not keys:
+            return
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.execute(
+                    update(ProcessedWebhookEvent).where(
+                        tuple_(
+                            ProcessedWebhookEvent.whatsapp_message_id,
+                            ProcessedWebhookEvent.kind,
+                            ProcessedWebhookEvent.status
+                        ).in_(keys)
+                    ).values(state="done", lease_expires_at=None)
+                )
+                await session.commit()
+        except Exception as e:
+            # The lease then expires and a redelivery is processed again (at-least-once)
+            logger.error(f"Webhook dedup complete error: {e}")
+            return
+        for key in keys:
+            self._remember(key)
+
+    async def release(self, keys):
+        """Forget keys whose handler failed, so a redelivery or queue retry is processed again."""
+        keys = list(keys)
+        if not keys:
+            return
+        for key in keys:
+            self._seen.pop(key, None)
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.execute(
+                    delete(ProcessedWebhookEvent).where(
+                        tuple_(
+                            ProcessedWebhookEvent.whatsapp_message_id,
+                            ProcessedWebhookEvent.kind,
+                            ProcessedWebhookEvent.status
+                        ).in_(keys)
+                    )
+                )
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Webhook dedup release error: {e}")
+
+    async def prune(self):
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=WEBHOOK_DEDUP_RETENTION_HOURS)
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                delete(ProcessedWebhookEvent).where(ProcessedWebhookEvent.created_at < cutoff)
+            )
+            await session.commit()
+            if result.rowcount:
+                logger.info(f"🧹 Pruned {result.rowcount} webhook dedup keys older than {WEBHOOK_DEDUP_RETENTION_HOURS}h")
+
+    async def _prune_loop(self):
+        while True:
+            try:
+                await self.prune()
+            except Exception as e:
+                logger.error(f"Webhook dedup prune error: {e}")
+            await asyncio.sleep(WEBHOOK_DEDUP_PRUNE_INTERVAL)
+
+    def start(self):
+        if not self._prune_task:
+            self._prune_task = asyncio.create_task(self._prune_loop())
+
+    async def stop(self):
+        if self._prune_task:
+            self._prune_task.cancel()
+            await asyncio.gather(self._prune_task, return_exceptions=True)
+            self._prune_task = None
+
+    def get_metrics(self):
+        return {
+            "lruSize": len(self._seen),
+            "lruCapacity": self.max_size,
+            **self.stats
+        }
+
+webhook_dedup = WebhookDeduplicator()
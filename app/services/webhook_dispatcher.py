@@ -0,0 +1,86 @@
+import logging
+import asyncio
+import contextvars
+import os
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Webhook work is sharded by (client_id, contact phone).
+# Jobs in the same shard run strictly in submission (arrival) order; different shards
+# (chats, tenants) run concurrently, bounded by a global limit. One slow media download
+# or Gemini call therefore only delays the chat it belongs to.
+# A shard's runner task is shared by whoever submits to it, so each job runs in the
+# context of its own submit() (replay's dedup bypass and log suppression flags).
+WEBHOOK_DISPATCH_CONCURRENCY = int(os.getenv("WEBHOOK_DISPATCH_CONCURRENCY", "32"))
+WEBHOOK_DISPATCH_METRICS_TOP = int(os.getenv("WEBHOOK_DISPATCH_METRICS_TOP", "50"))
+
+
+class ChatShardDispatcher:
+    def __init__(self, max_concurrency: int = WEBHOOK_DISPATCH_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+        self.shards = {}   # shard key -> deque of (job factory, future, submitter's context)
+        self.runners = {}  # shard key -> drain task
+        self.running = 0
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0}
+
+    def submit(self, key, job):
+        """
+        Queues `job` (a zero-argument coroutine function) on shard `key`.
+        Must be called without awaiting in between for jobs that need to stay ordered.
+        Returns a future with the job's result.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        future = asyncio.get_running_loop().create_future()
+        self.shards.setdefault(key, deque()).append((job, future, contextvars.copy_context()))
+        self.stats["submitted"] += 1
+        if key not in self.runners:
+            self.runners[key] = asyncio.create_task(self._drain(key))
+        return future
+
+    async def _drain(self, key):
+        queue = self.shards[key]
+        try:
+            while queue:
+                job, future, context = queue[0]
+                async with self._semaphore:
+                    self.running += 1
+                    try:
+                        # The task copies the context current at creation, i.e. the submitter's
+                        result = await context.run(asyncio.ensure_future, job())
+                    except Exception as e:
+                        self.stats["failed"] += 1
+                        if not future.done():
+                            future.set_exception(e)
+                    else:
+                        self.stats["completed"] += 1
+                        if not future.done():
+                            future.set_result(result)
+                    finally:
+                        self.running -= 1
+                queue.popleft()
+        finally:
+            # No await between the last popleft and here, so no job can slip in unnoticed
+            self.runners.pop(key, None)
+            if not queue:
+                self.shards.pop(key, None)
+
+    def get_metrics(self):
+        depths = sorted(
+            ((f"{key[0]}:{key[1]}", len(queue)) for key, queue in self.shards.items()),
+            key=lambda item: item[1],
+            reverse=True
+        )
+        return {
+            "maxConcurrency": self.max_concurrency,
+            "running": self.running,
+            "activeShards": len(self.shards),
+            "queued": sum(depth for _, depth in depths),
+            "shardDepths": dict(depths[:WEBHOOK_DISPATCH_METRICS_TOP]),
+            **self.stats
+        }
+
+dispatcher = ChatShardDispatcher()
@@ -1,11 +1,13 @@
 import logging
-from app.database import AsyncSessionLocal
+from app.database import AsyncSessionLocal, count_queries
 from app.models.sql_models import WebhookLog, Template, Contact, Chat, Message, Broadcast, BroadcastMessage, Wallet, WalletHistory
-from app.services.utils import get_secrets, extract_phone_number
+from app.services.utils import get_secrets, extract_phone_number, any_of
 from app.services.chat import (
     increment_daily_stats, 
+    load_contact_and_chat,
+    add_daily_stats,
+    refund_message_costs,
     send_whatsapp_message_helper, 
-    download_and_upload_media, 
     mark_message_as_read,
     refund_message_cost,
     ensure_contact_and_chat,
@@ -14,14 +16,19 @@ from app.services.chat import (
 from app.services.firebase_service import (
     sync_chat_metadata, 
     sync_message, 
-    sync_message_status, 
-    sync_broadcast_stats
+    sync_message_status
 )
 from app.services.gemini import generate_content_with_file_search
 from sqlalchemy.future import select
 from sqlalchemy import update, or_, and_
 from sqlalchemy.dialects.postgresql import JSONB
 from app.services.websocket_manager import manager
+from app.services.webhook_dedup import webhook_dedup
+from app.services.webhook_dispatcher import dispatcher
+from app.services.webhook_log_writer import webhook_log_writer
+from app.services.media_pipeline import media_pipeline, media_job_from_message
+from app.services.template_renderer import template_renderer
+from app.services.broadcast_counters import broadcast_counters
 import datetime
 import os
 import re
@@ -30,6 +37,8 @@ import time
 import requests
 import json
 import uuid
+import asyncio
+import functools
 
 from datetime import timezone, timedelta
 
@@ -38,46 +47,41 @@ logger = logging.getLogger(__name__)
 def get_ist_time():
     return datetime.datetime.now(timezone(timedelta(hours=5, minutes=30)))
 
-def serialize_payload(payload):
-    """Convert payload to JSON-serializable format, handling non-serializable objects."""
-    if payload is None:
-        return None
-    
-    try:
-        # Try to serialize to JSON and back to ensure it's clean
-        json_str = json.dumps(payload, default=str)
-        return json.loads(json_str)
-    except (TypeError, ValueError) as e:
-        # If serialization fails, convert to string representation
-        logger.warning(f"Payload serialization failed: {e}, converting to string")
-        return {"_serialized_error": str(e), "_original_type": str(type(payload)), "_string_repr": str(payload)[:1000]}
+# Chat messages and delivery statuses are high volume and are not logged unless enabled
+# (turn on to capture traffic for app.services.webhook_replay)
+WEBHOOK_LOG_MESSAGES = os.getenv("WEBHOOK_LOG_MESSAGES", "false").lower() == "true"
+
+# Expected DB round trips for storing one inbound message (contact+chat load, broadcast
+# lookup, contact/chat updates, message inserts); going over it is logged, or with
+# INBOUND_MESSAGE_QUERY_BUDGET_STRICT (dev / load tests) fails the message before commit
+INBOUND_MESSAGE_QUERY_BUDGET = int(os.getenv("INBOUND_MESSAGE_QUERY_BUDGET", "8"))
+INBOUND_MESSAGE_QUERY_BUDGET_STRICT = os.getenv("INBOUND_MESSAGE_QUERY_BUDGET_STRICT", "false").lower() == "true"
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+def check_query_budget(counter, message_id):
+    if counter["queries"] > INBOUND_MESSAGE_QUERY_BUDGET:
+        problem = f"Inbound message {message_id} used {counter['queries']} DB round trips (budget {INBOUND_MESSAGE_QUERY_BUDGET})"
+        if INBOUND_MESSAGE_QUERY_BUDGET_STRICT:
+            raise QueryBudgetExceeded(problem)
+        logger.warning(problem)
+    else:
+        logger.debug(f"Inbound message {message_id} used {counter['queries']} DB round trips")
+
+def queue_webhook_log(client_id, type_str, payload, status="SUCCESS"):
+    webhook_log_writer.submit({
+        # Ensure client_id is never None (use placeholder for invalid payloads)
+        "client_id": client_id if client_id else "unknown",
+        "type": type_str,
+        "payload": payload,
+        "status": status,
+        "created_at": get_ist_time()
+    })
 
 async def log_webhook(client_id, type_str, payload, status="SUCCESS"):
-    """Log webhook to database. Handles invalid payloads gracefully."""
-    # Ensure client_id is never None (use placeholder for invalid payloads)
-    safe_client_id = client_id if client_id else "unknown"
-    
-    # Serialize payload to ensure it's JSON-safe
-    safe_payload = serialize_payload(payload)
-    
-    async with AsyncSessionLocal() as session:
-        try:
-            log = WebhookLog(
-                client_id=safe_client_id,
-                type=type_str,
-                payload=safe_payload,
-                status=status,
-                created_at=get_ist_time()
-            )
-            session.add(log)
-            await session.commit()
-            logger.debug(f"Webhook logged: {safe_client_id} - {type_str} - {status}")
-        except Exception as e:
-            logger.error(f"LOGGING ERROR: {e}")
-            try:
-                await session.rollback()
-            except:
-                pass
+    """Queue a webhook log row for the background group-commit writer. Never touches the DB inline."""
+    queue_webhook_log(client_id, type_str, payload, status)
 
 async def handle_status_update(client_id, value):
     msg_template_id = str(value.get("message_template_id", ""))
@@ -106,18 +110,22 @@ async def handle_status_update(client_id, value):
 
     async with AsyncSessionLocal() as session:
         try:
-             result = await session.execute(select(Template).where(Template.id == msg_template_id, Template.client_id == client_id))
-             template = result.scalars().first()
+             # Template webhooks carry no phone_number_id, so client_id is usually None here;
+             # template ids are unique across WABAs
+             template = await session.get(Template, msg_template_id)
              if template:
                  template.status = status
-                 template.category = category
+                 if category:
+                     template.category = category
                  if reason_block:
                      template.reason = reason_block
                  template.updated_at = get_ist_time()
              else:
-                 # If template doesn't exist, we might create it but usually it should exist.
-                 pass
+                 # Not in the local catalog yet; the next template_catalog sync adds it
+                 logger.info(f"Status update for unknown template {msg_template_id}")
              await session.commit()
+             # An edited template comes back through review, so its rendered form may have changed
+             await template_renderer.invalidate_everywhere(template_id=msg_template_id)
         except Exception as e:
              logger.error(f"Template Status Update Error: {e}")
 
@@ -128,12 +136,12 @@ async def handle_category_update(client_id, value):
 
     async with AsyncSessionLocal() as session:
         try:
-            result = await session.execute(select(Template).where(Template.id == msg_template_id, Template.client_id == client_id))
-            template = result.scalars().first()
+            template = await session.get(Template, msg_template_id)
             if template:
                 template.category = value.get("new_category") or value.get("correct_category") or ""
                 template.updated_at = get_ist_time()
                 await session.commit()
+                await template_renderer.invalidate_everywhere(template_id=msg_template_id)
         except Exception as e:
              logger.error(f"Template Category Update Error: {e}")
 
@@ -166,6 +174,8 @@ async def handle_chat_message(client_id, value):
             context = None
             media_url = None
             file_name = None
+            media_id = None
+            media_status = None
             mime_type = None
             caption = None
             
@@ -179,13 +189,6 @@ async def handle_chat_message(client_id, value):
                 message_text = caption or "📷 Image"
                 mime_type = message.get("image", {}).get("mime_type", "image/jpeg")
                 media_id = message.get("image", {}).get("id")
-                if media_id:
-                    uploaded = await download_and_upload_media(actual_client_id, secrets, media_id, mime_type, None, message_id)
-                    if uploaded:
-                        media_url = uploaded["url"]
-                        file_name = uploaded["filename"]
-                    else:
-                        message_text = "[Failed to save image]"
                 context = message.get("image", {}).get("context")
 
             elif message_type == "document":
@@ -195,13 +198,6 @@ async def handle_chat_message(client_id, value):
                 mime_type = doc.get("mime_type", "application/octet-stream")
                 message_text = caption or f"📄 {file_name}"
                 media_id = doc.get("id")
-                if media_id:
-                    uploaded = await download_and_upload_media(actual_client_id, secrets, media_id, mime_type, file_name, message_id)
-                    if uploaded:
-                        media_url = uploaded["url"]
-                        file_name = uploaded["filename"]
-                    else:
-                        message_text = f"[Failed to save document: {file_name}]"
                 context = doc.get("context")
 
             elif message_type == "video":
@@ -209,13 +205,6 @@ async def handle_chat_message(client_id, value):
                 message_text = caption or "🎥 Video"
                 mime_type = message.get("video", {}).get("mime_type", "video/mp4")
                 media_id = message.get("video", {}).get("id")
-                if media_id:
-                    uploaded = await download_and_upload_media(actual_client_id, secrets, media_id, mime_type, None, message_id)
-                    if uploaded:
-                        media_url = uploaded["url"]
-                        file_name = uploaded["filename"]
-                    else:
-                        message_text = "[Failed to save video]"
                 context = message.get("video", {}).get("context")
             
             elif message_type == "audio" or message_type == "voice":
@@ -223,14 +212,8 @@ async def handle_chat_message(client_id, value):
                  message_text = "🎤 Voice Message" if is_voice else "🎵 Audio"
                  mime_type = message.get("audio", {}).get("mime_type", "audio/ogg")
                  media_id = message.get("audio", {}).get("id")
-                 if media_id:
-                     voice_filename = f"voice_{message_id}.ogg" if is_voice else None
-                     uploaded = await download_and_upload_media(actual_client_id, secrets, media_id, mime_type, voice_filename, message_id)
-                     if uploaded:
-                        media_url = uploaded["url"]
-                        file_name = uploaded["filename"]
-                     else:
-                        message_text = "[Failed to save audio]"
+                 if media_id and is_voice:
+                     file_name = f"voice_{message_id}.ogg"
                  context = message.get("audio", {}).get("context") or message.get("voice", {}).get("context") 
             
             elif message_type == "button":
@@ -249,45 +232,39 @@ async def handle_chat_message(client_id, value):
                 logger.info(f"Unsupported message type: {message_type}")
                 continue
 
+            # Media is fetched by the media pipeline after the message row is stored
+            if media_id:
+                media_status = "pending"
+
             logger.info(f"Message from {phone_number}: {message_text} ({message_type})")
 
-            # Contact & Chat Logic with DB Session
-            async with AsyncSessionLocal() as session:
-                # Find or Create Contact
-                result = await session.execute(
-                    select(Contact).where(
-                        Contact.client_id == actual_client_id,
-                        Contact.phone_number == phone_number
+            ts_millis = int(timestamp) * 1000
+            ts_dt = datetime.datetime.fromtimestamp(ts_millis / 1000.0, tz=timezone(timedelta(hours=5, minutes=30)))
+
+            # One unit of work: contact/chat upsert, chat metadata, template back-fill and the
+            # new message are written in a single transaction. Side effects run after commit.
+            with count_queries() as counter:
+                async with AsyncSessionLocal() as session:
+                    contact, chat = await load_contact_and_chat(session, actual_client_id, phone_number)
+                    is_new_chat = chat is None
+
+                    if contact:
+                        contact_name = f"{contact.f_name or ''} {contact.l_name or ''}".strip()
+                        if not contact_name: contact_name = phone_number
+                        contact.last_contacted = get_ist_time()
+                    else:
+                        # Create new contact with profile name if available
+                        profile_name = value.get("contacts", [{}])[0].get("profile", {}).get("name", "")
+                        contact_name = profile_name or phone_number
+
+                    contact_id, chat_name, full_phone_number = await ensure_contact_and_chat(
+                        session, actual_client_id, phone_number, name=contact_name, country_code=country_code,
+                        preloaded=(contact, chat)
                     )
-                )
-                contact = result.scalars().first()
-                contact_id = None
-                contact_name = "Unknown User"
-                
-                if contact:
-                    contact_id = contact.id
-                    contact_name = f"{contact.f_name or ''} {contact.l_name or ''}".strip()
-                    if not contact_name: contact_name = phone_number
-                    contact.last_contacted = get_ist_time()
-                else:
-                    # Create new contact with profile name if available
-                    profile_name = value.get("contacts", [{}])[0].get("profile", {}).get("name", "")
-                    contact_name = profile_name or phone_number
-
-                contact_id, chat_name, full_phone_number = await ensure_contact_and_chat(
-                    session, actual_client_id, phone_number, name=contact_name, country_code=country_code
-                )
-                
-                # Re-fetch chat to manage state
-                chat_result = await session.execute(
-                    select(Chat).where(Chat.id == contact_id, Chat.client_id == actual_client_id)
-                )
-                chat = chat_result.scalars().first()
-                
-                has_ai_response = False
-                ai_response_enabled = False
-                
-                if chat:
+                    if is_new_chat:
+                        await session.flush()
+                        chat = await session.get(Chat, contact_id)  # identity map, no query
+
                     chat.last_message = message_text
                     chat.last_message_time = get_ist_time()
                     chat.user_last_message_time = get_ist_time()
@@ -295,82 +272,22 @@ async def handle_chat_message(client_id, value):
                         chat.un_read = True
                     ai_response_enabled = chat.ai_response_enabled
 
-                await session.commit()
-                
-                # Firestore Sync - Chat Metadata
-                await sync_chat_metadata(contact_id, actual_client_id, {
-                    "name": contact_name,
-                    "phoneNumber": full_phone_number,
-                    "lastMessage": message_text,
-                    "lastMessageTime": get_ist_time(),
-                    "unRead": chat.un_read,
-                    "isActive": chat.is_active
-                })
-                logger.info(f"✅ Chat metadata synced for {contact_id}")
-                
-                # AI Response Logic
-                if ai_response_enabled:
-                    await mark_message_as_read(secrets, message_id, True)
-                    if message_type == 'text':
-                        try:
-                            ai_response = await generate_content_with_file_search(
-                                actual_client_id, 
-                                message_text, 
-                                secrets.get("googleApiKey"), 
-                                [secrets.get("storeId"), secrets.get("qnaStoreId")], 
-                                contact_id
-                            )
-                            await send_whatsapp_message_helper({
-                                "clientId": actual_client_id,
-                                "phoneNumber": phone_number,
-                                "message": ai_response,
-                                "chatId": contact_id,
-                                "messageType": "text"
-                            })
-                            has_ai_response = True
-                        except Exception as e:
-                             logger.error(f"AI Response Error: {e}")
-                    else:
-                        await send_whatsapp_message_helper({
-                            "clientId": actual_client_id,
-                            "phoneNumber": phone_number,
-                            "message": "Sorry, could not understand your request. Try again later.",
-                            "chatId": contact_id,
-                            "messageType": "text"
-                        })
-                        has_ai_response = True
-                
-                # Broadcast Helper
-                # Re-open session or use separate session inside helper? 
-                # Ideally helper should accept session but structure is messy.
-                # I'll update broadcast_message_helper to handle its own session OR refactor it.
-                # For now let's call it.
-                template_chat_msg, broadcast_msg_to_update = await broadcast_message_helper(actual_client_id, 'Sending', contact_id, full_phone_number)
-                
-                if not template_chat_msg:
-                     template_chat_msg, broadcast_msg_to_update = await broadcast_message_helper(actual_client_id, 'Sent', contact_id, full_phone_number)
-                
-                if template_chat_msg:
-                    # Save template message to chat
-                    async with AsyncSessionLocal() as session:
-                        tmpl_msg = Message(
-                             chat_id=contact_id,
-                             client_id=actual_client_id,
-                             **template_chat_msg
+                    # Back-fill the broadcast template this contact is replying to
+                    template_chat_msg, broadcast_msg_to_update = await broadcast_message_helper(session, actual_client_id, full_phone_number)
+                    if template_chat_msg:
+                        session.add(Message(
+                            chat_id=contact_id,
+                            client_id=actual_client_id,
+                            **template_chat_msg
+                        ))
+                        await session.execute(
+                            update(BroadcastMessage)
+                            .where(BroadcastMessage.id == broadcast_msg_to_update)
+                            .values(added_to_chat=True)
                         )
-                        session.add(tmpl_msg)
-                        if broadcast_msg_to_update:
-                             # broadcast_msg_to_update is likely a DB object or ID
-                             # Since I need to rewrite broadcast_message_helper, I'll assume it returns ID or object
-                             if isinstance(broadcast_msg_to_update, str):
-                                 await session.execute(update(BroadcastMessage).where(BroadcastMessage.id == broadcast_msg_to_update).values(added_to_chat=True))
-                        await session.commit()
-
-                # Save Incoming Message
-                ts_millis = int(timestamp) * 1000
-                ts_dt = datetime.datetime.fromtimestamp(ts_millis / 1000.0, tz=timezone(timedelta(hours=5, minutes=30)))
-                
-                async with AsyncSessionLocal() as session:
+
+                    # AI-enabled chats are marked read with Meta right after commit
+                    message_status = "read" if ai_response_enabled else "delivered"
                     new_msg = Message(
                         chat_id=contact_id,
                         client_id=actual_client_id,
@@ -378,271 +295,292 @@ async def handle_chat_message(client_id, value):
                         timestamp=ts_dt,
                         is_from_me=False,
                         sender_name=contact_name,
-                        status="read" if has_ai_response else "delivered",
+                        status=message_status,
                         whatsapp_message_id=message_id,
                         message_type=message_type,
                         media_url=media_url,
                         file_name=file_name,
                         mime_type=mime_type,
                         caption=caption,
-                        context=context
+                        context=context,
+                        media_id=media_id,
+                        media_status=media_status,
+                        # Claimed by this process for its first download attempt
+                        media_claimed_at=datetime.datetime.now(datetime.timezone.utc) if media_status == "pending" else None,
+                        media_attempts=1 if media_status == "pending" else 0
                     )
                     session.add(new_msg)
+                    # Flushed first so the insert is counted; a strict budget rolls it back
+                    await session.flush()
+                    check_query_budget(counter, message_id)
                     await session.commit()
 
-                    # 4. Sync to Firestore for real-time app update
-                    message_data = {
-                        "content": message_text,
-                        "timestamp": get_ist_time(),
-                        "isFromMe": False,
-                        "senderName": contact_name,
-                        "status": "read" if has_ai_response else "delivered",
-                        "whatsappMessageId": message_id,
-                        "messageType": message_type,
-                        "mediaUrl": media_url,
-                        "fileName": file_name,
-                        "mimeType": mime_type,
-                        "caption": caption
-                    }
-                    await sync_message(contact_id, actual_client_id, message_id, message_data)
-                    print(f"✅ Successfully stored in Firebase: Message {message_id} for chat {contact_id}")
-                    logger.info(f"✅ Successfully stored in Firebase: Message {message_id} for chat {contact_id}")
-                
-                logger.info(f"Message stored successfully in DB for contact {contact_id}")
-
-                # Broadcast to connected clients for real-time update
-                await manager.broadcast_to_client(actual_client_id, {
-                    "type": "new_message",
-                    "chatId": contact_id,
-                    "message": {
-                        "content": message_text,
-                        "timestamp": ts_dt.isoformat(),
-                        "is_from_me": False,
-                        "sender_name": contact_name,
-                        "status": "delivered",
-                        "whatsapp_message_id": message_id,
-                        "message_type": message_type,
-                        "media_url": media_url,
-                        "file_name": file_name,
-                        "mime_type": mime_type,
-                        "caption": caption
-                    }
-                })
+            logger.info(f"Message stored successfully in DB for contact {contact_id}")
+
+            if media_status == "pending":
+                media_pipeline.submit(media_job_from_message(new_msg))
+
+            # Firestore Sync - Chat Metadata
+            await sync_chat_metadata(contact_id, actual_client_id, {
+                "name": contact_name,
+                "phoneNumber": full_phone_number,
+                "lastMessage": message_text,
+                "lastMessageTime": get_ist_time(),
+                "unRead": chat.un_read,
+                "isActive": chat.is_active
+            })
+            logger.info(f"✅ Chat metadata synced for {contact_id}")
+
+            # Sync to Firestore for real-time app update
+            message_data = {
+                "content": message_text,
+                "timestamp": get_ist_time(),
+                "isFromMe": False,
+                "senderName": contact_name,
+                "status": message_status,
+                "whatsappMessageId": message_id,
+                "messageType": message_type,
+                "mediaUrl": media_url,
+                "fileName": file_name,
+                "mimeType": mime_type,
+                "caption": caption,
+                "mediaStatus": media_status
+            }
+            await sync_message(contact_id, actual_client_id, message_id, message_data)
+            logger.info(f"✅ Successfully stored in Firebase: Message {message_id} for chat {contact_id}")
+
+            # Broadcast to connected clients for real-time update
+            await manager.broadcast_to_client(actual_client_id, {
+                "type": "new_message",
+                "chatId": contact_id,
+                "message": {
+                    "content": message_text,
+                    "timestamp": ts_dt.isoformat(),
+                    "is_from_me": False,
+                    "sender_name": contact_name,
+                    "status": message_status,
+                    "whatsapp_message_id": message_id,
+                    "message_type": message_type,
+                    "media_url": media_url,
+                    "file_name": file_name,
+                    "mime_type": mime_type,
+                    "caption": caption,
+                    "media_status": media_status
+                }
+            })
+
+            # AI Response Logic
+            if ai_response_enabled:
+                await mark_message_as_read(secrets, message_id, True)
+                if message_type == 'text':
+                    try:
+                        ai_response = await generate_content_with_file_search(
+                            actual_client_id, 
+                            message_text, 
+                            secrets.get("googleApiKey"), 
+                            [secrets.get("storeId"), secrets.get("qnaStoreId")], 
+                            contact_id
+                        )
+                        await send_whatsapp_message_helper({
+                            "clientId": actual_client_id,
+                            "phoneNumber": phone_number,
+                            "message": ai_response,
+                            "chatId": contact_id,
+                            "messageType": "text"
+                        })
+                    except Exception as e:
+                         logger.error(f"AI Response Error: {e}")
+                else:
+                    await send_whatsapp_message_helper({
+                        "clientId": actual_client_id,
+                        "phoneNumber": phone_number,
+                        "message": "Sorry, could not understand your request. Try again later.",
+                        "chatId": contact_id,
+                        "messageType": "text"
+                    })
 
     except Exception as e:
         logger.error(f"Error handling chat message: {e}")
         # In Python we don't necessarily rethrow if inside an event loop unless strict
         raise e
 
-async def broadcast_message_helper(client_id, status, contact_id, full_phone_number):
-    # This helper now takes client_id and status/contact details
-    # We query Broadcasts and BroadcastMessages via SQL
+async def broadcast_message_helper(session, client_id, full_phone_number):
+    """
+    Finds the delivered/read broadcast template message for this phone that isn't in the
+    chat yet, preferring broadcasts still 'Sending' over 'Sent', newest first.
+    One lookup on the (client_id, mobile_no, added_to_chat) index, in the caller's session.
+    Returns (template chat message dict, BroadcastMessage id) or (None, None).
+    """
+    query = select(BroadcastMessage, Broadcast, Template).join(
+        Broadcast, Broadcast.id == BroadcastMessage.broadcast_id
+    ).outerjoin(
+        Template, and_(Template.id == Broadcast.template_id, Template.client_id == client_id)
+    ).where(
+        BroadcastMessage.client_id == client_id,
+        BroadcastMessage.mobile_no == full_phone_number,
+        BroadcastMessage.added_to_chat == False,
+        BroadcastMessage.status.in_(["delivered", "read"]),
+        Broadcast.status.in_(["Sending", "Sent"])
+    ).order_by(
+        (Broadcast.status == "Sending").desc(),
+        Broadcast.created_at.desc()
+    ).limit(1)
     
-    template_chat_message = None
-    message_doc_id = None # Return ID string
+    row = (await session.execute(query)).first()
+    if not row:
+        return None, None
     
-    async with AsyncSessionLocal() as session:
-        try:
-            # Find candidate broadcasts
-            # We want Broadcasts where status match (passed in arg is likely 'Sending' or 'Sent') (Wait, arg status is used to filter?)
-            # The original code filtered Broadcasts by status.
-            
-            # Since JSON contain query in standard SQLA is dialect specific, we'll fetch active broadcasts with status and filter in python for now
-            # Optimization: Filter by client_id and status
-            
-            # Using specific query if possible:
-            # from sqlalchemy import cast
-            # from sqlalchemy.dialects.postgresql import JSONB
-            
-            query = select(Broadcast).where(
-                Broadcast.client_id == client_id,
-                Broadcast.status == status
-            ).order_by(Broadcast.created_at.desc()).limit(20) # Limit to recent 20 to avoid scanning all
-            
-            result = await session.execute(query)
-            broadcasts = result.scalars().all()
-            
-            target_broadcast = None
-            
-            for b in broadcasts:
-                c_ids = b.contact_ids or []
-                if b.audience_type == 1:
-                    if full_phone_number in c_ids:
-                        target_broadcast = b
-                        break
-                else:
-                    if contact_id in c_ids:
-                        target_broadcast = b
-                        break
-            
-            if target_broadcast:
-                # Find the specific message in this broadcast
-                # Original logic: payload.mobileNo == fullPhoneNumber AND status in [delivered, read] AND addedToChat == False
-                
-                # Check BroadcastMessage table
-                # We need to dig into payload JSON to find mobileNo? 
-                # Or maybe we can rely on something else.
-                # The payload is stored in BroadcastMessage.payload
-                
-                # We'll fetch messages for this broadcast that are delivered/read and not added
-                msg_query = select(BroadcastMessage).where(
-                    BroadcastMessage.broadcast_id == target_broadcast.id,
-                    BroadcastMessage.status.in_(["delivered", "read"]),
-                    BroadcastMessage.added_to_chat == False
-                )
-                
-                msg_result = await session.execute(msg_query)
-                msgs = msg_result.scalars().all()
-                
-                target_msg = None
-                for m in msgs:
-                    # Check payload mobileNo
-                    p_mobile = m.payload.get("mobileNo")
-                    if p_mobile == full_phone_number:
-                        target_msg = m
-                        break
-                
-                if target_msg:
-                    message_doc_id = target_msg.id
-                    
-                    # Get Template Data
-                    t_result = await session.execute(select(Template).where(
-                        Template.id == target_broadcast.template_id, 
-                        Template.client_id == client_id
-                    ))
-                    template = t_result.scalars().first()
-                    
-                    if template:
-                        # Create template chat message dict
-                        template_chat_message = await create_template_chat_message(
-                            client_id,
-                            template,
-                            target_msg,
-                            target_broadcast,
-                            target_msg.whatsapp_message_id,
-                            target_msg.status,
-                            target_msg.delivered_at if target_msg.status == 'delivered' else target_msg.read_at
-                        )
+    target_msg, target_broadcast, template = row
+    if not template:
+        return None, target_msg.id
+    
+    # Create template chat message dict
+    template_chat_message = await create_template_chat_message(
+        client_id,
+        template,
+        target_msg,
+        target_broadcast,
+        target_msg.whatsapp_message_id,
+        target_msg.status,
+        target_msg.delivered_at if target_msg.status == 'delivered' else target_msg.read_at
+    )
+    return template_chat_message, target_msg.id
 
-        except Exception as e:
-            logger.error(f"Broadcast Message Helper Error: {e}")
-            
-    return template_chat_message, message_doc_id
 
+STATUS_PRIORITY = {"sent": 1, "delivered": 2, "read": 3, "failed": 1}
 
 async def handle_message_status_update(client_id, value):
-    statuses = value.get("statuses", [])
+    """
+    Applies every status in the webhook as one set-based batch:
+    one lookup per table with `= ANY(:ids)`, status rules applied in memory,
+    bulk UPDATEs by primary key, and one aggregated refund / daily-stats delta per
+    broadcast, all in a single transaction. Broadcast counter deltas go to the
+    write-behind aggregator once that transaction has committed.
+    """
+    statuses = [s for s in value.get("statuses", []) if s.get("id")]
     if not statuses:
         return
-        
+
     logger.info(f"📊 Processing {len(statuses)} status update(s)")
-    
+
+    ids = list(dict.fromkeys(s["id"] for s in statuses))
+    today = get_ist_time().strftime("%Y-%m-%d")
+    ist = timezone(timedelta(hours=5, minutes=30))
+
     async with AsyncSessionLocal() as session:
+        # 1. Resolve broadcast messages, then chat messages for the remaining ids
+        b_result = await session.execute(
+            select(
+                BroadcastMessage.id,
+                BroadcastMessage.broadcast_id,
+                BroadcastMessage.whatsapp_message_id,
+                BroadcastMessage.status,
+                BroadcastMessage.cost,
+                BroadcastMessage.sent_at,
+                BroadcastMessage.delivered_at,
+                BroadcastMessage.read_at,
+                BroadcastMessage.failed_at,
+                BroadcastMessage.error_code
+            ).where(BroadcastMessage.whatsapp_message_id == any_of(ids))
+        )
+        b_msgs = {}
+        for row in b_result.mappings().all():
+            b_msgs.setdefault(row["whatsapp_message_id"], dict(row))
+
+        remaining = [i for i in ids if i not in b_msgs]
+        messages = {}
+        if remaining:
+            m_result = await session.execute(
+                select(
+                    Message.id,
+                    Message.chat_id,
+                    Message.whatsapp_message_id,
+                    Message.status,
+                    Message.sent_at,
+                    Message.delivered_at,
+                    Message.read_at,
+                    Message.failed_at,
+                    Message.error_code,
+                    Message.error_description
+                ).where(Message.whatsapp_message_id == any_of(remaining)).order_by(Message.id)
+            )
+            for row in m_result.mappings().all():
+                messages.setdefault(row["whatsapp_message_id"], dict(row))
+
+        # 2. Apply status rules in memory, in webhook order
+        counter_deltas = {}   # broadcast_id -> {"sent": n, ...}
+        refunds = {}          # broadcast_id -> [count, amount]
+        daily_deltas = {}     # "sent"/"delivered"/... -> n
+        changed_b_msgs = {}
+        changed_messages = {}
+        ws_events = []
+        message_syncs = []
+
         for status_obj in statuses:
-            whatsapp_message_id = status_obj.get("id")
+            whatsapp_message_id = status_obj["id"]
             status = status_obj.get("status")
-            timestamp = status_obj.get("timestamp")
             billable = status_obj.get("pricing", {}).get("billable")
-            
-            if not whatsapp_message_id: continue
-            
-            logger.info(f"🔄 Updating status for: {whatsapp_message_id} → {status}")
-            
-            today = get_ist_time().strftime("%Y-%m-%d")
-            status_timestamp = datetime.datetime.fromtimestamp(int(timestamp), tz=timezone(timedelta(hours=5, minutes=30)))
+            status_timestamp = datetime.datetime.fromtimestamp(int(status_obj.get("timestamp")), tz=ist)
+            error = (status_obj.get("errors") or [{}])[0]
 
-            # 1. Check BroadcastMessage
-            result = await session.execute(select(BroadcastMessage).where(BroadcastMessage.whatsapp_message_id == whatsapp_message_id))
-            b_msg = result.scalars().first()
-            
+            b_msg = b_msgs.get(whatsapp_message_id)
             if b_msg:
-                # Update BroadcastMessage
-                if b_msg.status == status: continue
-                
-                b_msg.status = status
-                
-                # Fetch Broadcast to update stats
-                b_result = await session.execute(select(Broadcast).where(Broadcast.id == b_msg.broadcast_id))
-                broadcast = b_result.scalars().first()
-                if not broadcast: continue
+                if b_msg["status"] == status: continue
+
+                b_msg["status"] = status
+                deltas = counter_deltas.setdefault(b_msg["broadcast_id"], {})
 
                 if status == 'failed':
-                    b_msg.error_code = status_obj.get("errors", [{}])[0].get("code")
-                    b_msg.failed_at = status_timestamp
-                    broadcast.failed += 1
-                    # Refund
-                    await refund_message_cost(client_id, broadcast.id, b_msg.cost)
-                    await increment_daily_stats(client_id, today, 'failed')
-                    
+                    b_msg["error_code"] = error.get("code")
+                    b_msg["failed_at"] = status_timestamp
+                    refund = refunds.setdefault(b_msg["broadcast_id"], [0, 0.0])
+                    refund[0] += 1
+                    refund[1] += b_msg["cost"] or 0.0
                 elif status == 'sent':
-                    b_msg.sent_at = status_timestamp
-                    broadcast.sent += 1
+                    b_msg["sent_at"] = status_timestamp
                     if not billable:
-                        await refund_message_cost(client_id, broadcast.id, b_msg.cost)
-                    await increment_daily_stats(client_id, today, 'sent')
-                    
+                        refund = refunds.setdefault(b_msg["broadcast_id"], [0, 0.0])
+                        refund[0] += 1
+                        refund[1] += b_msg["cost"] or 0.0
                 elif status == 'delivered':
-                    b_msg.delivered_at = status_timestamp
-                    broadcast.delivered += 1
-                    await increment_daily_stats(client_id, today, 'delivered')
-                    
+                    b_msg["delivered_at"] = status_timestamp
                 elif status == 'read':
-                    b_msg.read_at = status_timestamp
-                    broadcast.read += 1
-                    await increment_daily_stats(client_id, today, 'read')
-                
-                await session.commit()
-                
-                # Firestore Sync - Broadcast Stats
-                await sync_broadcast_stats(broadcast.id, client_id, {
-                    "sent": broadcast.sent,
-                    "delivered": broadcast.delivered,
-                    "read": broadcast.read,
-                    "failed": broadcast.failed,
-                    "status": broadcast.status
-                })
-                
-                # Broadcast status update for broadcast messages
-                await manager.broadcast_to_client(client_id, {
+                    b_msg["read_at"] = status_timestamp
+
+                if status in ('sent', 'delivered', 'read', 'failed'):
+                    deltas[status] = deltas.get(status, 0) + 1
+                    daily_deltas[status] = daily_deltas.get(status, 0) + 1
+
+                changed_b_msgs[b_msg["id"]] = b_msg
+                ws_events.append({
                     "type": "status_update",
                     "whatsappMessageId": whatsapp_message_id,
                     "status": status
                 })
                 continue # broadcast handled
 
-            # 2. Check Chat Message
-            # Only need to join Client? Or just query Message directly (unique ID usually)
-            m_result = await session.execute(select(Message).where(Message.whatsapp_message_id == whatsapp_message_id))
-            message = m_result.scalars().first()
-            
+            message = messages.get(whatsapp_message_id)
             if message:
-                current_status = message.status or "sent"
-                status_priority = {"sent": 1, "delivered": 2, "read": 3, "failed": 1}
-                 
-                new_prio = status_priority.get(status, 1)
-                curr_prio = status_priority.get(current_status, 1)
-                 
+                current_status = message["status"] or "sent"
+                new_prio = STATUS_PRIORITY.get(status, 1)
+                curr_prio = STATUS_PRIORITY.get(current_status, 1)
+
                 if new_prio >= curr_prio:
-                    message.status = status
+                    message["status"] = status
                     if status == 'failed':
-                        message.error_code = status_obj.get("errors", [{}])[0].get("code")
-                        message.error_description = status_obj.get("errors", [{}])[0].get("error_data", {}).get("details")
-                        message.failed_at = status_timestamp
+                        message["error_code"] = error.get("code")
+                        message["error_description"] = error.get("error_data", {}).get("details")
+                        message["failed_at"] = status_timestamp
                     elif status == 'delivered':
-                        message.delivered_at = status_timestamp
-                        await increment_daily_stats(client_id, today, 'delivered')
+                        message["delivered_at"] = status_timestamp
+                        daily_deltas["delivered"] = daily_deltas.get("delivered", 0) + 1
                     elif status == 'read':
-                        message.read_at = status_timestamp
-                        await increment_daily_stats(client_id, today, 'read')
-                    
-                    await session.commit()
-
-                    # Firestore Sync - Message Status (Individual Chat)
-                    # We need the chat_id from the message
-                    await sync_message_status(message.chat_id, client_id, whatsapp_message_id, status, status_timestamp)
+                        message["read_at"] = status_timestamp
+                        daily_deltas["read"] = daily_deltas.get("read", 0) + 1
 
-                    # Broadcast status update for individual chat messages
-                    await manager.broadcast_to_client(client_id, {
+                    changed_messages[message["id"]] = message
+                    message_syncs.append((message["chat_id"], whatsapp_message_id, status, status_timestamp))
+                    ws_events.append({
                         "type": "status_update",
                         "whatsappMessageId": whatsapp_message_id,
                         "status": status
@@ -652,6 +590,193 @@ async def handle_message_status_update(client_id, value):
             else:
                 logger.info(f"Message ID {whatsapp_message_id} not found in Broadcasts or Chats")
 
+        # 3. Write back: bulk UPDATEs by primary key + aggregated deltas, one commit
+        try:
+            if changed_b_msgs:
+                await session.execute(update(BroadcastMessage), [
+                    {k: m[k] for k in ("id", "status", "sent_at", "delivered_at", "read_at", "failed_at", "error_code")}
+                    for m in changed_b_msgs.values()
+                ])
+            if changed_messages:
+                await session.execute(update(Message), [
+                    {k: m[k] for k in ("id", "status", "delivered_at", "read_at", "failed_at", "error_code", "error_description")}
+                    for m in changed_messages.values()
+                ])
+
+            for broadcast_id, (count, amount) in refunds.items():
+                await refund_message_costs(session, client_id, broadcast_id, count, amount)
+
+            await add_daily_stats(session, client_id, today, daily_deltas)
+            await session.commit()
+        except Exception as e:
+            logger.error(f"Status batch write error: {e}")
+            await session.rollback()
+            raise
+
+    # 4. Side effects after commit; broadcast counters and their Firestore/WebSocket
+    # stats are written behind, coalesced across webhooks (see broadcast_counters.py)
+    for broadcast_id, deltas in counter_deltas.items():
+        if deltas:
+            await broadcast_counters.add(client_id, broadcast_id, deltas)
+
+    for chat_id, whatsapp_message_id, status, status_timestamp in message_syncs:
+        # Firestore Sync - Message Status (Individual Chat)
+        await sync_message_status(chat_id, client_id, whatsapp_message_id, status, status_timestamp)
+
+    for event in ws_events:
+        await manager.broadcast_to_client(client_id, event)
+
+async def drop_redelivered_events(value):
+    """
+    Removes messages / statuses that were already processed, keyed by
+    (whatsapp_message_id, kind, status). Returns (filtered value or None, claimed keys).
+    """
+    if value.get("statuses"):
+        list_key, kind = "statuses", "status"
+    else:
+        list_key, kind = "messages", "message"
+
+    items = value.get(list_key) or []
+    keys = []
+    for item in items:
+        status = (item.get("status") or "") if kind == "status" else ""
+        keys.append((item["id"], kind, status) if item.get("id") else None)
+
+    if not any(keys):
+        return value, set()
+
+    claimed = await webhook_dedup.claim([k for k in keys if k])
+    kept = []
+    used = set()
+    for item, key in zip(items, keys):
+        # Items without an id cannot be de-duplicated and are always kept
+        if key is None:
+            kept.append(item)
+        elif key in claimed and key not in used:
+            used.add(key)
+            kept.append(item)
+    if not kept:
+        return None, claimed
+    if len(kept) == len(items):
+        return value, claimed
+    logger.info(f"Dropped {len(items) - len(kept)} redelivered {list_key}")
+    return {**value, list_key: kept}, claimed
+
+async def process_webhook_payload(body):
+    """
+    Validates a parsed Meta webhook body and dispatches every change to its handler.
+    Shared by the inline /webhook path and the webhook queue workers.
+    Handler errors are raised so queued deliveries can be retried.
+    """
+    # Check if this is a proper Meta webhook format
+    if not isinstance(body, dict):
+        logger.error(f"Invalid webhook body: not a dict, got {type(body)}")
+        await log_webhook(None, "invalid_payload", {"error": "Body is not a JSON object", "type": str(type(body))}, "ERROR")
+        return
+
+    logger.info(f"Webhook event received: {body.get('object')}")
+
+    # Check for Meta webhook format
+    if body.get("object") != "whatsapp_business_account":
+        # Not a Meta webhook - could be a test payload or different format
+        logger.warning(f"Unexpected webhook format - missing 'object': {list(body.keys())}")
+        # Still try to process if it has entry, otherwise log and return
+        if not body.get("entry"):
+            logger.error(f"Invalid webhook body: missing 'entry' array. Keys: {list(body.keys())}")
+            await log_webhook(None, "invalid_payload", {"error": "Missing 'entry' array", "received_keys": list(body.keys()), "sample": str(body)[:500]}, "ERROR")
+            return
+
+    if not isinstance(body.get("entry"), list):
+        logger.error(f"Invalid webhook body: 'entry' is not an array, got {type(body.get('entry'))}")
+        await log_webhook(None, "invalid_payload", {"error": "'entry' is not an array", "entry_type": str(type(body.get("entry")))}, "ERROR")
+        return
+
+    # Submit every job before awaiting anything, so jobs of the same chat keep arrival order
+    futures = []
+    for entry in body.get("entry", []):
+        for change in entry.get("changes", []):
+            field = change.get("field")
+            value = change.get("value", {})
+
+            # metadata could be in value.metadata or value directly?
+            # JS: const phoneNumberId = value.metadata?.phone_number_id;
+            phone_number_id = value.get("metadata", {}).get("phone_number_id")
+            client_id = phone_number_id
+            logger.info(f"Processing webhook for Client ID (PhoneNumberID): {client_id}, Field: {field}")
+
+            for shard, job in plan_webhook_jobs(client_id, field, value):
+                futures.append(dispatcher.submit((client_id, shard), job))
+
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    errors = [r for r in results if isinstance(r, Exception)]
+    if errors:
+        # Completed jobs are de-duplicated, so a retry only re-runs the failed ones
+        raise errors[0]
+
+def plan_webhook_jobs(client_id, field, value):
+    """
+    Splits one webhook change into (shard, job) pairs. The shard is the contact's phone
+    for inbound messages so each chat is processed in order; delivery statuses and
+    tenant-wide events get their own shards.
+    """
+    if field == "message_template_status_update":
+        async def job():
+            await log_webhook(client_id, "status_update", value)
+            await handle_status_update(client_id, value)
+        return [("__templates__", job)]
+
+    if field == "template_category_update":
+        async def job():
+            await log_webhook(client_id, "category_update", value)
+            await handle_category_update(client_id, value)
+        return [("__templates__", job)]
+
+    if field == "messages":
+        jobs = []
+        if value.get("statuses"):
+            # The whole webhook is one set-based batch (statuses applied in webhook order).
+            # Batches share one shard per tenant: they don't need chat order, but a
+            # message's sent/delivered/read in separate webhooks must not race each other.
+            if WEBHOOK_LOG_MESSAGES:
+                queue_webhook_log(client_id, "message_status_update", value)
+            jobs.append(("__statuses__", functools.partial(run_deduplicated, handle_message_status_update, client_id, value)))
+        else:
+            contacts = value.get("contacts") or []
+            for message in value.get("messages") or []:
+                sender = message.get("from")
+                sender_contacts = [c for c in contacts if c.get("wa_id") == sender] or contacts
+                sub_value = {**value, "messages": [message], "contacts": sender_contacts}
+                if WEBHOOK_LOG_MESSAGES:
+                    queue_webhook_log(client_id, "chat_message", sub_value)
+                jobs.append((sender, functools.partial(run_deduplicated, handle_chat_message, client_id, sub_value)))
+        return jobs
+
+    if field == "user_preferences":
+        wa_id = (value.get("user_preferences") or [{}])[0].get("wa_id")
+        async def job():
+            await log_webhook(client_id, "user_preference", value)
+            await update_user_preference(client_id, value)
+        return [(wa_id, job)]
+
+    async def job():
+        await log_webhook(client_id, "unknown_event", {"field": field, "value": value})
+    return [("__misc__", job)]
+
+async def run_deduplicated(handler, client_id, value):
+    # Drop Meta redeliveries before any handler work runs
+    value, claimed_keys = await drop_redelivered_events(value)
+    if value is None:
+        logger.info(f"Skipping redelivered webhook for {client_id}")
+        return
+    try:
+        await handler(client_id, value)
+    except Exception:
+        # Let a retry / redelivery process these events again
+        await webhook_dedup.release(claimed_keys)
+        raise
+    # A crash or cancellation before this point leaves the keys leased, not done
+    await webhook_dedup.complete(claimed_keys)
+
 async def update_user_preference(client_id, value):
     user_pref = value.get("user_preferences", [{}])[0]
     val = user_pref.get("value", "").lower()
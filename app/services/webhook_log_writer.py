@@ -0,0 +1,128 @@
+import logging
+import asyncio
+import os
+import time
+import json
+from contextvars import ContextVar
+from app.database import AsyncSessionLocal
+from app.models.sql_models import WebhookLog
+from sqlalchemy import insert
+
+logger = logging.getLogger(__name__)
+
+# Group-commit writer for webhook_logs.
+# Handlers only append to a bounded in-memory queue; one background task flushes it
+# every WEBHOOK_LOG_FLUSH_MS or WEBHOOK_LOG_BATCH_SIZE rows, whichever comes first,
+# as a single multi-row INSERT. When the queue is full new records are dropped and
+# counted rather than slowing the webhook path down.
+WEBHOOK_LOG_QUEUE_SIZE = int(os.getenv("WEBHOOK_LOG_QUEUE_SIZE", "10000"))
+WEBHOOK_LOG_BATCH_SIZE = int(os.getenv("WEBHOOK_LOG_BATCH_SIZE", "500"))
+WEBHOOK_LOG_FLUSH_MS = int(os.getenv("WEBHOOK_LOG_FLUSH_MS", "200"))
+
+# Set by the replay tool so replayed payloads are not logged a second time
+webhook_logs_suppressed = ContextVar("webhook_logs_suppressed", default=False)
+
+def serialize_payload(payload):
+    """Convert payload to JSON-serializable format, handling non-serializable objects."""
+    if payload is None:
+        return None
+
+    try:
+        # Try to serialize to JSON and back to ensure it's clean
+        json_str = json.dumps(payload, default=str)
+        return json.loads(json_str)
+    except (TypeError, ValueError) as e:
+        # If serialization fails, convert to string representation
+        logger.warning(f"Payload serialization failed: {e}, converting to string")
+        return {"_serialized_error": str(e), "_original_type": str(type(payload)), "_string_repr": str(payload)[:1000]}
+
+
+class WebhookLogWriter:
+    def __init__(self):
+        self.queue = asyncio.Queue(maxsize=WEBHOOK_LOG_QUEUE_SIZE)
+        self.stats = {"enqueued": 0, "written": 0, "dropped": 0, "failed": 0, "flushes": 0}
+        self._task = None
+        self._pending = []
+
+    def submit(self, record: dict):
+        if webhook_logs_suppressed.get():
+            return
+        try:
+            self.queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            if self.stats["dropped"] % 1000 == 1:
+                logger.warning(f"Webhook log queue full, dropped {self.stats['dropped']} record(s) so far")
+            return
+        self.stats["enqueued"] += 1
+
+    async def _collect(self, batch):
+        """Waits for one record, then keeps collecting until the batch is full or the flush window closes."""
+        batch.append(await self.queue.get())
+        deadline = time.monotonic() + WEBHOOK_LOG_FLUSH_MS / 1000
+        while len(batch) < WEBHOOK_LOG_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+
+    async def flush(self, batch):
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.execute(insert(WebhookLog), batch)
+                await session.commit()
+        except Exception as e:
+            # Most likely a payload JSONB can't encode: sanitize every row and retry once
+            logger.warning(f"Webhook log batch insert failed, retrying sanitized: {e}")
+            for record in batch:
+                record["payload"] = serialize_payload(record["payload"])
+            try:
+                async with AsyncSessionLocal() as session:
+                    await session.execute(insert(WebhookLog), batch)
+                    await session.commit()
+            except Exception as e:
+                self.stats["failed"] += len(batch)
+                logger.error(f"LOGGING ERROR: dropped {len(batch)} webhook log(s): {e}")
+                return
+        self.stats["written"] += len(batch)
+        self.stats["flushes"] += 1
+
+    async def _run(self):
+        while True:
+            await self._collect(self._pending)
+            batch, self._pending = self._pending, []
+            await self.flush(batch)
+
+    def _drain(self):
+        batch = []
+        while not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Flush whatever is still queued so a clean shutdown loses nothing
+        batch = self._pending + self._drain()
+        self._pending = []
+        while batch:
+            await self.flush(batch[:WEBHOOK_LOG_BATCH_SIZE])
+            batch = batch[WEBHOOK_LOG_BATCH_SIZE:]
+
+    def get_metrics(self):
+        return {
+            "queueDepth": self.queue.qsize(),
+            "queueCapacity": WEBHOOK_LOG_QUEUE_SIZE,
+            **self.stats
+        }
+
+webhook_log_writer = WebhookLogWriter()
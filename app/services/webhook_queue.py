@@ -0,0 +1,200 @@
+import logging
+import asyncio
+import os
+import time
+from app.database import AsyncSessionLocal
+from app.services.webhook_handlers import process_webhook_payload
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Durable webhook ingestion.
+# /webhook appends the raw body to the `webhook_queue` table and ACKs Meta at once.
+# Each process claims rows with FOR UPDATE SKIP LOCKED, so several API processes can
+# drain the same queue, and runs up to WEBHOOK_QUEUE_WORKERS of them concurrently.
+# A claimed row stays invisible until its visibility timeout expires; if the process
+# dies before deleting it, the row is claimed again (at-least-once delivery).
+WEBHOOK_QUEUE_ENABLED = os.getenv("WEBHOOK_QUEUE_ENABLED", "false").lower() == "true"
+WEBHOOK_QUEUE_WORKERS = int(os.getenv("WEBHOOK_QUEUE_WORKERS", "16"))  # max rows in flight per process
+WEBHOOK_QUEUE_BATCH_SIZE = int(os.getenv("WEBHOOK_QUEUE_BATCH_SIZE", "10"))
+WEBHOOK_QUEUE_VISIBILITY_TIMEOUT = int(os.getenv("WEBHOOK_QUEUE_VISIBILITY_TIMEOUT", "300"))  # seconds
+WEBHOOK_QUEUE_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_QUEUE_MAX_ATTEMPTS", "5"))
+WEBHOOK_QUEUE_POLL_INTERVAL = float(os.getenv("WEBHOOK_QUEUE_POLL_INTERVAL", "1.0"))  # seconds
+
+ENQUEUE_SQL = text("INSERT INTO webhook_queue (payload, status, attempts) VALUES (CAST(:payload AS JSONB), 'pending', 0)")
+
+CLAIM_SQL = text("""
+    UPDATE webhook_queue
+    SET status = 'processing',
+        attempts = attempts + 1,
+        visible_at = now() + make_interval(secs => :visibility)
+    WHERE id IN (
+        SELECT id FROM webhook_queue
+        WHERE status IN ('pending', 'processing') AND visible_at <= now()
+        ORDER BY id
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, payload, attempts
+""")
+
+ACK_SQL = text("DELETE FROM webhook_queue WHERE id = :id")
+
+RETRY_SQL = text("""
+    UPDATE webhook_queue
+    SET status = 'pending', visible_at = now() + make_interval(secs => :delay), last_error = :error
+    WHERE id = :id
+""")
+
+DEAD_SQL = text("UPDATE webhook_queue SET status = 'dead', last_error = :error WHERE id = :id")
+
+DEPTH_SQL = text("""
+    SELECT status, count(*) AS depth, EXTRACT(EPOCH FROM (now() - min(created_at))) AS oldest_age
+    FROM webhook_queue
+    GROUP BY status
+""")
+
+
+class WebhookQueue:
+    def __init__(self):
+        self.claimer = None
+        self.in_flight = set()
+        self.stats = {
+            "enqueued": 0,
+            "processed": 0,
+            "retried": 0,
+            "dead": 0,
+            "totalProcessingSeconds": 0.0,
+        }
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+
+    async def enqueue(self, raw_body: bytes):
+        """Single INSERT of the raw webhook body. Postgres parses it into JSONB."""
+        async with AsyncSessionLocal() as session:
+            await session.execute(ENQUEUE_SQL, {"payload": raw_body.decode("utf-8")})
+            await session.commit()
+        self.stats["enqueued"] += 1
+        # Wake the claim loop in this process instead of waiting for the next poll
+        self._wakeup.set()
+
+    async def claim(self, limit: int):
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(CLAIM_SQL, {
+                "visibility": WEBHOOK_QUEUE_VISIBILITY_TIMEOUT,
+                "limit": limit
+            })
+            rows = result.all()
+            await session.commit()
+            return rows
+
+    async def ack(self, item_id: int):
+        async with AsyncSessionLocal() as session:
+            await session.execute(ACK_SQL, {"id": item_id})
+            await session.commit()
+
+    async def nack(self, item_id: int, attempts: int, error: str):
+        async with AsyncSessionLocal() as session:
+            if attempts >= WEBHOOK_QUEUE_MAX_ATTEMPTS:
+                await session.execute(DEAD_SQL, {"id": item_id, "error": error[:2000]})
+                self.stats["dead"] += 1
+                logger.error(f"❌ Webhook queue item {item_id} moved to dead letter after {attempts} attempts: {error}")
+            else:
+                # Exponential backoff: 2s, 4s, 8s ...
+                delay = min(2 ** attempts, WEBHOOK_QUEUE_VISIBILITY_TIMEOUT)
+                await session.execute(RETRY_SQL, {"id": item_id, "delay": delay, "error": error[:2000]})
+                self.stats["retried"] += 1
+                logger.warning(f"Webhook queue item {item_id} failed (attempt {attempts}), retrying in {delay}s: {error}")
+            await session.commit()
+
+    async def process_item(self, item_id: int, payload, attempts: int):
+        started = time.monotonic()
+        try:
+            await process_webhook_payload(payload)
+        except Exception as e:
+            await self.nack(item_id, attempts, str(e))
+            return
+        await self.ack(item_id)
+        self.stats["processed"] += 1
+        self.stats["totalProcessingSeconds"] += time.monotonic() - started
+
+    async def claim_loop(self):
+        """
+        Claims rows in id order and starts them in that order, so the shard dispatcher
+        receives each chat's webhooks in arrival order. At most WEBHOOK_QUEUE_WORKERS
+        rows are in flight per process.
+        """
+        slots = asyncio.Semaphore(WEBHOOK_QUEUE_WORKERS)
+        logger.info(f"🚀 Webhook queue started with {WEBHOOK_QUEUE_WORKERS} in-flight slot(s)")
+        while not self._stopping:
+            await slots.acquire()
+            free = 1
+            while free < WEBHOOK_QUEUE_BATCH_SIZE and not slots.locked():
+                await slots.acquire()
+                free += 1
+
+            self._wakeup.clear()
+            try:
+                rows = await self.claim(free)
+            except Exception as e:
+                logger.error(f"Webhook queue claim error: {e}")
+                rows = []
+
+            for _ in range(free - len(rows)):
+                slots.release()
+
+            for row in rows:
+                task = asyncio.create_task(self.process_item(row.id, row.payload, row.attempts))
+                self.in_flight.add(task)
+                task.add_done_callback(self.in_flight.discard)
+                task.add_done_callback(lambda _: slots.release())
+
+            if not rows:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=WEBHOOK_QUEUE_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+
+    def start(self):
+        if self.claimer:
+            return
+        self._stopping = False
+        self.claimer = asyncio.create_task(self.claim_loop())
+
+    async def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+        tasks = [t for t in [self.claimer, *self.in_flight] if t]
+        for task in tasks:
+            task.cancel()
+        # Rows claimed by cancelled tasks become visible again after the timeout
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.claimer = None
+
+    async def get_metrics(self):
+        depth = {}
+        try:
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(DEPTH_SQL)
+                for row in result.all():
+                    depth[row.status] = {
+                        "depth": row.depth,
+                        "oldestAgeSeconds": float(row.oldest_age or 0)
+                    }
+        except Exception as e:
+            logger.error(f"Webhook queue metrics error: {e}")
+
+        processed = self.stats["processed"]
+        return {
+            "enabled": WEBHOOK_QUEUE_ENABLED,
+            "maxInFlight": WEBHOOK_QUEUE_WORKERS,
+            "inFlight": len(self.in_flight),
+            "depth": depth,
+            "enqueued": self.stats["enqueued"],
+            "processed": processed,
+            "retried": self.stats["retried"],
+            "dead": self.stats["dead"],
+            "avgProcessingSeconds": (self.stats["totalProcessingSeconds"] / processed) if processed else 0.0,
+        }
+
+webhook_queue = WebhookQueue()
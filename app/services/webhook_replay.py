@@ -0,0 +1,254 @@
+import logging
+import asyncio
+import argparse
+import datetime
+import json
+import os
+import time
+import uuid
+from app.database import AsyncSessionLocal
+from app.models.sql_models import WebhookLog
+from app.services.utils import get_base_url
+from app.services.meta_client import meta_client
+from app.services.webhook_handlers import process_webhook_payload
+from app.services.webhook_dedup import dedup_bypassed
+from app.services.webhook_log_writer import webhook_log_writer, webhook_logs_suppressed
+from sqlalchemy.future import select
+from sqlalchemy import tuple_
+
+logger = logging.getLogger(__name__)
+
+# Replays stored webhook traffic through process_webhook_payload, the same dispatch
+# /webhook uses. Sources are webhook_logs rows (enable WEBHOOK_LOG_MESSAGES to capture
+# chat messages and statuses too) or an NDJSON file of raw Meta bodies / log records.
+# Handlers call the Graph API at BASE_URL, so replay refuses to run while it points at
+# graph.facebook.com unless allow_live is set. Point BASE_URL at a local Meta stub.
+#
+#   python -m app.services.webhook_replay --since 2026-10-01T00:00:00+05:30 --rate 50
+#   python -m app.services.webhook_replay --file capture.ndjson --concurrency 64
+#
+# The admin endpoint only reads captures from WEBHOOK_REPLAY_DIR (file replay over
+# HTTP is off while it is unset); the CLI reads any path it is given.
+WEBHOOK_REPLAY_DIR = os.getenv("WEBHOOK_REPLAY_DIR", "")
+
+LOG_TYPE_FIELDS = {
+    "status_update": "message_template_status_update",
+    "category_update": "template_category_update",
+    "user_preference": "user_preferences",
+    "message_status_update": "messages",
+    "chat_message": "messages",
+}
+
+REPLAY_BATCH_SIZE = 500
+
+def body_from_log(client_id, type_str, payload):
+    """Rebuilds a Meta webhook body from a webhook_logs row. Returns None for rows that can't be replayed."""
+    if not isinstance(payload, dict):
+        return None
+    if type_str == "unknown_event":
+        field, value = payload.get("field"), payload.get("value")
+    else:
+        field, value = LOG_TYPE_FIELDS.get(type_str), payload
+    if not field or not isinstance(value, dict):
+        return None
+
+    # Handlers resolve the tenant from metadata.phone_number_id
+    if client_id and client_id != "unknown" and not value.get("metadata"):
+        value = {**value, "metadata": {"phone_number_id": client_id}}
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "replay", "changes": [{"field": field, "value": value}]}]
+    }
+
+async def iter_webhook_logs(since=None, until=None, client_id=None, types=None, limit=None):
+    """Streams replayable webhook_logs rows in arrival order using keyset pagination."""
+    types = types or list(LOG_TYPE_FIELDS) + ["unknown_event"]
+    last = None
+    yielded = 0
+    while True:
+        query = select(WebhookLog).where(WebhookLog.type.in_(types))
+        if since:
+            query = query.where(WebhookLog.created_at >= since)
+        if until:
+            query = query.where(WebhookLog.created_at < until)
+        if client_id:
+            query = query.where(WebhookLog.client_id == client_id)
+        if last:
+            query = query.where(tuple_(WebhookLog.created_at, WebhookLog.id) > tuple_(*last))
+        query = query.order_by(WebhookLog.created_at, WebhookLog.id).limit(REPLAY_BATCH_SIZE)
+
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(query)
+            rows = result.scalars().all()
+        if not rows:
+            return
+
+        for row in rows:
+            body = body_from_log(row.client_id, row.type, row.payload)
+            if body:
+                yield body
+                yielded += 1
+                if limit and yielded >= limit:
+                    return
+        last = (rows[-1].created_at, rows[-1].id)
+
+async def iter_ndjson(path, limit=None):
+    """Each line is either a raw Meta webhook body or a {"client_id", "type", "payload"} log record."""
+    yielded = 0
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            body = record if "entry" in record else body_from_log(record.get("client_id"), record.get("type"), record.get("payload"))
+            if body:
+                yield body
+                yielded += 1
+                if limit and yielded >= limit:
+                    return
+
+def capture_path(name):
+    """Resolves a capture file name inside WEBHOOK_REPLAY_DIR; raises ValueError for anything outside it."""
+    if not WEBHOOK_REPLAY_DIR:
+        raise ValueError("File replay is disabled; set WEBHOOK_REPLAY_DIR")
+    root = os.path.realpath(WEBHOOK_REPLAY_DIR)
+    path = os.path.realpath(os.path.join(root, name))
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError("Capture file must be inside WEBHOOK_REPLAY_DIR")
+    if not os.path.isfile(path):
+        raise ValueError(f"Capture file {name} not found")
+    return path
+
+def check_target(allow_live: bool):
+    base_url = get_base_url()
+    if "graph.facebook.com" in base_url and not allow_live:
+        raise RuntimeError(
+            f"BASE_URL is {base_url}; replay would call the live Graph API. "
+            "Point BASE_URL at a local Meta stub or pass allow_live."
+        )
+
+
+class ReplayJob:
+    def __init__(self, source, rate=None, concurrency=32, dedup=True):
+        self.id = uuid.uuid4().hex[:12]
+        self.source = source
+        self.rate = rate  # bodies per second, None = as fast as possible
+        self.concurrency = concurrency
+        self.dedup = dedup
+        self.status = "pending"
+        self.stats = {"replayed": 0, "failed": 0}
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self._in_flight = set()
+
+    async def _replay_one(self, body, slots):
+        try:
+            await process_webhook_payload(body)
+            self.stats["replayed"] += 1
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.warning(f"Replay {self.id}: webhook failed: {e}")
+        finally:
+            slots.release()
+
+    async def run(self):
+        # Replayed payloads are already in webhook_logs; don't log them again
+        webhook_logs_suppressed.set(True)
+        if not self.dedup:
+            dedup_bypassed.set(True)
+
+        self.status = "running"
+        self.started_at = time.monotonic()
+        slots = asyncio.Semaphore(self.concurrency)
+        try:
+            index = 0
+            async for body in self.source:
+                if self.rate:
+                    delay = self.started_at + index / self.rate - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                await slots.acquire()
+                # Started in order, so the shard dispatcher keeps each chat's original order
+                task = asyncio.create_task(self._replay_one(body, slots))
+                self._in_flight.add(task)
+                task.add_done_callback(self._in_flight.discard)
+                index += 1
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+            self.status = "completed"
+        except asyncio.CancelledError:
+            self.status = "cancelled"
+            raise
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            logger.error(f"Replay {self.id} failed: {e}")
+        finally:
+            self.finished_at = time.monotonic()
+            logger.info(f"Replay {self.id} {self.status}: {self.stats}")
+
+    def to_dict(self):
+        elapsed = ((self.finished_at or time.monotonic()) - self.started_at) if self.started_at else 0.0
+        done = self.stats["replayed"] + self.stats["failed"]
+        return {
+            "id": self.id,
+            "status": self.status,
+            "rate": self.rate,
+            "concurrency": self.concurrency,
+            "dedup": self.dedup,
+            "inFlight": len(self._in_flight),
+            **self.stats,
+            "elapsedSeconds": round(elapsed, 3),
+            "throughputPerSecond": round(done / elapsed, 2) if elapsed else 0.0,
+            "error": self.error
+        }
+
+replay_jobs = {}
+
+def start_replay(source, rate=None, concurrency=32, dedup=True, allow_live=False):
+    """Starts a replay in the background of the running server and returns its job."""
+    check_target(allow_live)
+    job = ReplayJob(source, rate=rate, concurrency=concurrency, dedup=dedup)
+    replay_jobs[job.id] = job
+    asyncio.create_task(job.run())
+    return job
+
+def parse_time(value):
+    return datetime.datetime.fromisoformat(value) if value else None
+
+async def main(args):
+    from app.services.firebase_service import init_firebase
+
+    check_target(args.allow_live)
+    init_firebase()
+    webhook_log_writer.start()
+    if args.file:
+        source = iter_ndjson(args.file, limit=args.limit)
+    else:
+        source = iter_webhook_logs(
+            since=parse_time(args.since), until=parse_time(args.until),
+            client_id=args.client_id, types=args.types, limit=args.limit
+        )
+    job = ReplayJob(source, rate=args.rate, concurrency=args.concurrency, dedup=not args.no_dedup)
+    try:
+        await job.run()
+    finally:
+        await webhook_log_writer.stop()
+        await meta_client.stop()
+    print(json.dumps(job.to_dict(), indent=2))
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Replay stored webhooks through the webhook dispatcher")
+    parser.add_argument("--file", help="NDJSON capture instead of webhook_logs")
+    parser.add_argument("--since", help="ISO timestamp (inclusive)")
+    parser.add_argument("--until", help="ISO timestamp (exclusive)")
+    parser.add_argument("--client-id", help="Only this phone number id")
+    parser.add_argument("--types", nargs="*", help="webhook_logs types to replay")
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--rate", type=float, help="Webhooks per second (default: as fast as possible)")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--no-dedup", action="store_true", help="Process events even if already handled")
+    parser.add_argument("--allow-live", action="store_true", help="Allow calls to graph.facebook.com")
+    asyncio.run(main(parser.parse_args()))
@@ -1,6 +1,7 @@
 from app.services.utils import get_secrets, get_base_url
+from app.services.meta_client import meta_client
+from app.services.send_limiter import send_limiter
 from typing import Any, Dict, List
-import httpx
 import os
 import logging
 
@@ -13,14 +14,13 @@ async def get_meta_token():
 async def get_app_id(access_token):
     # Fetch App ID using debug_token
     try:
-        url = "https://graph.facebook.com/v21.0/debug_token"
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(url, params={
-                "input_token": access_token,
-                "access_token": access_token
-            })
-            data = resp.json()
-            return data.get("data", {}).get("app_id")
+        url = f"{get_base_url()}/debug_token"
+        resp = await meta_client.get(url, params={
+            "input_token": access_token,
+            "access_token": access_token
+        })
+        data = resp.json()
+        return data.get("data", {}).get("app_id")
     except Exception as e:
         logger.error(f"Error fetching App ID: {e}")
         return None
@@ -39,38 +39,37 @@ async def create_media_handle(secrets, file_content, file_name, mime_type):
         init_url = f"{base_url}/{app_id}/uploads"
         file_length = len(file_content)
         
-        async with httpx.AsyncClient() as client:
-            # Step 1: Initialize
-            init_resp = await client.post(
-                init_url,
-                params={
-                    "file_length": file_length,
-                    "file_type": mime_type
-                },
-                headers={"Authorization": f"Bearer {token}"}
-            )
-            init_resp.raise_for_status()
-            session_id = init_resp.json().get("id")
-            
-            # Step 2: Upload Content
-            upload_url = f"{base_url}/{session_id}"
-            
-            # Headers for upload
-            headers = {
-                "Authorization": f"Bearer {token}",
-                "file_offset": "0"
-            }
-            
-            upload_resp = await client.post(
-                upload_url,
-                content=file_content,
-                headers=headers,
-                timeout=60.0
-            )
-            upload_resp.raise_for_status()
-            
-            # The handle is in the 'h' field of the response
-            return upload_resp.json().get("h")
+        # Step 1: Initialize
+        init_resp = await meta_client.post(
+            init_url,
+            params={
+                "file_length": file_length,
+                "file_type": mime_type
+            },
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        init_resp.raise_for_status()
+        session_id = init_resp.json().get("id")
+        
+        # Step 2: Upload Content
+        upload_url = f"{base_url}/{session_id}"
+        
+        # Headers for upload
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "file_offset": "0"
+        }
+        
+        upload_resp = await meta_client.post(
+            upload_url,
+            content=file_content,
+            headers=headers,
+            kind="upload"
+        )
+        upload_resp.raise_for_status()
+        
+        # The handle is in the 'h' field of the response
+        return upload_resp.json().get("h")
             
     except Exception as e:
         logger.error(f"Error in createMediaHandle: {e}")
@@ -93,18 +92,17 @@ async def create_media_id(secrets, file_content, file_name, mime_type):
              "type": mime_type
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                files=files,
-                data=data,
-                headers={
-                    "Authorization": f"Bearer {token}"
-                },
-                timeout=60.0
-            )
-            response.raise_for_status()
-            return response.json().get("id")
+        response = await meta_client.post(
+            url,
+            files=files,
+            data=data,
+            headers={
+                "Authorization": f"Bearer {token}"
+            },
+            kind="upload"
+        )
+        response.raise_for_status()
+        return response.json().get("id")
             
     except Exception as e:
         logger.error(f"Error in createMediaId: {e}")
@@ -123,17 +121,16 @@ async def get_whatsapp_business_profile(client_id):
         "fields": "about,address,description,email,profile_picture_url,websites,vertical"
     }
     
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            url,
-            params=params,
-            headers={
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json"
-            }
-        )
-        data = response.json()
-        return data.get("data", [{}])[0]
+    response = await meta_client.get(
+        url,
+        params=params,
+        headers={
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json"
+        }
+    )
+    data = response.json()
+    return data.get("data", [{}])[0]
 
 async def update_whatsapp_business_profile(client_id, payload):
     secrets = await get_secrets(client_id)
@@ -147,16 +144,15 @@ async def update_whatsapp_business_profile(client_id, payload):
     
     payload["messaging_product"] = "whatsapp"
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            url,
-            json=payload,
-             headers={
-                "Authorization": f"Bearer {token}",
-                 "Content-Type": "application/json"
-            }
-        )
-        return response.json()
+    response = await meta_client.post(
+        url,
+        json=payload,
+        headers={
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json"
+        }
+    )
+    return response.json()
 
 async def create_meta_template(client_id, template_data):
     try:
@@ -315,16 +311,15 @@ async def create_meta_template(client_id, template_data):
             "components": components
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{base_url}/{secrets['wabaId']}/message_templates",
-                json=final_payload,
-                headers={
-                    "Authorization": f"Bearer {token}",
-                    "Content-Type": "application/json"
-                }
-            )
-            return response.json()
+        response = await meta_client.post(
+            f"{base_url}/{secrets['wabaId']}/message_templates",
+            json=final_payload,
+            headers={
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json"
+            }
+        )
+        return response.json()
     except Exception as e:
         logger.error(f"Error in create_meta_template: {e}")
         return {"error": str(e)}
@@ -349,19 +344,18 @@ async def get_meta_templates(client_id, limit=None, after=None, before=None, sta
         if language: params["language"] = language
         if fields: params["fields"] = fields
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{base_url}/{secrets['wabaId']}/message_templates",
-                params=params,
-                headers={
-                    "Authorization": f"Bearer {token}",
-                    "Content-Type": "application/json"
-                }
-            )
-            data = response.json()
-            if "error" in data:
-                logger.error(f"Meta API error in get_meta_templates: {data['error']}")
-            return data
+        response = await meta_client.get(
+            f"{base_url}/{secrets['wabaId']}/message_templates",
+            params=params,
+            headers={
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json"
+            }
+        )
+        data = response.json()
+        if "error" in data:
+            logger.error(f"Meta API error in get_meta_templates: {data['error']}")
+        return data
     except Exception as e:
         logger.error(f"Error in get_meta_templates: {e}")
         return {"error": str(e), "success": False}
@@ -375,15 +369,14 @@ async def delete_meta_template(client_id, name):
     import urllib.parse
     encoded_name = urllib.parse.quote(name)
     
-    async with httpx.AsyncClient() as client:
-        response = await client.delete(
-            f"{base_url}/{secrets['wabaId']}/message_templates?name={encoded_name}",
-            headers={
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json"
-            }
-        )
-        return response.json()
+    response = await meta_client.delete(
+        f"{base_url}/{secrets['wabaId']}/message_templates?name={encoded_name}",
+        headers={
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json"
+        }
+    )
+    return response.json()
 
 async def send_template_message(
     client_id: str,
@@ -479,17 +472,17 @@ async def send_template_message(
             
         url = f"{base_url}/{secrets['phoneNumberId']}/messages"
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                json=payload,
-                headers={
-                    "Authorization": f"Bearer {token}",
-                    "Content-Type": "application/json"
-                }
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await send_limiter.post(
+            secrets['phoneNumberId'],
+            url,
+            json=payload,
+            headers={
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json"
+            }
+        )
+        response.raise_for_status()
+        return response.json()
             
     except Exception as e:
         logger.error(f"Error in send_template_message: {e}")
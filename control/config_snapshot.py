@@ -0,0 +1,91 @@
+import logging
+import asyncio
+import hashlib
+import json
+import os
+import time
+from app.database import AsyncSessionLocal
+from app.services.pg_notify import pg_notify
+from sqlalchemy.future import select
+from .models import AppConfig
+
+logger = logging.getLogger(__name__)
+
+# In-memory copy of the single app_configs row.
+# The maintenance middleware and /app-status read it instead of querying per request.
+# It is reloaded every APP_CONFIG_REFRESH_INTERVAL seconds, replaced immediately by the
+# toggle endpoints, and (with PG_NOTIFY_ENABLED) reloaded by every other worker on NOTIFY.
+APP_CONFIG_REFRESH_INTERVAL = float(os.getenv("APP_CONFIG_REFRESH_INTERVAL", "5"))  # seconds
+APP_STATUS_MAX_AGE = int(os.getenv("APP_STATUS_MAX_AGE", "5"))  # Cache-Control max-age for /app-status
+APP_CONFIG_NOTIFY_CHANNEL = "app_config_changed"
+
+DEFAULT_CONFIG = {"maintenance_mode": False, "allow_log_store": True}
+
+
+class AppConfigSnapshot:
+    def __init__(self):
+        self.values = dict(DEFAULT_CONFIG)
+        self.etag = None
+        self.loaded_at = None
+        self._task = None
+
+    def _apply(self, config):
+        self.values = {
+            "maintenance_mode": bool(config.maintenance_mode),
+            "allow_log_store": bool(config.allow_log_store),
+        }
+        digest = hashlib.sha1(json.dumps(self.values, sort_keys=True).encode()).hexdigest()[:16]
+        self.etag = f'"{digest}"'
+        self.loaded_at = time.monotonic()
+
+    async def refresh(self):
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(select(AppConfig).limit(1))
+            config = result.scalars().first()
+            if not config:
+                # Initialize default config if it doesn't exist
+                config = AppConfig(**DEFAULT_CONFIG)
+                session.add(config)
+                await session.commit()
+        self._apply(config)
+
+    async def current(self):
+        """Returns the snapshot dict, loading it on first use (or when no refresh loop is running)."""
+        stale = self.loaded_at is None or (
+            self._task is None and time.monotonic() - self.loaded_at > APP_CONFIG_REFRESH_INTERVAL
+        )
+        if stale:
+            await self.refresh()
+        return self.values
+
+    async def publish(self, config):
+        """Called after a toggle commits: update this worker now and tell the others."""
+        self._apply(config)
+        await pg_notify.publish(APP_CONFIG_NOTIFY_CHANNEL)
+
+    def handle_notification(self, payload: str):
+        asyncio.create_task(self._refresh_quietly())
+
+    async def _refresh_quietly(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.error(f"App config refresh error: {e}")
+
+    async def _run(self):
+        while True:
+            await self._refresh_quietly()
+            await asyncio.sleep(APP_CONFIG_REFRESH_INTERVAL)
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+app_config = AppConfigSnapshot()
+pg_notify.subscribe(APP_CONFIG_NOTIFY_CHANNEL, app_config.handle_notification)
@@ -1,6 +1,8 @@
 from fastapi import FastAPI
 from .database import engine, Base
 from .routes import router
+from .config_snapshot import app_config
+from app.services.pg_notify import pg_notify
 import uvicorn
 
 app = FastAPI(title="BW Backend Control API")
@@ -13,6 +15,13 @@ async def startup():
     # Create tables automatically on startup
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    app_config.start()
+    pg_notify.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await pg_notify.stop()
+    await app_config.stop()
 
 @app.get("/")
 async def root():
@@ -12,9 +12,11 @@ class AppConfig(Base):
 
 class AppLog(Base):
     __tablename__ = "app_logs"
+    # Monthly range partitions, managed by app.services.log_partitions
+    __table_args__ = {"postgresql_partition_by": "RANGE (created_at)"}
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     user_id = Column(String, index=True)
     device_info = Column(String)
     message = Column(String)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, primary_key=True, default=datetime.utcnow)  # Partition key must be part of the PK
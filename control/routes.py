@@ -1,10 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, Header, status
+from fastapi import APIRouter, Depends, HTTPException, Header, status, Request, Response
+from fastapi.responses import JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from app.database import get_db
 
 from .models import AppConfig, AppLog
 from .schemas import AppStatusResponse, ToggleStatusRequest, LogCreateRequest, LogResponse
+from .config_snapshot import app_config, APP_STATUS_MAX_AGE
 import os
 from dotenv import load_dotenv
 
@@ -34,15 +36,20 @@ async def get_config(db: AsyncSession):
     return config
 
 @router.get("/app-status", response_model=AppStatusResponse)
-async def get_app_status(db: AsyncSession = Depends(get_db)):
-    config = await get_config(db)
-    return config
+async def get_app_status(request: Request):
+    # Served from the in-memory snapshot; clients polling with If-None-Match get a 304
+    values = await app_config.current()
+    headers = {"ETag": app_config.etag, "Cache-Control": f"max-age={APP_STATUS_MAX_AGE}"}
+    if request.headers.get("if-none-match") == app_config.etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=values, headers=headers)
 
 @router.post("/admin/toggle-maintenance", dependencies=[Depends(verify_api_key)])
 async def toggle_maintenance(request: ToggleStatusRequest, db: AsyncSession = Depends(get_db)):
     config = await get_config(db)
     config.maintenance_mode = request.status
     await db.commit()
+    await app_config.publish(config)
     return {"message": f"Maintenance mode set to {request.status}"}
 
 @router.post("/admin/toggle-log-store", dependencies=[Depends(verify_api_key)])
@@ -50,13 +57,14 @@ async def toggle_log_store(request: ToggleStatusRequest, db: AsyncSession = Depe
     config = await get_config(db)
     config.allow_log_store = request.status
     await db.commit()
+    await app_config.publish(config)
     return {"message": f"Log store allowed set to {request.status}"}
 
 @router.post("/store-log", response_model=LogResponse, dependencies=[Depends(verify_api_key)])
 async def store_log(log_data: LogCreateRequest, db: AsyncSession = Depends(get_db)):
-    config = await get_config(db)
+    config = await app_config.current()
     
-    if not config.allow_log_store:
+    if not config["allow_log_store"]:
         return {"success": False, "message": "Log storing is currently disabled"}
     
     new_log = AppLog(
@@ -0,0 +1,387 @@
+from fastapi import FastAPI, Request, Response, Body
+from fastapi.responses import JSONResponse
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+import random
+import time
+import uuid
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Stand-in for the subset of the Graph API this backend calls, for benchmarks and
+# offline testing. Point the backend at it with BASE_URL=http://localhost:9000/v21.0
+# (or META_STUB_IN_PROCESS=true to route meta_client through this app without a socket).
+# Latency, error and throttle behaviour come from the env vars below and can be
+# changed at runtime with POST /_stub/config. With META_STUB_WEBHOOK_URL set, sent
+# messages produce status webhooks and new templates get approved via webhook.
+#
+#   python -m meta_stub.main
+#   curl -X POST localhost:9000/_stub/config -d '{"error_rate": 0.05}'
+config = {
+    "latency_ms": float(os.getenv("META_STUB_LATENCY_MS", "50")),
+    "jitter_ms": float(os.getenv("META_STUB_JITTER_MS", "20")),
+    "error_rate": float(os.getenv("META_STUB_ERROR_RATE", "0")),        # fraction answered with 500
+    "throttle_rate": float(os.getenv("META_STUB_THROTTLE_RATE", "0")),  # fraction of sends answered with 429
+    "messages_per_second": float(os.getenv("META_STUB_MPS", "80")),     # per phone number, 0 = unlimited
+    "retry_after": int(os.getenv("META_STUB_RETRY_AFTER", "1")),
+    "webhook_url": os.getenv("META_STUB_WEBHOOK_URL"),                 # e.g. http://localhost:8000/webhook
+    "statuses": os.getenv("META_STUB_STATUSES", "sent,delivered,read").split(","),
+    "status_delay_ms": float(os.getenv("META_STUB_STATUS_DELAY_MS", "200")),
+    "media_bytes": int(os.getenv("META_STUB_MEDIA_BYTES", "50000")),
+    "templates_per_waba": int(os.getenv("META_STUB_TEMPLATES", "30")),
+}
+
+stats = {
+    "requests": 0,
+    "messages": 0,
+    "throttled": 0,
+    "errors": 0,
+    "mediaUploads": 0,
+    "mediaDownloads": 0,
+    "webhooksSent": 0,
+    "webhooksFailed": 0,
+}
+
+media = {}      # media_id -> (bytes, mime_type)
+templates = {}  # waba_id -> [template dict]
+buckets = {}    # phone_id -> (tokens, updated)
+webhook_tasks = set()
+webhook_client = None
+
+app = FastAPI(title="Meta Graph API Stub")
+
+def graph_error(status_code, code, message, headers=None):
+    return JSONResponse(
+        status_code=status_code,
+        content={"error": {"message": message, "type": "OAuthException", "code": code, "fbtrace_id": uuid.uuid4().hex}},
+        headers=headers
+    )
+
+@app.middleware("http")
+async def simulate_network(request: Request, call_next):
+    if request.url.path.startswith("/_stub"):
+        return await call_next(request)
+    stats["requests"] += 1
+    delay = config["latency_ms"] + random.uniform(-config["jitter_ms"], config["jitter_ms"])
+    if delay > 0:
+        await asyncio.sleep(delay / 1000)
+    if config["error_rate"] and random.random() < config["error_rate"]:
+        stats["errors"] += 1
+        return graph_error(500, 2, "Service temporarily unavailable")
+    return await call_next(request)
+
+def take_token(phone_id):
+    rate = config["messages_per_second"]
+    if not rate:
+        return True
+    now = time.monotonic()
+    tokens, updated = buckets.get(phone_id, (rate, now))
+    tokens = min(rate, tokens + (now - updated) * rate)
+    if tokens < 1:
+        buckets[phone_id] = (tokens, now)
+        return False
+    buckets[phone_id] = (tokens - 1, now)
+    return True
+
+# Stub control (registered first: the Graph routes below have catch-all paths)
+
+@app.get("/_stub/stats")
+async def get_stats():
+    return {"config": config, **stats, "pendingWebhooks": len(webhook_tasks)}
+
+@app.post("/_stub/config")
+async def update_config(changes: dict = Body(...)):
+    unknown = [key for key in changes if key not in config]
+    if unknown:
+        return JSONResponse(status_code=400, content={"unknown": unknown})
+    config.update(changes)
+    buckets.clear()
+    return config
+
+@app.post("/_stub/reset")
+async def reset():
+    for key in stats:
+        stats[key] = 0
+    media.clear()
+    templates.clear()
+    buckets.clear()
+    return {"success": True}
+
+@app.get("/_stub/media/{media_id}")
+async def download_media(media_id: str):
+    # Signed CDN URL handed out by GET /{media_id}
+    stats["mediaDownloads"] += 1
+    if media_id in media:
+        content, mime_type = media[media_id]
+    else:
+        block = hashlib.sha256(media_id.encode()).digest()
+        content, mime_type = (block * (config["media_bytes"] // len(block) + 1))[:config["media_bytes"]], "image/jpeg"
+    return Response(content=content, media_type=mime_type)
+
+# Webhooks
+
+async def post_webhook(body):
+    global webhook_client
+    if webhook_client is None:
+        webhook_client = httpx.AsyncClient(timeout=10.0)
+    try:
+        response = await webhook_client.post(config["webhook_url"], json=body)
+        response.raise_for_status()
+        stats["webhooksSent"] += 1
+    except Exception as e:
+        stats["webhooksFailed"] += 1
+        logger.warning(f"Stub webhook to {config['webhook_url']} failed: {e}")
+
+def emit(body):
+    if not config["webhook_url"]:
+        return
+    task = asyncio.create_task(post_webhook(body))
+    webhook_tasks.add(task)
+    task.add_done_callback(webhook_tasks.discard)
+
+def webhook_body(entry_id, field, value):
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{"id": entry_id, "changes": [{"field": field, "value": value}]}]
+    }
+
+async def emit_statuses(phone_id, recipient, message_id):
+    for index, status in enumerate(config["statuses"]):
+        await asyncio.sleep(config["status_delay_ms"] / 1000)
+        status_obj = {
+            "id": message_id,
+            "status": status,
+            "timestamp": str(int(time.time())),
+            "recipient_id": recipient
+        }
+        if index == 0:
+            status_obj["conversation"] = {"id": uuid.uuid4().hex, "origin": {"type": "marketing"}}
+            status_obj["pricing"] = {"billable": True, "pricing_model": "CBP", "category": "marketing"}
+        # Awaited in turn so sent / delivered / read arrive in order
+        await post_webhook(webhook_body("stub-waba", "messages", {
+            "messaging_product": "whatsapp",
+            "metadata": {"display_phone_number": "15550000000", "phone_number_id": phone_id},
+            "statuses": [status_obj]
+        }))
+
+# Messages and media
+
+@app.post("/{version}/{phone_id}/messages")
+async def send_message(phone_id: str, payload: dict = Body(...)):
+    if payload.get("status") == "read":
+        return {"success": True}
+
+    throttled = not take_token(phone_id) or (config["throttle_rate"] and random.random() < config["throttle_rate"])
+    if throttled:
+        stats["throttled"] += 1
+        return graph_error(
+            429, 130429, "(#130429) Rate limit hit",
+            headers={"Retry-After": str(config["retry_after"])}
+        )
+
+    stats["messages"] += 1
+    recipient = payload.get("to")
+    message_id = f"wamid.stub.{uuid.uuid4().hex}"
+    if config["webhook_url"] and config["statuses"]:
+        task = asyncio.create_task(emit_statuses(phone_id, recipient, message_id))
+        webhook_tasks.add(task)
+        task.add_done_callback(webhook_tasks.discard)
+    return {
+        "messaging_product": "whatsapp",
+        "contacts": [{"input": recipient, "wa_id": recipient}],
+        "messages": [{"id": message_id}]
+    }
+
+@app.post("/{version}/{phone_id}/media")
+async def upload_media(request: Request):
+    form = await request.form()
+    upload = form.get("file")
+    content = await upload.read() if upload else b""
+    media_id = str(random.randint(10**15, 10**16 - 1))
+    media[media_id] = (content, form.get("type") or "application/octet-stream")
+    stats["mediaUploads"] += 1
+    return {"id": media_id}
+
+# Resumable upload (template media handles)
+
+@app.get("/{version}/debug_token")
+async def debug_token(input_token: str = None):
+    return {"data": {"app_id": "stub-app", "is_valid": True, "scopes": ["whatsapp_business_messaging"]}}
+
+@app.post("/{version}/{app_id}/uploads")
+async def start_upload(app_id: str):
+    return {"id": f"upload:{uuid.uuid4().hex}"}
+
+# Templates
+
+def seed_templates(waba_id):
+    if waba_id not in templates:
+        formats = [None, "IMAGE", "VIDEO", "DOCUMENT", "TEXT"]
+        seeded = []
+        for i in range(config["templates_per_waba"]):
+            components = []
+            header = formats[i % len(formats)]
+            if header == "TEXT":
+                components.append({"type": "HEADER", "format": "TEXT", "text": "Hello {{1}}"})
+            elif header:
+                components.append({"type": "HEADER", "format": header, "example": {"header_handle": ["stub-handle"]}})
+            components.append({"type": "BODY", "text": f"Stub template {i} for {{{{1}}}}", "example": {"body_text": [["there"]]}})
+            seeded.append({
+                "id": str(10**15 + int(hashlib.sha1(f"{waba_id}:{i}".encode()).hexdigest(), 16) % 10**15),
+                "name": f"stub_template_{i:03d}",
+                "status": "APPROVED" if i % 7 else "REJECTED",
+                "category": "MARKETING" if i % 3 else "UTILITY",
+                "language": "en",
+                "components": components
+            })
+        templates[waba_id] = seeded
+    return templates[waba_id]
+
+def encode_offset(offset):
+    return base64.urlsafe_b64encode(str(offset).encode()).decode()
+
+@app.get("/{version}/{waba_id}/message_templates")
+async def list_templates(
+    request: Request, waba_id: str, limit: int = 25, after: str = None, before: str = None,
+    status: str = None, category: str = None, language: str = None, fields: str = None
+):
+    rows = seed_templates(waba_id)
+    if status:
+        rows = [t for t in rows if t["status"] == status.upper()]
+    if category:
+        rows = [t for t in rows if t["category"] == category.upper()]
+    if language:
+        rows = [t for t in rows if t["language"] == language]
+
+    start = int(base64.urlsafe_b64decode(after).decode()) if after else 0
+    if before and not after:
+        start = max(0, int(base64.urlsafe_b64decode(before).decode()) - limit)
+    page = rows[start:start + limit]
+    if fields:
+        wanted = set(fields.split(",")) | {"id"}
+        page = [{key: value for key, value in t.items() if key in wanted} for t in page]
+
+    result = {"data": page}
+    if page:
+        result["paging"] = {"cursors": {"before": encode_offset(start), "after": encode_offset(start + len(page))}}
+        if start + len(page) < len(rows):
+            result["paging"]["next"] = str(request.url.include_query_params(after=encode_offset(start + len(page))))
+    return result
+
+@app.post("/{version}/{waba_id}/message_templates")
+async def create_template(waba_id: str, payload: dict = Body(...)):
+    rows = seed_templates(waba_id)
+    template_id = str(random.randint(10**15, 10**16 - 1))
+    rows.append({
+        "id": template_id,
+        "name": payload.get("name"),
+        "status": "PENDING",
+        "category": payload.get("category"),
+        "language": payload.get("language"),
+        "components": payload.get("components", [])
+    })
+    # Approve it a moment later, the way Meta review does
+    async def approve():
+        await asyncio.sleep(config["status_delay_ms"] / 1000)
+        for t in rows:
+            if t["id"] == template_id:
+                t["status"] = "APPROVED"
+        emit(webhook_body(waba_id, "message_template_status_update", {
+            "event": "APPROVED",
+            "message_template_id": int(template_id),
+            "message_template_name": payload.get("name"),
+            "message_template_language": payload.get("language"),
+            "message_template_category": payload.get("category"),
+            "reason": None
+        }))
+    task = asyncio.create_task(approve())
+    webhook_tasks.add(task)
+    task.add_done_callback(webhook_tasks.discard)
+    return {"id": template_id, "status": "PENDING", "category": payload.get("category")}
+
+@app.delete("/{version}/{waba_id}/message_templates")
+async def delete_template(waba_id: str, name: str):
+    rows = seed_templates(waba_id)
+    remaining = [t for t in rows if t["name"] != name]
+    if len(remaining) == len(rows):
+        return graph_error(400, 100, f"Template {name} not found")
+    templates[waba_id] = remaining
+    return {"success": True}
+
+# Business profile
+
+@app.get("/{version}/{phone_id}/whatsapp_business_profile")
+async def get_profile(phone_id: str):
+    return {"data": [{
+        "about": "Stub business",
+        "address": "",
+        "description": "Meta Graph API stub",
+        "email": "stub@example.com",
+        "profile_picture_url": "",
+        "websites": [],
+        "vertical": "OTHER",
+        "messaging_product": "whatsapp"
+    }]}
+
+@app.post("/{version}/{phone_id}/whatsapp_business_profile")
+async def update_profile(phone_id: str):
+    return {"success": True}
+
+# Single-object reads and upload sessions
+
+def analytics_points(query):
+    now = int(time.time())
+    if "conversation_analytics" in query:
+        points = []
+        for category in ("MARKETING", "UTILITY", "SERVICE"):
+            points.append({
+                "start": now - 86400, "end": now,
+                "conversation": random.randint(10, 500),
+                "conversation_type": "REGULAR",
+                "conversation_direction": "BUSINESS_INITIATED",
+                "conversation_category": category,
+                "cost": round(random.uniform(1, 100), 2)
+            })
+        return {"conversation_analytics": {"data": [{"data_points": points}]}}
+    sent = random.randint(100, 1000)
+    return {"analytics": {"data_points": [{"start": now - 86400, "end": now, "sent": sent, "delivered": int(sent * 0.95)}]}}
+
+@app.get("/{version}/{object_id}")
+async def get_object(request: Request, object_id: str):
+    query = request.url.query
+    if "analytics" in query:
+        return {**analytics_points(query), "id": object_id}
+    # Anything else is treated as a media id
+    content, mime_type = media.get(object_id) or (None, "image/jpeg")
+    size = len(content) if content is not None else config["media_bytes"]
+    return {
+        "messaging_product": "whatsapp",
+        "url": str(request.base_url).rstrip("/") + f"/_stub/media/{object_id}",
+        "mime_type": mime_type,
+        "sha256": hashlib.sha256(object_id.encode()).hexdigest(),
+        "file_size": size,
+        "id": object_id
+    }
+
+@app.post("/{version}/{session_id}")
+async def upload_chunk(session_id: str, request: Request):
+    if not session_id.startswith("upload:"):
+        return graph_error(400, 100, "Unsupported post request")
+    content = await request.body()
+    stats["mediaUploads"] += 1
+    return {"h": f"stub-handle:{hashlib.sha256(content).hexdigest()[:24]}"}
+
+@app.on_event("shutdown")
+async def shutdown():
+    for task in list(webhook_tasks):
+        task.cancel()
+    if webhook_client:
+        await webhook_client.aclose()
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("meta_stub.main:app", host="0.0.0.0", port=int(os.getenv("META_STUB_PORT", "9000")))